@@ -0,0 +1,403 @@
+"""Shared pieces of the offline pipeline benchmark: stage timing and in-process stand-ins.
+
+Each service runs in its own process (their module names overlap, as in their
+containers), so stand-ins are installed by patching the client classes before
+the service modules are imported.
+"""
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def use_service(name):
+    """Make a service directory (and the shared common package) importable and current.
+
+    The service directory is made current because streaming opens its schema by relative path.
+    """
+    path = os.path.join(ROOT, name)
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, path)
+    os.chdir(path)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class Stage:
+    """Latency of every call of one stage plus the number of records it handled"""
+
+    def __init__(self, name, unit, trace_memory=False):
+        self.name = name
+        self.unit = unit
+        self.trace_memory = trace_memory
+        self.latencies = []
+        self.records = 0
+        self.seconds = 0.0
+        # Set for stages whose calls overlap (concurrent fetches); throughput then uses wall time
+        self.wall_seconds = None
+        self.peak_traced = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, records=1):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(time.perf_counter() - start, records)
+            if self.trace_memory:
+                self.peak_traced = max(self.peak_traced, tracemalloc.get_traced_memory()[1])
+
+    def add(self, seconds, records=1):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.seconds += seconds
+            self.records += records
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        seconds = self.wall_seconds if self.wall_seconds is not None else self.seconds
+        result = {
+            "unit": self.unit,
+            "records": self.records,
+            "calls": len(latencies),
+            "seconds": round(seconds, 4),
+            "records_per_sec": round(self.records / seconds, 1) if seconds else None,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        }
+        if self.trace_memory:
+            result["peak_traced_mb"] = round(self.peak_traced / 2**20, 2)
+        return result
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def write_result(path, service, stages, **extra):
+    with open(path, "w") as f:
+        json.dump({"service": service, "stages": {s.name: s.summary() for s in stages},
+                   "peak_rss_mb": peak_rss_mb(), **extra}, f, indent=2)
+
+
+class _BulkWriteResult:
+    def __init__(self, upserted, matched, modified):
+        self.upserted_count = upserted
+        self.matched_count = matched
+        self.modified_count = modified
+
+
+class InMemoryCollection:
+    """The subset of a pymongo Collection the services call, kept in dicts.
+
+    Unique indexes are hash lookups and documents are bucketed by city, so
+    upserts and per-city range reads stay O(1)/O(city) as the data grows.
+    Supports equality and $gt/$gte/$lt/$lte filters and the $set, $setOnInsert,
+    $max and $addToSet update operators. Documents are stored under a hashable
+    form of their _id, which may be an embedded document.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.docs = {}
+        self.unique = {}  # index fields -> {key tuple: stored _id}
+        self.by_city = {}
+        self.lock = threading.RLock()
+
+    def create_index(self, keys, unique=False, **kwargs):
+        if unique:
+            fields = tuple(field for field, _ in keys)
+            with self.lock:
+                self.unique.setdefault(fields, {
+                    tuple(doc.get(f) for f in fields): _id for _id, doc in self.docs.items()
+                })
+        return kwargs.get("name")
+
+    @staticmethod
+    def _stored_id(_id):
+        return tuple(_id.items()) if isinstance(_id, dict) else _id
+
+    def _store(self, doc):
+        _id = self._stored_id(doc["_id"])
+        self.docs[_id] = doc
+        for fields, index in self.unique.items():
+            index[tuple(doc.get(f) for f in fields)] = _id
+        if "city" in doc:
+            self.by_city.setdefault(doc["city"], set()).add(_id)
+
+    def _lookup(self, query):
+        """Stored _id of the document matching an equality filter on _id or a unique index, or None"""
+        if "_id" in query:
+            _id = self._stored_id(query["_id"])
+            return _id if _id in self.docs else None
+        for fields, index in self.unique.items():
+            if set(fields) == set(query):
+                return index.get(tuple(query[f] for f in fields))
+        return False  # no index covers the filter
+
+    @staticmethod
+    def _matches(doc, query):
+        for field, condition in query.items():
+            value = doc.get(field)
+            if isinstance(condition, dict):
+                for op, operand in condition.items():
+                    if value is None or not {"$gt": value > operand, "$gte": value >= operand,
+                                             "$lt": value < operand, "$lte": value <= operand}[op]:
+                        return False
+            elif value != condition:
+                return False
+        return True
+
+    @staticmethod
+    def _project(doc, projection):
+        if not projection:
+            return dict(doc)
+        included = {f for f, v in projection.items() if v}
+        result = {f: doc[f] for f in included if f in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+
+    @staticmethod
+    def _apply(doc, update, inserting=False):
+        changed = False
+        for op, fields in update.items():
+            if op == "$setOnInsert" and not inserting:
+                continue
+            for field, value in fields.items():
+                current = doc.get(field)
+                if op in ("$set", "$setOnInsert"):
+                    new = value
+                elif op == "$max":
+                    new = value if current is None or value > current else current
+                elif op == "$addToSet":
+                    items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                    new = list(current or []) + [i for i in items if i not in (current or [])]
+                else:
+                    raise NotImplementedError(op)
+                if new != current or field not in doc:
+                    doc[field] = new
+                    changed = True
+        return changed
+
+    def update_one(self, query, update, upsert=False):
+        with self.lock:
+            _id = self._lookup(query)
+            if _id is False:
+                _id = next((self._stored_id(doc["_id"]) for doc in self._scan(query)), None)
+            if _id is not None:
+                return self._apply(self.docs[_id], update), False
+            if not upsert:
+                return False, False
+            from bson import ObjectId
+            doc = {"_id": ObjectId(), **{k: v for k, v in query.items() if not isinstance(v, dict)}}
+            self._apply(doc, update, inserting=True)
+            self._store(doc)
+            return True, True
+
+    def bulk_write(self, operations, ordered=True):
+        upserted = matched = modified = 0
+        for op in operations:
+            changed, inserted = self.update_one(op._filter, op._doc, op._upsert)
+            if inserted:
+                upserted += 1
+            else:
+                matched += 1
+                modified += int(changed)
+        return _BulkWriteResult(upserted, matched, modified)
+
+    def insert_one(self, doc):
+        self.insert_many([doc])
+
+    def insert_many(self, docs, ordered=True):
+        from bson import ObjectId
+        with self.lock:
+            for doc in docs:
+                doc.setdefault("_id", ObjectId())
+                self._store(doc)
+
+    def _scan(self, query):
+        if "city" in query and not isinstance(query["city"], dict):
+            candidates = (self.docs[_id] for _id in self.by_city.get(query["city"], ()))
+        else:
+            candidates = self.docs.values()
+        return [doc for doc in candidates if self._matches(doc, query)]
+
+    def find(self, query=None, projection=None, **kwargs):
+        query = query or {}
+        with self.lock:
+            return [self._project(doc, projection) for doc in self._scan(query)]
+
+    def find_one(self, query=None, projection=None):
+        query = query or {}
+        with self.lock:
+            _id = self._lookup(query)
+            if _id is False:
+                found = self._scan(query)
+                return self._project(found[0], projection) if found else None
+            return self._project(self.docs[_id], projection) if _id is not None else None
+
+
+class InMemoryMongoClient:
+    """pymongo.MongoClient stand-in handing out InMemoryCollections"""
+
+    def __init__(self, *args, **kwargs):
+        self.databases = {}
+
+    def __getitem__(self, db_name):
+        return self.databases.setdefault(db_name, _InMemoryDatabase())
+
+
+class _InMemoryDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, InMemoryCollection(name))
+
+    def list_collection_names(self):
+        return list(self.collections)
+
+
+class InMemoryRegistry:
+    """The subset of SchemaRegistryClient the encoder and decoder call.
+
+    IDs are assigned in registration order, so the streaming and storage
+    processes agree on the ID of the one schema they share.
+    """
+
+    def __init__(self):
+        self.schemas = {}
+
+    def register_schema(self, subject_name, schema, normalize_schemas=False):
+        canonical = json.dumps(json.loads(schema.schema_str), sort_keys=True)
+        return self.schemas.setdefault(canonical, len(self.schemas) + 1)
+
+    def get_schema(self, schema_id):
+        from confluent_kafka.schema_registry import Schema
+        return next(Schema(s, "AVRO") for s, i in self.schemas.items() if i == schema_id)
+
+
+class InMemoryMessage:
+    """A produced or consumed Kafka message"""
+
+    def __init__(self, topic, key, value, timestamp_ms, partition=0, offset=0):
+        self._topic = topic
+        self._key = key
+        self._value = value
+        self._timestamp = timestamp_ms
+        self._partition = partition
+        self._offset = offset
+
+    def topic(self):
+        return self._topic
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def timestamp(self):
+        from confluent_kafka import TIMESTAMP_CREATE_TIME
+        return TIMESTAMP_CREATE_TIME, self._timestamp
+
+    def latency(self):
+        return 0.0
+
+    def error(self):
+        return None
+
+
+class InMemoryProducer:
+    """confluent_kafka.Producer stand-in: keeps every message and acknowledges it on poll/flush"""
+
+    def __init__(self, conf=None):
+        self.conf = conf or {}
+        self.messages = []
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def produce(self, topic, value=None, key=None, on_delivery=None, headers=None, **kwargs):
+        msg = InMemoryMessage(topic, key, value, int(time.time() * 1000))
+        with self.lock:
+            self.messages.append(msg)
+            self.pending.append((msg, on_delivery))
+
+    def poll(self, timeout=None):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for msg, on_delivery in pending:
+            if on_delivery is not None:
+                on_delivery(None, msg)
+        return len(pending)
+
+    def flush(self, timeout=None):
+        self.poll()
+        return 0
+
+    def __len__(self):
+        return len(self.pending)
+
+
+class InMemoryCassandra:
+    """Replaces cassandra.concurrent.execute_concurrent for the write path.
+
+    Statements are bound by the real driver (BatchStatement.add binds when the
+    batch is built, plain statements are bound here), so serialization is still
+    measured; only the network round trip is skipped.
+    """
+
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+
+    def execute_concurrent(self, session, statements_and_params, concurrency=100, raise_on_first_error=True):
+        results = []
+        for statement, params in statements_and_params:
+            if params:
+                statement.bind(params)
+                self.rows += 1
+            else:
+                self.rows += len(statement)
+            self.statements += 1
+            results.append((True, []))
+        return results
+
+
+def insert_statement():
+    """PreparedStatement shaped like repository.init()'s insert, built without a cluster"""
+    from collections import namedtuple
+    from cassandra import cqltypes
+    from cassandra.query import PreparedStatement
+
+    column = namedtuple("ColumnMetadata", "keyspace_name table_name name type")
+    columns = [("city", cqltypes.UTF8Type), ("date", cqltypes.UTF8Type), ("hour", cqltypes.Int32Type)]
+    columns += [(p, cqltypes.FloatType) for p in
+                ("pm2_5", "pm10", "ozone", "carbon_monoxide", "nitrogen_dioxide", "sulphur_dioxide", "uv_index")]
+    columns += [("ingest_time", cqltypes.DateType), ("[timestamp]", cqltypes.LongType)]
+    metadata = [column("air_quality_keyspace", "air_quality_by_city_date", name, kind) for name, kind in columns]
+    return PreparedStatement(metadata, b"bench", [0, 1], "INSERT INTO air_quality_by_city_date ...",
+                             "air_quality_keyspace", 4, None, None)
@@ -0,0 +1,93 @@
+"""Local stand-in for the Open-Meteo air-quality API.
+
+Answers /v1/air-quality with `hours` hourly values per requested location.
+Values are deterministic per location, and about `invalid_rate` of the cells
+are null or out of range so validation has work to do. Several comma-separated
+coordinates return a list, like the real API.
+
+Usage: python mock_open_meteo.py [--port 8090] [--hours 120] [--invalid-rate 0.02]
+Point the ingestion service at it by patching config.API_TEMPLATE to
+http://127.0.0.1:8090/v1/air-quality?latitude={}&longitude={}&hourly=...
+"""
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from urllib.parse import parse_qs, urlparse
+
+POLLUTANTS = ["pm2_5", "pm10", "ozone", "carbon_monoxide", "nitrogen_dioxide", "sulphur_dioxide", "uv_index"]
+RANGES = {"pm2_5": 150, "pm10": 250, "ozone": 200, "carbon_monoxide": 2000, "nitrogen_dioxide": 150,
+          "sulphur_dioxide": 80, "uv_index": 12}
+START = datetime(2024, 1, 1)
+
+
+def location_payload(lat, lon, hours, invalid_rate):
+    rng = random.Random(f"{lat},{lon}")
+    times = [(START + timedelta(hours=h)).strftime("%Y-%m-%dT%H:%M") for h in range(hours)]
+    hourly = {"time": times}
+    for pollutant in POLLUTANTS:
+        column = []
+        for _ in range(hours):
+            roll = rng.random()
+            if roll < invalid_rate / 2:
+                column.append(None)
+            elif roll < invalid_rate:
+                column.append(-1.0)
+            else:
+                column.append(round(rng.uniform(0, RANGES[pollutant]), 1))
+        hourly[pollutant] = column
+    return {
+        "latitude": lat,
+        "longitude": lon,
+        "timezone": "Africa/Nairobi",
+        "hourly_units": {"time": "iso8601", **{p: "ug/m3" for p in POLLUTANTS}},
+        "hourly": hourly,
+    }
+
+
+def make_handler(hours, invalid_rate):
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive, so the pooled client reuses connections as it would against the real API
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path != "/v1/air-quality" or "latitude" not in query or "longitude" not in query:
+                self.send_error(404)
+                return
+            lats = query["latitude"][0].split(",")
+            lons = query["longitude"][0].split(",")
+            payloads = [location_payload(float(lat), float(lon), hours, invalid_rate) for lat, lon in zip(lats, lons)]
+            body = json.dumps(payloads[0] if len(payloads) == 1 else payloads).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_server(hours, invalid_rate=0.02, port=0):
+    """Serve from a daemon thread; returns (server, base URL)"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(hours, invalid_rate))
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name="mock-open-meteo", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a mock Open-Meteo air-quality API")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--hours", type=int, default=120)
+    parser.add_argument("--invalid-rate", type=float, default=0.02)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(("0.0.0.0", args.port), make_handler(args.hours, args.invalid_rate))
+    print(f"Mock Open-Meteo API on http://0.0.0.0:{args.port}/v1/air-quality ({args.hours} hours per location)")
+    server.serve_forever()
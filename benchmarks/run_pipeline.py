@@ -0,0 +1,156 @@
+"""Offline end-to-end benchmark of the pipeline: fetch -> validate -> upsert ->
+change stream -> produce -> consume -> insert.
+
+Starts the mock Open-Meteo API, then runs each service's stages in its own
+process with in-memory stand-ins for Mongo, Kafka, the schema registry and the
+Cassandra round trip (see harness.py). Each stage hands its output to the next
+through files in --workdir. Reports records/sec, p50/p99 latency per call and
+peak RSS per service, and writes them as JSON so runs on different commits can
+be compared.
+
+Usage: python run_pipeline.py [--cities 100] [--hours 120] [--output bench.json] [--compare previous.json]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from harness import ROOT
+from mock_open_meteo import start_server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STAGES = ["fetch", "validate", "upsert", "change_stream", "produce", "consume", "insert"]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_stage(script, workdir, env, *extra):
+    command = [sys.executable, os.path.join(HERE, script), "--workdir", workdir, *extra]
+    started = time.perf_counter()
+    subprocess.run(command, env=env, check=True)
+    return time.perf_counter() - started
+
+
+def run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pipeline-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    env = {
+        **os.environ,
+        "PYTHONPATH": HERE,
+        "HTTP_RATE_LIMIT_PER_SECOND": "0",
+        "DEAD_LETTER_ENABLED": "false",
+        "LOG_FILE": "",
+        "RESUME_TOKEN_STORE": "file",
+        "RESUME_TOKEN_FILE": os.path.join(workdir, "resume_token.json"),
+        "ROLLUPS_ENABLED": "false",
+        "STORAGE_WRITES_TOPIC": "",
+    }
+    memory = ["--trace-memory"] if args.trace_memory else []
+
+    server, api_url = start_server(args.hours, args.invalid_rate)
+    try:
+        wall = {"ingestion": run_stage("stage_ingestion.py", workdir, env, "--api-url", api_url,
+                                       "--cities", str(args.cities), *memory)}
+    finally:
+        server.shutdown()
+    wall["streaming"] = run_stage("stage_streaming.py", workdir,
+                                  {**env, "SCHEMA_CACHE_FILE": os.path.join(workdir, "streaming_schemas.json")}, *memory)
+    wall["storage"] = run_stage("stage_storage.py", workdir,
+                                {**env, "SCHEMA_CACHE_FILE": os.path.join(workdir, "storage_schemas.json")}, *memory)
+
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "cities": args.cities,
+            "hours": args.hours,
+            "invalid_rate": args.invalid_rate,
+        },
+        "stages": {},
+        "services": {},
+    }
+    for service in ["ingestion", "streaming", "storage"]:
+        with open(os.path.join(workdir, f"{service}.json"), "r") as f:
+            service_result = json.load(f)
+        result["stages"].update(service_result.pop("stages"))
+        service_result["wall_seconds"] = round(wall[service], 2)
+        result["services"][service] = service_result
+
+    # Rows that reached Cassandra per second of stage time, i.e. throughput if the stages ran back to back
+    stage_seconds = sum(result["stages"][s]["seconds"] for s in STAGES)
+    rows = result["stages"]["insert"]["records"]
+    result["end_to_end"] = {
+        "rows": rows,
+        "stage_seconds": round(stage_seconds, 4),
+        "rows_per_sec": round(rows / stage_seconds, 1) if stage_seconds else None,
+    }
+    return result
+
+
+def print_report(result, previous=None):
+    header = f"{'stage':<14}{'unit':<17}{'records':>10}{'rec/s':>12}{'p50 ms':>10}{'p99 ms':>10}"
+    if previous:
+        header += f"{'rec/s chg':>11}{'p99 chg':>10}"
+    print(header)
+    for name in STAGES:
+        stage = result["stages"][name]
+        line = (f"{name:<14}{stage['unit']:<17}{stage['records']:>10}{stage['records_per_sec'] or 0:>12.1f}"
+                f"{stage['p50_ms']:>10.3f}{stage['p99_ms']:>10.3f}")
+        before = (previous or {}).get("stages", {}).get(name)
+        if before:
+            line += f"{change(before['records_per_sec'], stage['records_per_sec']):>11}"
+            line += f"{change(before['p99_ms'], stage['p99_ms']):>10}"
+        print(line)
+    for service, summary in result["services"].items():
+        print(f"{service}: peak RSS {summary['peak_rss_mb']} MB, {summary['wall_seconds']}s wall")
+    end_to_end = result["end_to_end"]
+    print(f"end to end: {end_to_end['rows']} rows, {end_to_end['rows_per_sec']} rows/s of stage time")
+    if previous:
+        print(f"compared with {previous['meta'].get('commit')} "
+              f"({previous['meta'].get('cities')} cities x {previous['meta'].get('hours')} hours)")
+
+
+def change(before, after):
+    if not before or after is None:
+        return "-"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline end-to-end pipeline benchmark")
+    parser.add_argument("--cities", type=int, default=100)
+    parser.add_argument("--hours", type=int, default=120, help="Hourly values per city")
+    parser.add_argument("--invalid-rate", type=float, default=0.02, help="Share of null/out-of-range values")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Results JSON of an earlier run to compare with")
+    parser.add_argument("--workdir", help="Directory for the stage handoff files (default: a temp dir)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Also report the tracemalloc peak per stage (slows every stage down)")
+    args = parser.parse_args()
+
+    previous = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            previous = json.load(f)
+    try:
+        result = run(args)
+    except subprocess.CalledProcessError as e:
+        print(f"Benchmark stage failed: {' '.join(e.cmd)}", file=sys.stderr)
+        sys.exit(1)
+    print_report(result, previous)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}")
@@ -0,0 +1,80 @@
+"""Ingestion stages of the pipeline benchmark: fetch -> validate -> upsert.
+
+Fetches go over HTTP to the mock Open-Meteo API through the real pooled client;
+Mongo is the in-memory collection from harness.py. Run by run_pipeline.py in
+its own process. Writes ingestion.json (stage timings) and curated.pkl (the
+curated documents, which become the change events of the streaming stage).
+"""
+import argparse
+import os
+import pickle
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from harness import InMemoryMongoClient, Stage, use_service, write_result
+
+
+def run(args):
+    import pymongo
+    pymongo.MongoClient = InMemoryMongoClient
+
+    use_service("ingestion")
+    import config
+    config.CITIES = {f"City{i:05d}": {"lat": round(-4.5 + i * 0.001, 6), "lon": round(34.0 + i * 0.001, 6)}
+                     for i in range(args.cities)}
+    config.API_TEMPLATE = args.api_url + "/v1/air-quality?latitude={}&longitude={}&hourly=" + ",".join(
+        ["pm2_5", "pm10", "ozone", "carbon_monoxide", "nitrogen_dioxide", "sulphur_dioxide", "uv_index"])
+
+    from logger import setup_logging
+    setup_logging(level="ERROR", log_file="")
+    from fetcher import fetch_cities_air_quality, chunked
+    from validator import validate_payload
+    import storage
+
+    storage.ensure_indexes()
+    fetch = Stage("fetch", "city payloads", args.trace_memory)
+    validate = Stage("validate", "curated records", args.trace_memory)
+    upsert = Stage("upsert", "curated records", args.trace_memory)
+
+    def fetch_chunk(chunk):
+        with fetch.measure(len(chunk)):
+            return fetch_cities_air_quality(chunk)
+
+    cities = list(config.CITIES)
+    start = time.perf_counter()
+    payloads = {}
+    with ThreadPoolExecutor(max_workers=max(1, config.FETCH_CONCURRENCY)) as executor:
+        for result in executor.map(fetch_chunk, chunked(cities, config.BATCH_FETCH_SIZE)):
+            payloads.update(result)
+    fetch.wall_seconds = time.perf_counter() - start
+
+    for city in cities:
+        data = payloads[city]
+        start = time.perf_counter()
+        _, _, records, _ = validate_payload(data, city)
+        validate.add(time.perf_counter() - start, len(records))
+        with upsert.measure(len(records)):
+            storage.save_raw(city, data, buffered=config.RAW_BATCH_INSERTS)
+            storage.upsert_curated(city, records)
+    with upsert.measure(0):
+        storage.flush_raw()
+
+    target = storage.curated_wide_col if config.CURATED_LAYOUT == "wide" else storage.curated_col
+    with open(os.path.join(args.workdir, "curated.pkl"), "wb") as f:
+        pickle.dump(list(target.find({})), f, protocol=pickle.HIGHEST_PROTOCOL)
+    write_result(os.path.join(args.workdir, "ingestion.json"), "ingestion", [fetch, validate, upsert],
+                 layout=config.CURATED_LAYOUT)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingestion stages of the pipeline benchmark")
+    parser.add_argument("--workdir", required=True)
+    parser.add_argument("--api-url", required=True)
+    parser.add_argument("--cities", type=int, required=True)
+    parser.add_argument("--trace-memory", action="store_true")
+    args = parser.parse_args()
+    args.workdir = os.path.abspath(args.workdir)
+    if args.trace_memory:
+        tracemalloc.start()
+    run(args)
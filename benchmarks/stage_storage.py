@@ -0,0 +1,81 @@
+"""Storage stages of the pipeline benchmark: consume -> insert.
+
+The messages produced by the streaming stage are fed to the consumer's write
+path in STORAGE_BATCH_SIZE batches: consume is decode_batch (Avro decoding and
+row building), insert is timed_write (partition batching, statement binding by
+the Cassandra driver and write notification; rollups refresh in the
+background and are disabled here). Only the
+Cassandra round trip is replaced, by harness.InMemoryCassandra. Run by
+run_pipeline.py in its own process. Writes storage.json.
+"""
+import argparse
+import os
+import pickle
+import tracemalloc
+
+from harness import InMemoryCassandra, InMemoryMessage, InMemoryRegistry, Stage, insert_statement, use_service, write_result
+
+
+class _DeadLetterCounter:
+    """DeadLetterProducer stand-in that only counts"""
+
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, msg, error, retry_count=0):
+        self.sent += 1
+
+
+def run(args):
+    use_service("storage")
+    from logger import setup_logging
+    setup_logging(level="ERROR", log_file="")
+    from confluent_kafka.schema_registry import Schema
+    from common.avro_codec import AvroEventDecoder
+    from write_notifications import WriteNotifier
+    import config
+    import consumer
+    import repository
+
+    registry = InMemoryRegistry()
+    with open(os.path.join("..", "streaming", "air_quality_event.avsc"), "r") as f:
+        registry.register_schema(f"{config.KAFKA_TOPIC}-value", Schema(f.read(), "AVRO"))
+    cassandra = InMemoryCassandra()
+    dead_letter = _DeadLetterCounter()
+    consumer.avro_decoder = AvroEventDecoder(registry, config.SCHEMA_CACHE_FILE, 5)
+    consumer.dead_letter = dead_letter
+    consumer.write_notifier = WriteNotifier(config.STORAGE_WRITES_TOPIC)
+    repository.insert_stmt = insert_statement()
+    repository.session = object()
+    repository.execute_concurrent = cassandra.execute_concurrent
+
+    with open(os.path.join(args.workdir, "messages.pkl"), "rb") as f:
+        produced = pickle.load(f)
+    messages = [InMemoryMessage(config.KAFKA_TOPIC, key, value, timestamp, partition=i % args.partitions, offset=i)
+                for i, (key, value, timestamp) in enumerate(produced)]
+
+    consume = Stage("consume", "messages", args.trace_memory)
+    insert = Stage("insert", "rows", args.trace_memory)
+    for start in range(0, len(messages), config.STORAGE_BATCH_SIZE):
+        batch = messages[start:start + config.STORAGE_BATCH_SIZE]
+        with consume.measure(len(batch)):
+            entries = consumer.decode_batch(batch)
+        with insert.measure(len(entries)):
+            failures = consumer.timed_write(entries)
+            consumer.handle_failures(failures, attempts=1)
+
+    write_result(os.path.join(args.workdir, "storage.json"), "storage", [consume, insert],
+                 statements=cassandra.statements, rows_bound=cassandra.rows, dead_lettered=dead_letter.sent,
+                 batch_size=config.STORAGE_BATCH_SIZE)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Storage stages of the pipeline benchmark")
+    parser.add_argument("--workdir", required=True)
+    parser.add_argument("--partitions", type=int, default=3)
+    parser.add_argument("--trace-memory", action="store_true")
+    args = parser.parse_args()
+    args.workdir = os.path.abspath(args.workdir)
+    if args.trace_memory:
+        tracemalloc.start()
+    run(args)
@@ -0,0 +1,87 @@
+"""Streaming stages of the pipeline benchmark: change stream -> produce.
+
+Every curated document written by the ingestion stage is replayed as an insert
+change event (shaped like the projected watch pipeline's output) through
+fetcher.handle_change, so hour aggregation and Avro encoding run as in the
+service. Kafka is an in-memory producer and the schema registry an in-memory
+registry. Run by run_pipeline.py in its own process. Writes streaming.json and
+messages.pkl (the produced messages for the storage stage).
+
+change_stream times handle_change minus the time spent in produce_event, which
+is reported separately as produce.
+"""
+import argparse
+import os
+import pickle
+import time
+import tracemalloc
+from datetime import datetime
+
+from harness import InMemoryMongoClient, InMemoryProducer, InMemoryRegistry, Stage, use_service, write_result
+
+
+def change_event(doc, fields):
+    return {
+        "operationType": "insert",
+        "documentKey": {"_id": doc["_id"]},
+        "wallTime": datetime.utcnow(),
+        "fullDocument": {f: doc[f] for f in fields if f in doc},
+    }
+
+
+def run(args):
+    import confluent_kafka
+    import pymongo
+    confluent_kafka.Producer = InMemoryProducer
+    pymongo.MongoClient = InMemoryMongoClient
+
+    use_service("streaming")
+    from logger import setup_logging
+    setup_logging(level="ERROR", log_file="")
+    import fetcher
+    from projection import STREAMED_FIELDS
+
+    with open(os.path.join(args.workdir, "curated.pkl"), "rb") as f:
+        docs = pickle.load(f)
+    fetcher.collection.insert_many([dict(doc) for doc in docs])
+    fetcher.schema_registry_client = InMemoryRegistry()
+    fetcher.init_encoder()
+
+    change_stream = Stage("change_stream", "change events", args.trace_memory)
+    produce = Stage("produce", "messages", args.trace_memory)
+    produce_event = fetcher.produce_event
+
+    def timed_produce(key, value, topic=None):
+        start = time.perf_counter()
+        produce_event(key, value, topic)
+        produce.add(time.perf_counter() - start)
+
+    fetcher.produce_event = timed_produce
+    events = [change_event(doc, STREAMED_FIELDS) for doc in docs]
+    for event in events:
+        produced_before = produce.seconds
+        start = time.perf_counter()
+        fetcher.handle_change(event)
+        change_stream.add(time.perf_counter() - start - (produce.seconds - produced_before))
+    # Hours still open in the aggregator (incomplete after validation) are emitted on shutdown
+    produced_before = produce.seconds
+    start = time.perf_counter()
+    fetcher.flush_and_close()
+    change_stream.add(time.perf_counter() - start - (produce.seconds - produced_before), 0)
+
+    messages = [(m.key(), m.value(), m.timestamp()[1]) for m in fetcher.producer.messages]
+    with open(os.path.join(args.workdir, "messages.pkl"), "wb") as f:
+        pickle.dump(messages, f, protocol=pickle.HIGHEST_PROTOCOL)
+    write_result(os.path.join(args.workdir, "streaming.json"), "streaming", [change_stream, produce],
+                 aggregation=fetcher.aggregator is not None, watch_mode=fetcher.WATCH_MODE)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming stages of the pipeline benchmark")
+    parser.add_argument("--workdir", required=True)
+    parser.add_argument("--trace-memory", action="store_true")
+    args = parser.parse_args()
+    args.workdir = os.path.abspath(args.workdir)
+    if args.trace_memory:
+        tracemalloc.start()
+    run(args)
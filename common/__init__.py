@@ -0,0 +1,5 @@
+"""Code shared by the ingestion, streaming and storage services.
+
+Each image copies this package next to its own modules (build context is the
+repository root); outside Docker, put the repository root on PYTHONPATH.
+"""
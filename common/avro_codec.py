@@ -0,0 +1,181 @@
+"""Confluent-framed Avro encoding and decoding with on-disk schema caches.
+
+Records are written and read with fastavro's schemaless_writer and
+schemaless_reader against schemas parsed once with parse_schema. The
+encoder asks the registry for its schema ID once and keeps it in a cache
+file, so a service also starts while the registry is down; the decoder
+keeps the writer schema of every ID it has seen, so a restarted worker
+decodes known IDs without reaching the registry. Output is byte-for-byte
+what AvroSerializer produces and record-for-record what AvroDeserializer
+returns.
+"""
+import io
+import json
+import logging
+import os
+import struct
+import time
+from fastavro import parse_schema, schemaless_reader, schemaless_writer
+from confluent_kafka.schema_registry import Schema
+
+logger = logging.getLogger(__name__)
+
+MAGIC_BYTE = 0
+
+
+def _write_json(path, data):
+    """Write a cache file through a temp file, so readers never see it half written"""
+    if not path:
+        return
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write schema cache {path}: {e}")
+
+
+def _read_json(path):
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable schema cache {path}: {e}")
+        return {}
+
+
+class SchemaIdCache:
+    """JSON file of subject -> {"id", "schema"} entries"""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = _read_json(path)
+
+    def get(self, subject, schema_str):
+        entry = self.entries.get(subject)
+        if entry and entry["schema"] == schema_str:
+            return entry["id"]
+        return None
+
+    def put(self, subject, schema_id, schema_str):
+        self.entries[subject] = {"id": schema_id, "schema": schema_str}
+        _write_json(self.path, self.entries)
+
+
+class AvroEventEncoder:
+    """Encodes records for one subject.
+
+    The schema ID is resolved at construction; if neither the registry nor
+    the cache has it, the first encode() tries the registry again.
+    """
+
+    def __init__(self, schema_str, registry_client, subject, cache_path=None):
+        self.schema_str = schema_str
+        self.registry_client = registry_client
+        self.subject = subject
+        self.cache = SchemaIdCache(cache_path)
+        self.parsed_schema = parse_schema(json.loads(schema_str))
+        self.schema_id = None
+        self.header = None
+        try:
+            self._resolve_schema_id()
+        except Exception as e:
+            logger.warning(f"Schema ID for {subject} not resolved yet, will retry on first event: {e}")
+
+    def _resolve_schema_id(self):
+        try:
+            schema_id = self.registry_client.register_schema(self.subject, Schema(self.schema_str, "AVRO"))
+        except Exception as e:
+            schema_id = self.cache.get(self.subject, self.schema_str)
+            if schema_id is None:
+                raise
+            logger.warning(f"Schema registry unavailable ({e}); using cached schema ID {schema_id} for {self.subject}")
+        else:
+            if self.cache.get(self.subject, self.schema_str) != schema_id:
+                self.cache.put(self.subject, schema_id, self.schema_str)
+        self.schema_id = schema_id
+        self.header = struct.pack(">bI", MAGIC_BYTE, schema_id)
+
+    def encode(self, record):
+        if self.header is None:
+            self._resolve_schema_id()
+        buffer = io.BytesIO()
+        buffer.write(self.header)
+        schemaless_writer(buffer, self.parsed_schema, record)
+        return buffer.getvalue()
+
+    def encode_batch(self, records):
+        """Encode many records into one reused buffer"""
+        if self.header is None:
+            self._resolve_schema_id()
+        header, parsed_schema = self.header, self.parsed_schema
+        buffer = io.BytesIO()
+        payloads = []
+        for record in records:
+            buffer.seek(0)
+            buffer.truncate()
+            buffer.write(header)
+            schemaless_writer(buffer, parsed_schema, record)
+            payloads.append(buffer.getvalue())
+        return payloads
+
+    def __call__(self, record, ctx=None):
+        # Serializer signature, for use as a SerializingProducer value.serializer
+        return None if record is None else self.encode(record)
+
+
+class SchemaLookupError(Exception):
+    """The writer schema of a message could not be found"""
+
+
+class AvroEventDecoder:
+    """Decodes Confluent-framed Avro payloads using the writer schema of each message"""
+
+    def __init__(self, registry_client, cache_path=None, lookup_timeout=30.0):
+        self.registry_client = registry_client
+        self.cache_path = cache_path
+        self.lookup_timeout = lookup_timeout
+        self.schema_strs = {int(k): v for k, v in _read_json(cache_path).items()}
+        # schema ID -> parsed writer schema
+        self.readers = {}
+
+    def _fetch(self, schema_id):
+        """Schema string for schema_id from the registry, retrying for up to lookup_timeout seconds"""
+        deadline = time.monotonic() + self.lookup_timeout
+        delay = 0.5
+        while True:
+            try:
+                return self.registry_client.get_schema(schema_id).schema_str
+            except Exception as e:
+                if time.monotonic() + delay > deadline:
+                    raise SchemaLookupError(f"Schema {schema_id} unavailable: {e}") from e
+                logger.warning(f"Schema registry lookup of {schema_id} failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
+
+    def reader(self, schema_id):
+        reader = self.readers.get(schema_id)
+        if reader is None:
+            schema_str = self.schema_strs.get(schema_id)
+            if schema_str is None:
+                schema_str = self._fetch(schema_id)
+                self.schema_strs[schema_id] = schema_str
+                _write_json(self.cache_path, self.schema_strs)
+            reader = self.readers[schema_id] = parse_schema(json.loads(schema_str))
+        return reader
+
+    def decode(self, payload):
+        if payload is None:
+            return None
+        if len(payload) < 5:
+            raise ValueError(f"Message of {len(payload)} bytes is too short for Confluent Avro framing")
+        magic, schema_id = struct.unpack(">bI", payload[:5])
+        if magic != MAGIC_BYTE:
+            raise ValueError(f"Unknown magic byte {magic}")
+        buffer = io.BytesIO(payload)
+        buffer.seek(5)
+        return schemaless_reader(buffer, self.reader(schema_id))
@@ -0,0 +1,22 @@
+"""Deterministic _id of curated documents.
+
+Ingestion gives every curated document its key as `_id`:
+{"city", "timestamp", "pollutant"} in the long layout and {"city", "timestamp"}
+in the wide one. Change events always carry `documentKey._id`, so the
+streaming service can tell which reading an update belongs to without
+reading the document back.
+"""
+
+
+def document_id(city, timestamp, pollutant=None):
+    """_id of the curated document for one reading (wide layout when pollutant is None)"""
+    if pollutant is None:
+        return {"city": city, "timestamp": timestamp}
+    return {"city": city, "timestamp": timestamp, "pollutant": pollutant}
+
+
+def key_from_id(doc_id):
+    """The city/timestamp(/pollutant) fields of a document _id, or None for ids without them"""
+    if not isinstance(doc_id, dict) or "city" not in doc_id or "timestamp" not in doc_id:
+        return None
+    return dict(doc_id)
@@ -0,0 +1,118 @@
+"""Liveness and readiness endpoints and startup phase timing.
+
+Served on the metrics port next to /metrics:
+    GET /health/live   200 while the main loop keeps beating (or has not started yet)
+    GET /health/ready  200 once startup finished and every readiness check passes
+
+Each service's health.py creates one HealthState with its own gauges.
+"""
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+from prometheus_client import make_wsgi_app
+
+logger = logging.getLogger(__name__)
+
+
+class HealthState:
+    """Readiness flag, readiness checks, a main-loop heartbeat and startup phase timing.
+
+    ready_gauge and phase_gauge are the service_ready and service_startup_phase_seconds
+    gauges; `labels` (e.g. a worker ID) are applied to both.
+    """
+
+    def __init__(self, liveness_timeout, ready_gauge=None, phase_gauge=None, labels=None):
+        self.liveness_timeout = liveness_timeout
+        self.ready_gauge = ready_gauge
+        self.phase_gauge = phase_gauge
+        self.labels = dict(labels or {})
+        self.ready = False
+        self.checks = {}
+        self.last_heartbeat = None
+        self.lock = threading.Lock()
+
+    def heartbeat(self):
+        self.last_heartbeat = time.monotonic()
+
+    def set_ready(self, ready=True):
+        self.ready = ready
+        if self.ready_gauge is not None:
+            gauge = self.ready_gauge.labels(**self.labels) if self.labels else self.ready_gauge
+            gauge.set(1 if ready else 0)
+
+    def add_check(self, name, check):
+        """Register a callable that returns True while a dependency is usable"""
+        with self.lock:
+            self.checks[name] = check
+
+    def liveness(self):
+        if self.last_heartbeat is None or not self.liveness_timeout:
+            return True, {}
+        stalled = time.monotonic() - self.last_heartbeat
+        return stalled < self.liveness_timeout, {"seconds_since_heartbeat": round(stalled, 1)}
+
+    def readiness(self):
+        with self.lock:
+            checks = dict(self.checks)
+        results = {}
+        for name, check in checks.items():
+            try:
+                results[name] = bool(check())
+            except Exception:
+                results[name] = False
+        return self.ready and all(results.values()), {"started": self.ready, **results}
+
+    @contextmanager
+    def startup_phase(self, name):
+        """Time one startup phase into service_startup_phase_seconds"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - start
+            if self.phase_gauge is not None:
+                self.phase_gauge.labels(**self.labels, phase=name).set(duration)
+            logger.info(f"Startup phase {name} took {duration:.2f}s")
+
+    def run_phases(self, phases):
+        """Run independent {name: callable} startup phases in parallel; re-raises the first failure"""
+        def timed(name, fn):
+            with self.startup_phase(name):
+                return fn()
+
+        with ThreadPoolExecutor(max_workers=len(phases), thread_name_prefix="startup") as executor:
+            futures = {name: executor.submit(timed, name, fn) for name, fn in phases.items()}
+            return {name: future.result() for name, future in futures.items()}
+
+    def start_server(self, port):
+        """Serve /metrics, /health/live and /health/ready on port from a daemon thread"""
+        server = make_server("", port, _app(self, make_wsgi_app()), _ThreadingWSGIServer, handler_class=_QuietHandler)
+        threading.Thread(target=server.serve_forever, name="health-server", daemon=True).start()
+        return server
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        # Probes hit these endpoints every few seconds
+        pass
+
+
+def _app(health, metrics_app):
+    def app(environ, start_response):
+        path = environ.get("PATH_INFO", "/")
+        if path in ("/health/live", "/health/ready"):
+            ok, detail = health.liveness() if path == "/health/live" else health.readiness()
+            body = json.dumps({"status": "ok" if ok else "unavailable", **detail}).encode("utf-8")
+            start_response("200 OK" if ok else "503 Service Unavailable", [("Content-Type", "application/json")])
+            return [body]
+        return metrics_app(environ, start_response)
+    return app
@@ -0,0 +1,251 @@
+"""Service logging: a queue-backed root handler, sampled per-record logs and JSON output.
+
+setup_logging() puts a single QueueHandler on the root logger. A QueueListener thread
+does the formatting and the stdout/file writes, so a log call on a hot path only
+enqueues the record. With fmt="json" every line is one JSON object that promtail
+can parse into labels.
+
+For events that can fire once per record, use SampledLog: it logs the first
+`sample_burst` events per key in each `summary_interval` window and then a single
+summary line with the number it suppressed. PeriodicSummary replaces a per-batch
+INFO line with a counter that is logged once per interval.
+
+Each service's logger.py calls setup_logging() with its name and its LOG_* settings.
+"""
+import atexit
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Attributes every LogRecord has; anything else was passed through extra= and goes into the JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+# Defaults until setup_logging() is called with the service's settings
+_settings = {"sample_burst": 5, "summary_interval": 60}
+
+_lock = threading.Lock()
+_listener = None
+_dropped = 0
+_summaries = weakref.WeakSet()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, service, logger, message and any extra fields"""
+
+    def __init__(self, service, fields=None):
+        super().__init__()
+        self.service = service
+        self.fields = dict(fields or {})
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "service": self.service,
+            **self.fields,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _AsyncHandler(QueueHandler):
+    """QueueHandler that never blocks the caller and leaves formatting to the listener thread"""
+
+    def prepare(self, record):
+        # The queue is in-process, so the record does not need to be pickle-safe. Only
+        # %-style arguments are merged here, because they may be mutated after the call.
+        if record.args:
+            record.msg, record.args = record.getMessage(), None
+        return record
+
+    def enqueue(self, record):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped += 1
+
+
+def _make_formatter(fmt, service, fields):
+    if fmt == "json":
+        return JsonFormatter(service, fields)
+    return logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+
+def _summary_loop():
+    global _dropped
+    while True:
+        # Tick faster than the interval so a window is summarised soon after it closes
+        time.sleep(min(_settings["summary_interval"], 5))
+        flush_summaries()
+        if _dropped:
+            dropped, _dropped = _dropped, 0
+            logging.getLogger(__name__).warning(f"Dropped {dropped} log records because the log queue was full",
+                                                extra={"dropped": dropped})
+
+
+def flush_summaries(force=False):
+    """Emit the summary lines of every SampledLog and PeriodicSummary whose interval has passed"""
+    for summary in list(_summaries):
+        summary.flush(force)
+
+
+def setup_logging(service, level="INFO", fmt="text", log_file="", fields=None, queue_size=10000,
+                  sample_burst=5, summary_interval=60, quiet_loggers=None):
+    """Route the root logger through a background queue listener; safe to call more than once.
+
+    `fields` are added to every JSON line (e.g. a worker ID); `quiet_loggers` maps
+    chatty library loggers to the level they should log at.
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        _settings.update(sample_burst=sample_burst, summary_interval=summary_interval)
+        formatter = _make_formatter(fmt, service, fields)
+        handlers = [logging.StreamHandler(sys.stdout)]
+        if log_file:
+            try:
+                handlers.append(logging.FileHandler(log_file, mode='a'))
+            except OSError as e:
+                print(f"Not logging to {log_file}: {e}", file=sys.stderr)
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.Queue(queue_size)
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_AsyncHandler(log_queue))
+        root.setLevel(level.upper())
+        for name, logger_level in (quiet_loggers or {}).items():
+            logging.getLogger(name).setLevel(logger_level)
+
+        threading.Thread(target=_summary_loop, name="log-summaries", daemon=True).start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Write pending summaries, then drain the queue"""
+    global _listener
+    flush_summaries(force=True)
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+class SampledLog:
+    """Logs the first `burst` events per key in each interval and a summary line for the rest.
+
+    burst and interval default to the service's settings passed to setup_logging().
+    """
+
+    def __init__(self, logger, burst=None, interval=None):
+        self.logger = logger
+        self._burst = burst
+        self._interval = interval
+        self.lock = threading.Lock()
+        self.counts = {}  # key -> [logged, suppressed, highest level]
+        self.window_start = time.monotonic()
+        _summaries.add(self)
+
+    @property
+    def burst(self):
+        return self._burst if self._burst is not None else _settings["sample_burst"]
+
+    @property
+    def interval(self):
+        return self._interval if self._interval is not None else _settings["summary_interval"]
+
+    def log(self, level, key, msg, **extra):
+        if not self.logger.isEnabledFor(level):
+            return
+        with self.lock:
+            counts = self.counts.setdefault(key, [0, 0, level])
+            counts[2] = max(counts[2], level)
+            if counts[0] >= self.burst:
+                counts[1] += 1
+                return
+            counts[0] += 1
+        self.logger.log(level, msg, extra=extra or None)
+
+    def info(self, key, msg, **extra):
+        self.log(logging.INFO, key, msg, **extra)
+
+    def warning(self, key, msg, **extra):
+        self.log(logging.WARNING, key, msg, **extra)
+
+    def error(self, key, msg, **extra):
+        self.log(logging.ERROR, key, msg, **extra)
+
+    def flush(self, force=False):
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.window_start < self.interval:
+                return
+            counts, self.counts = self.counts, {}
+            elapsed, self.window_start = now - self.window_start, now
+        for key, (logged, suppressed, level) in counts.items():
+            if suppressed:
+                name = "/".join(map(str, key)) if isinstance(key, tuple) else str(key)
+                self.logger.log(level, f"Suppressed {suppressed} more '{name}' messages in the last {elapsed:.0f}s ({logged} logged)",
+                                extra={"sample_key": name, "suppressed": suppressed})
+
+
+class PeriodicSummary:
+    """Accumulates counters and logs them as one line per interval, e.g. instead of a line per batch"""
+
+    def __init__(self, logger, template, interval=None, level=logging.INFO):
+        self.logger = logger
+        self.template = template
+        self._interval = interval
+        self.level = level
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.window_start = time.monotonic()
+        _summaries.add(self)
+
+    @property
+    def interval(self):
+        return self._interval if self._interval is not None else _settings["summary_interval"]
+
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                self.counts[name] = self.counts.get(name, 0) + value
+        self.flush()
+
+    def flush(self, force=False):
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.window_start < self.interval:
+                return
+            counts, self.counts = self.counts, {}
+            elapsed, self.window_start = max(now - self.window_start, 1e-9), now
+        if any(counts.values()):
+            self.logger.log(self.level, f"{self.template.format_map(_Counts(counts))} in the last {elapsed:.0f}s",
+                            extra={**counts, "interval_seconds": round(elapsed, 1)})
+
+
+class _Counts(dict):
+    """format_map() source where counters that were never added read as 0"""
+
+    def __missing__(self, key):
+        return 0
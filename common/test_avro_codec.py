@@ -0,0 +1,91 @@
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+from common.avro_codec import AvroEventDecoder, AvroEventEncoder, SchemaLookupError
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streaming", "air_quality_event.avsc")
+SUBJECT = "air_quality_events-value"
+
+with open(SCHEMA_PATH, "r") as f:
+    SCHEMA_STR = f.read()
+
+
+class FakeRegistry:
+    """Schema registry stand-in; `down` makes every call fail like an unreachable registry"""
+
+    def __init__(self, schema_id=7, down=False):
+        self.schema_id = schema_id
+        self.down = down
+        self.lookups = 0
+
+    def register_schema(self, subject, schema):
+        if self.down:
+            raise ConnectionError("registry down")
+        return self.schema_id
+
+    def get_schema(self, schema_id):
+        self.lookups += 1
+        if self.down:
+            raise ConnectionError("registry down")
+        return type("RegisteredSchema", (), {"schema_str": SCHEMA_STR})()
+
+
+def event(city="Nairobi", hour=0, **values):
+    timestamp = datetime(2024, 1, 1, hour, tzinfo=timezone.utc)
+    return {"city": city, "timestamp": timestamp, "pm2_5": None, "pm10": None, "ozone": None,
+            "carbon_monoxide": None, "nitrogen_dioxide": None, "sulphur_dioxide": None, "uv_index": None,
+            "source": "open-meteo", "ingest_time": timestamp, **values}
+
+
+def test_round_trip():
+    registry = FakeRegistry()
+    record = event(pm2_5=12.5, uv_index=3.0)
+    payload = AvroEventEncoder(SCHEMA_STR, registry, SUBJECT).encode(record)
+
+    assert payload[:5] == b"\x00\x00\x00\x00\x07"
+    assert AvroEventDecoder(registry).decode(payload) == record
+
+
+def test_encode_batch_matches_encode():
+    encoder = AvroEventEncoder(SCHEMA_STR, FakeRegistry(), SUBJECT)
+    records = [event(hour=h, pm10=float(h)) for h in range(3)]
+
+    assert encoder.encode_batch(records) == [encoder.encode(r) for r in records]
+
+
+def test_encoder_uses_cached_id_while_registry_is_down(tmp_path):
+    cache = str(tmp_path / "schema_ids.json")
+    AvroEventEncoder(SCHEMA_STR, FakeRegistry(schema_id=3), SUBJECT, cache_path=cache)
+
+    encoder = AvroEventEncoder(SCHEMA_STR, FakeRegistry(down=True), SUBJECT, cache_path=cache)
+    assert encoder.encode(event())[:5] == b"\x00\x00\x00\x00\x03"
+
+
+def test_decoder_uses_cached_schema_while_registry_is_down(tmp_path):
+    cache = str(tmp_path / "schemas.json")
+    registry = FakeRegistry()
+    payload = AvroEventEncoder(SCHEMA_STR, registry, SUBJECT).encode(event(ozone=40.0))
+    AvroEventDecoder(registry, cache_path=cache).decode(payload)
+
+    down = FakeRegistry(down=True)
+    assert AvroEventDecoder(down, cache_path=cache).decode(payload)["ozone"] == 40.0
+    assert down.lookups == 0
+
+
+def test_decoder_gives_up_on_unknown_schema():
+    payload = AvroEventEncoder(SCHEMA_STR, FakeRegistry(), SUBJECT).encode(event())
+
+    with pytest.raises(SchemaLookupError):
+        AvroEventDecoder(FakeRegistry(down=True), lookup_timeout=0).decode(payload)
+
+
+def test_decoder_rejects_unframed_payloads():
+    decoder = AvroEventDecoder(FakeRegistry())
+
+    with pytest.raises(ValueError):
+        decoder.decode(b"\x00\x00")
+    with pytest.raises(ValueError):
+        decoder.decode(b"\x01\x00\x00\x00\x07payload")
+    assert decoder.decode(None) is None
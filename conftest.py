@@ -0,0 +1,4 @@
+# The services are flat modules that share names (config, metrics, logger), so each
+# one's tests run from its own directory, e.g. `cd streaming && python -m pytest`.
+# From here pytest runs the tests of common/ and test_storage.py.
+collect_ignore = ["ingestion", "streaming", "storage", "benchmarks"]
@@ -1,7 +1,7 @@
 import os
 from datetime import datetime, timedelta
 
-# API endpoint with placeholders for lat/lon
+# API endpoint with placeholders for lat/lon (comma-separated lists fetch several locations at once)
 API_TEMPLATE = "https://air-quality-api.open-meteo.com/v1/air-quality?latitude={}&longitude={}&hourly=pm2_5,pm10,ozone,carbon_monoxide,nitrogen_dioxide,sulphur_dioxide,uv_index&timezone=Africa/Nairobi"
 
 CITIES = {
@@ -13,6 +13,63 @@ MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://mongo:27017")
 DB_NAME = os.getenv("DB_NAME", "air_quality")
 RAW_CCOLLECTION = "raw_air_quality"
 CURATED_COLLECTION = "curated_air_quality"
+CURATED_WIDE_COLLECTION = os.getenv("CURATED_WIDE_COLLECTION", "curated_air_quality_hourly")
+# "long": one document per (city, timestamp, pollutant); "wide": one per (city, timestamp)
+CURATED_LAYOUT = os.getenv("CURATED_LAYOUT", "long")
+BACKFILL_CHECKPOINT_COLLECTION = "backfill_checkpoints"
+WATERMARK_COLLECTION = "ingest_watermarks"
+# Skip curated rows already stored with the same value
+INCREMENTAL_UPSERTS = os.getenv("INCREMENTAL_UPSERTS", "true").lower() == "true"
+MONGO_BULK_CHUNK_SIZE = int(os.getenv("MONGO_BULK_CHUNK_SIZE", 1000))
+RAW_TTL_DAYS = int(os.getenv("RAW_TTL_DAYS", 90))  # 0 keeps raw payloads forever
+
+# Raw archive: "plain" keeps the payload as a document, "compressed" stores a compressed JSON blob
+RAW_ARCHIVE_MODE = os.getenv("RAW_ARCHIVE_MODE", "compressed")
+RAW_COMPRESSION = os.getenv("RAW_COMPRESSION", "zstd")  # zstd, zlib or none
+RAW_COMPRESSION_LEVEL = int(os.getenv("RAW_COMPRESSION_LEVEL", 6))
+RAW_TIMESERIES = os.getenv("RAW_TIMESERIES", "false").lower() == "true"
+RAW_BATCH_INSERTS = os.getenv("RAW_BATCH_INSERTS", "true").lower() == "true"
+RAW_BATCH_SIZE = int(os.getenv("RAW_BATCH_SIZE", 100))
 
 POLL_INTERVAL_SECONDS = int(os.getenv("POLL_INTERVAL_SECONDS", 3600))  # hourly
-BACKFILL_DAYS = int(os.getenv("BACKFILL_DAYS", 5))
\ No newline at end of file
+BACKFILL_DAYS = int(os.getenv("BACKFILL_DAYS", 5))
+BACKFILL_WINDOW_DAYS = int(os.getenv("BACKFILL_WINDOW_DAYS", 7))  # days per API call
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", 4))
+METRICS_PORT = int(os.getenv("METRICS_PORT", 8000))  # also serves /health/live and /health/ready
+LIVENESS_TIMEOUT_SECONDS = float(os.getenv("LIVENESS_TIMEOUT_SECONDS", 180))  # scheduler heartbeat job runs every 30s
+BACKFILL_IN_BACKGROUND = os.getenv("BACKFILL_IN_BACKGROUND", "true").lower() == "true"
+
+# Concurrent multi-city fetching (1 = sequential)
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", 8))
+JOB_TIMEOUT_SECONDS = int(os.getenv("JOB_TIMEOUT_SECONDS", 3000))
+# Cities per multi-coordinate API request (1 = one request per city)
+BATCH_FETCH_SIZE = int(os.getenv("BATCH_FETCH_SIZE", 50))
+
+# Pooled HTTP client
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", FETCH_CONCURRENCY))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", 10))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 3))
+HTTP_BACKOFF_BASE_SECONDS = float(os.getenv("HTTP_BACKOFF_BASE_SECONDS", 0.5))
+HTTP_BACKOFF_MAX_SECONDS = float(os.getenv("HTTP_BACKOFF_MAX_SECONDS", 30))
+HTTP_RATE_LIMIT_PER_SECOND = float(os.getenv("HTTP_RATE_LIMIT_PER_SECOND", 5))  # per host, 0 disables
+
+# Dead-letter topic for payloads that failed validation or storage (python replay_dead_letters.py reprocesses them)
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "kafka:9092")
+DEAD_LETTER_ENABLED = os.getenv("DEAD_LETTER_ENABLED", "true").lower() == "true"
+DEAD_LETTER_TOPIC = os.getenv("DEAD_LETTER_TOPIC", "air_quality_dead_letter")
+DEAD_LETTER_PARKED_TOPIC = os.getenv("DEAD_LETTER_PARKED_TOPIC", f"{DEAD_LETTER_TOPIC}_parked")  # out of retries
+DEAD_LETTER_MAX_PAYLOAD_BYTES = int(os.getenv("DEAD_LETTER_MAX_PAYLOAD_BYTES", 900000))  # below the broker's 1 MB default
+DEAD_LETTER_COMPRESSION = os.getenv("DEAD_LETTER_COMPRESSION", "zstd")
+DEAD_LETTER_LINGER_MS = int(os.getenv("DEAD_LETTER_LINGER_MS", 100))
+DEAD_LETTER_MAX_RETRIES = int(os.getenv("DEAD_LETTER_MAX_RETRIES", 3))  # replays before a message is parked
+REPLAY_CONSUMER_GROUP = os.getenv("REPLAY_CONSUMER_GROUP", "air_quality_dead_letter_replay")
+REPLAY_CONCURRENCY = int(os.getenv("REPLAY_CONCURRENCY", 8))
+REPLAY_RATE_PER_SECOND = float(os.getenv("REPLAY_RATE_PER_SECOND", 50))  # 0 disables
+
+# Logging: records are formatted and written by a background thread (see logger.py)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "json" for promtail/Loki
+LOG_FILE = os.getenv("LOG_FILE", "/app/logs/ingestion.log")  # empty string logs to stdout only
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # records beyond this are dropped, not waited on
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", 5))  # per-record messages logged per key and interval
+LOG_SUMMARY_INTERVAL_SECONDS = float(os.getenv("LOG_SUMMARY_INTERVAL_SECONDS", 60))
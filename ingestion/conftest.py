@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules import shared code as `common.*`; the Docker images copy it next to the service
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -1,19 +1,70 @@
+import atexit
 import json
 import logging
+import threading
 from datetime import datetime
-from metrics import record_dead_letter_message, ERRORS
+from confluent_kafka import Producer
+from config import (
+    KAFKA_BOOTSTRAP_SERVERS, DEAD_LETTER_ENABLED, DEAD_LETTER_TOPIC, DEAD_LETTER_MAX_PAYLOAD_BYTES,
+    DEAD_LETTER_COMPRESSION, DEAD_LETTER_LINGER_MS,
+)
+from metrics import record_dead_letter_message, ERRORS, DEAD_LETTER_DELIVERIES
 
 logger = logging.getLogger(__name__)
 
 class DeadLetterHandler:
-    """Handles poisoned messages by sending them to a dead letter topic"""
-    
-    def __init__(self, kafka_producer=None, dead_letter_topic="air_quality_dead_letter"):
+    """Handles poisoned messages by sending them to a dead letter topic.
+
+    Messages are compact JSON keyed by city and go through an asynchronous,
+    batched and compressed producer, so a failing city never waits on Kafka.
+    Payloads above DEAD_LETTER_MAX_PAYLOAD_BYTES are replaced by a marker;
+    replay_dead_letters.py can only refetch those.
+    """
+
+    def __init__(self, kafka_producer=None, dead_letter_topic=DEAD_LETTER_TOPIC, max_payload_bytes=DEAD_LETTER_MAX_PAYLOAD_BYTES):
         self.kafka_producer = kafka_producer
         self.dead_letter_topic = dead_letter_topic
-        
-    def send_to_dead_letter(self, original_message, error_reason, city="unknown", pollutant=None):
+        self.max_payload_bytes = max_payload_bytes
+        self._lock = threading.Lock()
+
+    def _producer(self):
+        """Create the producer on first use, so importing the handler never touches Kafka"""
+        if self.kafka_producer is None:
+            with self._lock:
+                if self.kafka_producer is None:
+                    self.kafka_producer = Producer({
+                        "bootstrap.servers": KAFKA_BOOTSTRAP_SERVERS,
+                        "linger.ms": DEAD_LETTER_LINGER_MS,
+                        "compression.type": DEAD_LETTER_COMPRESSION,
+                        "enable.idempotence": True,
+                    })
+                    atexit.register(self.flush)
+        return self.kafka_producer
+
+    def _on_delivery(self, err, msg):
+        topic = msg.topic() if msg is not None else self.dead_letter_topic
+        if err is not None:
+            logger.error(f"Dead-letter message for {topic} was not delivered: {err}")
+            DEAD_LETTER_DELIVERIES.labels(topic=topic, status="failed").inc()
+        else:
+            DEAD_LETTER_DELIVERIES.labels(topic=topic, status="delivered").inc()
+
+    def encode(self, dead_letter_message):
+        """Compact JSON, with the original message replaced by a marker above the size cap"""
+        value = json.dumps(dead_letter_message, separators=(",", ":"), default=str).encode("utf-8")
+        if len(value) <= self.max_payload_bytes:
+            return value
+        dead_letter_message = {
+            **dead_letter_message,
+            "original_message": None,
+            "payload_truncated": True,
+            "payload_bytes": len(value),
+        }
+        return json.dumps(dead_letter_message, separators=(",", ":"), default=str).encode("utf-8")
+
+    def send_to_dead_letter(self, original_message, error_reason, city="unknown", pollutant=None, retry_count=0, topic=None):
         """Send a poisoned message to the dead letter topic"""
+        topic = topic or self.dead_letter_topic
         try:
             dead_letter_message = {
                 "timestamp": datetime.utcnow().isoformat(),
@@ -21,49 +72,61 @@ class DeadLetterHandler:
                 "error_reason": error_reason,
                 "city": city,
                 "pollutant": pollutant,
-                "retry_count": 0
+                "retry_count": retry_count
             }
-            
-            # In a real implementation, you would send to Kafka here
-            # For now, we'll just log and record metrics
-            logger.error(f"Message sent to dead letter topic: {error_reason} for {city}")
-            logger.debug(f"Dead letter message: {json.dumps(dead_letter_message, indent=2)}")
-            
-            # Record metrics
-            record_dead_letter_message(self.dead_letter_topic, error_reason)
-            
-            # If we had a Kafka producer, we would do:
-            # if self.kafka_producer:
-            #     self.kafka_producer.send(
-            #         self.dead_letter_topic, 
-            #         value=json.dumps(dead_letter_message).encode('utf-8')
-            #     )
-                
+            value = self.encode(dead_letter_message)
+            logger.error(f"Message sent to dead letter topic {topic}: {error_reason} for {city} ({len(value)} bytes, retry {retry_count})")
+            record_dead_letter_message(topic, error_reason)
+            if not DEAD_LETTER_ENABLED:
+                return
+
+            producer = self._producer()
+            try:
+                producer.produce(topic, key=city.encode("utf-8"), value=value, on_delivery=self._on_delivery)
+            except BufferError:
+                # Local queue full: serve delivery reports briefly, then try once more
+                producer.poll(1)
+                producer.produce(topic, key=city.encode("utf-8"), value=value, on_delivery=self._on_delivery)
+            producer.poll(0)
+
         except Exception as e:
             logger.error(f"Failed to send message to dead letter topic: {str(e)}")
+            DEAD_LETTER_DELIVERIES.labels(topic=topic, status="dropped").inc()
             ERRORS.labels(error_type="dead_letter_failure", city=city).inc()
-    
-    def handle_validation_error(self, data, city, pollutant, error_details):
+
+    def flush(self, timeout=10):
+        """Wait for queued dead-letter messages; returns the number still undelivered"""
+        if self.kafka_producer is None:
+            return 0
+        remaining = self.kafka_producer.flush(timeout)
+        if remaining:
+            logger.error(f"{remaining} dead-letter messages still queued after {timeout}s")
+        return remaining
+
+    def handle_validation_error(self, data, city, pollutant, error_details, retry_count=0):
         """Handle validation errors by sending to dead letter topic"""
         self.send_to_dead_letter(
             original_message=data,
             error_reason=f"validation_error_{error_details}",
             city=city,
-            pollutant=pollutant
+            pollutant=pollutant,
+            retry_count=retry_count
         )
-    
-    def handle_processing_error(self, data, city, error_details):
+
+    def handle_processing_error(self, data, city, error_details, retry_count=0):
         """Handle processing errors by sending to dead letter topic"""
         self.send_to_dead_letter(
             original_message=data,
             error_reason=f"processing_error_{error_details}",
-            city=city
+            city=city,
+            retry_count=retry_count
         )
-    
-    def handle_api_error(self, city, error_details):
-        """Handle API errors by sending to dead letter topic"""
+
+    def handle_api_error(self, city, error_details, retry_count=0):
+        """Handle API errors by sending to dead letter topic; there is no payload, so replays refetch"""
         self.send_to_dead_letter(
             original_message={"city": city, "error": error_details},
-            error_reason=f"api_error_{error_details}",
-            city=city
+            error_reason="api_error",
+            city=city,
+            retry_count=retry_count
         )
@@ -3,6 +3,7 @@ import time
 import logging
 from config import API_TEMPLATE, CITIES
 from metrics import record_api_call, record_processing_time, ERRORS
+from http_client import http_get
 
 logger = logging.getLogger(__name__)
 
@@ -23,8 +24,7 @@ def fetch_city_air_quality(city_name, start_date=None, end_date=None):
             url += f"&start_date={start_date}&end_date={end_date}"
         
         logger.info(f"Fetching air quality data for {city_name}")
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
+        response = http_get(url, city=city_name)
         
         duration = time.time() - start_time
         record_api_call(city_name, True, duration)
@@ -52,4 +52,72 @@ def fetch_city_air_quality(city_name, start_date=None, end_date=None):
         logger.error(f"Unexpected error fetching data for {city_name}: {str(e)}")
         record_api_call(city_name, False, duration)
         ERRORS.labels(error_type="unexpected", city=city_name).inc()
-        raise
\ No newline at end of file
+        raise
+
+def chunked(items, size):
+    """Yield successive lists of at most `size` items"""
+    items = list(items)
+    for i in range(0, len(items), max(1, size)):
+        yield items[i:i + size]
+
+def fetch_cities_air_quality(city_names, start_date=None, end_date=None):
+    """Fetch several cities in one multi-coordinate request.
+
+    Returns a dict mapping each city name to its own payload, shaped like
+    the single-city response so it can go through the usual validate/store flow.
+    """
+    city_names = list(city_names)
+    unknown = [c for c in city_names if c not in CITIES]
+    if unknown:
+        logger.error(f"Unknown cities: {unknown}")
+        for city_name in unknown:
+            ERRORS.labels(error_type="config", city=city_name).inc()
+        raise ValueError(f'Unknown cities {unknown}')
+
+    start_time = time.time()
+    label = "batch"
+
+    try:
+        lats = ",".join(str(CITIES[c]['lat']) for c in city_names)
+        lons = ",".join(str(CITIES[c]['lon']) for c in city_names)
+        url = API_TEMPLATE.format(lats, lons)
+        if start_date and end_date:
+            url += f"&start_date={start_date}&end_date={end_date}"
+
+        logger.info(f"Fetching air quality data for {len(city_names)} cities in one request")
+        response = http_get(url, city=label)
+        body = response.json()
+
+        # A single location comes back as an object, several as a list in request order
+        results = body if isinstance(body, list) else [body]
+        if len(results) != len(city_names):
+            raise ValueError(f"Expected {len(city_names)} locations in batch response, got {len(results)}")
+
+        duration = time.time() - start_time
+        record_api_call(label, True, duration)
+        for city_name in city_names:
+            record_processing_time(city_name, "api_fetch", duration)
+
+        logger.info(f"Successfully fetched batch of {len(city_names)} cities in {duration:.2f}s")
+        return dict(zip(city_names, results))
+
+    except requests.exceptions.Timeout:
+        duration = time.time() - start_time
+        logger.error(f"API timeout for batch of {len(city_names)} cities after {duration:.2f}s")
+        record_api_call(label, False, duration)
+        ERRORS.labels(error_type="api_timeout", city=label).inc()
+        raise
+
+    except requests.exceptions.RequestException as e:
+        duration = time.time() - start_time
+        logger.error(f"API request failed for batch of {len(city_names)} cities: {str(e)}")
+        record_api_call(label, False, duration)
+        ERRORS.labels(error_type="api_error", city=label).inc()
+        raise
+
+    except Exception as e:
+        duration = time.time() - start_time
+        logger.error(f"Unexpected error fetching batch of {len(city_names)} cities: {str(e)}")
+        record_api_call(label, False, duration)
+        ERRORS.labels(error_type="unexpected", city=label).inc()
+        raise
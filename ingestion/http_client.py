@@ -0,0 +1,142 @@
+import random
+import threading
+import time
+import logging
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (
+    HTTP_POOL_SIZE,
+    HTTP_TIMEOUT_SECONDS,
+    HTTP_MAX_RETRIES,
+    HTTP_BACKOFF_BASE_SECONDS,
+    HTTP_BACKOFF_MAX_SECONDS,
+    HTTP_RATE_LIMIT_PER_SECOND,
+)
+from metrics import record_api_retry, record_http_connection
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class RetryableStatusError(requests.exceptions.HTTPError):
+    """Raised for 429/5xx responses that should be retried"""
+
+
+class RateLimiter:
+    """Token bucket limiting requests per second to a single host"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_session = None
+_session_lock = threading.Lock()
+_limiters = {}
+_pool_counts = {}
+
+
+def get_session():
+    """Return the process-wide pooled keep-alive session"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, pool_block=True)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def _get_limiter(host):
+    with _session_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = RateLimiter(HTTP_RATE_LIMIT_PER_SECOND)
+            _limiters[host] = limiter
+        return limiter
+
+
+def _record_connection_reuse(response, host):
+    """Count new vs reused connections from the urllib3 pool counters"""
+    pool = getattr(response.raw, "_pool", None)
+    if pool is None:
+        return
+    with _session_lock:
+        opened = pool.num_connections
+        previous = _pool_counts.get(host, 0)
+        _pool_counts[host] = max(opened, previous)
+    record_http_connection(host, reused=opened <= previous)
+
+
+def _backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, honouring Retry-After when given"""
+    delay = random.uniform(0, min(HTTP_BACKOFF_MAX_SECONDS, HTTP_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, HTTP_BACKOFF_MAX_SECONDS))
+    return delay
+
+
+def _retry_after_seconds(response):
+    value = response.headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def http_get(url, city="unknown", timeout=HTTP_TIMEOUT_SECONDS):
+    """GET a URL through the shared session with rate limiting and retries.
+
+    Retries timeouts, connection errors and 429/5xx responses up to
+    HTTP_MAX_RETRIES times; other errors are raised immediately.
+    """
+    session = get_session()
+    host = urlparse(url).netloc
+    limiter = _get_limiter(host)
+    attempt = 0
+
+    while True:
+        limiter.acquire()
+        retry_after = None
+        try:
+            response = session.get(url, timeout=timeout)
+            _record_connection_reuse(response, host)
+            if response.status_code in RETRY_STATUS_CODES:
+                retry_after = _retry_after_seconds(response)
+                raise RetryableStatusError(f"{response.status_code} from {host}", response=response)
+            response.raise_for_status()
+            return response
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, RetryableStatusError) as e:
+            if attempt >= HTTP_MAX_RETRIES:
+                raise
+            delay = _backoff_delay(attempt, retry_after)
+            attempt += 1
+            reason = "status" if isinstance(e, RetryableStatusError) else type(e).__name__.lower()
+            logger.warning(f"Retrying {city} request in {delay:.2f}s (attempt {attempt}/{HTTP_MAX_RETRIES}): {e}")
+            record_api_retry(city, reason, delay)
+            time.sleep(delay)
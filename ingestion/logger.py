@@ -0,0 +1,12 @@
+"""Logging for the ingestion service: common/logger.py configured from config.py"""
+from common import logger as _shared
+from common.logger import JsonFormatter, SampledLog, PeriodicSummary, flush_summaries, shutdown_logging
+from config import LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_QUEUE_SIZE, LOG_SAMPLE_BURST, LOG_SUMMARY_INTERVAL_SECONDS
+
+SERVICE = "ingestion"
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, log_file=LOG_FILE):
+    """Route the root logger through a background queue listener; safe to call more than once"""
+    _shared.setup_logging(SERVICE, level, fmt, log_file, queue_size=LOG_QUEUE_SIZE,
+                          sample_burst=LOG_SAMPLE_BURST, summary_interval=LOG_SUMMARY_INTERVAL_SECONDS)
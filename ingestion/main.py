@@ -1,18 +1,15 @@
 from scheduler import start_scheduler, run_backfill
 import logging
 import sys
-from metrics import start_metrics_server
+import threading
+from config import BACKFILL_IN_BACKGROUND, METRICS_PORT
+from health import start_health_server, startup_phase
+from logger import setup_logging
+from storage import ensure_indexes
 
-def setup_logging():
-    """Setup structured logging with proper formatting"""
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(sys.stdout),
-            logging.FileHandler('/app/logs/ingestion.log', mode='a')
-        ]
-    )
+def setup_service_logging():
+    """Queue-backed logging (stdout plus LOG_FILE, text or JSON per LOG_FORMAT)"""
+    setup_logging()
     
     # Set specific loggers to appropriate levels
     logging.getLogger('urllib3').setLevel(logging.WARNING)
@@ -24,18 +21,26 @@ def setup_logging():
     return logger
 
 if __name__ == '__main__':
-    logger = setup_logging()
+    logger = setup_service_logging()
     logger.info("Starting Air Quality Ingestion Service")
     
     try:
-        # Start metrics server
-        start_metrics_server(8000)
-        logger.info("Metrics server started on port 8000")
+        # Metrics and probes are served from the start; /health/ready turns 200 with the scheduler
+        start_health_server(METRICS_PORT)
+        logger.info(f"Metrics and health endpoints started on port {METRICS_PORT}")
         
-        # Run backfill
-        logger.info("Starting backfill process")
-        run_backfill()
-        logger.info("Backfill process completed")
+        # Provision MongoDB indexes before any writes
+        with startup_phase("mongo_indexes"):
+            ensure_indexes()
+        
+        # Run backfill (in the background so scheduling starts immediately)
+        if BACKFILL_IN_BACKGROUND:
+            logger.info("Starting backfill process in the background")
+            threading.Thread(target=run_backfill, name="backfill", daemon=True).start()
+        else:
+            logger.info("Starting backfill process")
+            run_backfill()
+            logger.info("Backfill process completed")
         
         # Start scheduler
         logger.info("Starting scheduled processing")
@@ -5,21 +5,31 @@ import logging
 # API and external service metrics
 API_CALLS = Counter("api_calls_total", "Number of API calls", ["city", "status"])  # status = success/fail
 API_LATENCY = Histogram("api_call_duration_seconds", "API call duration", ["city"])
+API_RETRIES = Counter("api_retries_total", "API request retries", ["city", "reason"])
+API_RETRY_WAIT = Counter("api_retry_wait_seconds_total", "Time spent backing off before API retries", ["city"])
+HTTP_CONNECTIONS = Counter("http_connections_total", "HTTP requests by connection reuse", ["host", "reused"])
 VALIDATION_ERRORS = Counter("validation_errors_total", "Validation errors count", ["city", "pollutant"])
 MONGO_OPS = Counter("mongo_operations_total", "MongoDB ops count", ["operation", "status"])
+RAW_BYTES = Counter("raw_payload_bytes_total", "Raw payload bytes before and after compression", ["stage"])  # stage = uncompressed/stored
+MONGO_BULK_LATENCY = Histogram("mongo_bulk_write_duration_seconds", "Duration of one bulk write chunk", ["collection"])
+MONGO_BULK_DOCS = Counter("mongo_bulk_write_documents_total", "Documents affected by bulk writes", ["collection", "result"])  # result = upserted/matched/modified/error
 
 # Ingestion metrics
 INGESTION_RATE = Gauge("ingestion_rate_per_second", "Current ingestion rate", ["city"])
 RECORDS_PROCESSED = Counter("records_processed_total", "Total records processed", ["city", "status"])
 BATCH_SIZE = Histogram("batch_size", "Batch processing size", ["city"])
+CURATED_ROWS_SKIPPED = Counter("curated_rows_skipped_total", "Curated rows skipped because the stored value is unchanged", ["city"])
+CITIES_IN_FLIGHT = Gauge("cities_in_flight", "Cities currently being fetched/processed")
 
 # Error tracking
 ERRORS = Counter("errors_total", "Total errors", ["error_type", "city"])
 DEAD_LETTER_MESSAGES = Counter("dead_letter_messages_total", "Messages sent to dead letter topic", ["topic", "reason"])
+DEAD_LETTER_DELIVERIES = Counter("dead_letter_deliveries_total", "Dead-letter messages acknowledged or lost by Kafka", ["topic", "status"])  # status = delivered/failed/dropped
+DEAD_LETTER_REPLAYED = Counter("dead_letter_replayed_total", "Dead-letter messages handled by the replay tool", ["result"])  # result = success/failed/parked/skipped
 
-# Kafka metrics (simulated for now - would be real in production)
-KAFKA_LAG = Gauge("kafka_consumer_lag", "Kafka consumer lag", ["topic", "partition"])
-KAFKA_THROUGHPUT = Counter("kafka_messages_processed_total", "Kafka messages processed", ["topic"])
+# Startup and health
+STARTUP_PHASE_SECONDS = Gauge("service_startup_phase_seconds", "Duration of each startup phase of the last start", ["phase"])
+SERVICE_READY = Gauge("service_ready", "1 once indexes exist and the scheduler is running")
 
 # Processing time metrics
 PROCESSING_TIME = Histogram("processing_duration_seconds", "Processing duration", ["city", "stage"])
@@ -35,11 +45,25 @@ def record_api_call(city, success, duration):
     if success:
         API_LATENCY.labels(city=city).observe(duration)
 
+def record_api_retry(city, reason, wait_seconds):
+    """Record an API retry and the backoff time before it"""
+    API_RETRIES.labels(city=city, reason=reason).inc()
+    API_RETRY_WAIT.labels(city=city).inc(wait_seconds)
+
+def record_http_connection(host, reused):
+    """Record whether a request reused a pooled connection"""
+    HTTP_CONNECTIONS.labels(host=host, reused=str(reused).lower()).inc()
+
 def record_validation_error(city, pollutant):
     """Record validation error"""
     VALIDATION_ERRORS.labels(city=city, pollutant=pollutant).inc()
     ERRORS.labels(error_type="validation", city=city).inc()
 
+def record_validation_errors(city, pollutant, count):
+    """Record a batch of validation errors for one pollutant"""
+    VALIDATION_ERRORS.labels(city=city, pollutant=pollutant).inc(count)
+    ERRORS.labels(error_type="validation", city=city).inc(count)
+
 def record_mongo_operation(operation, success):
     """Record MongoDB operation"""
     status = "success" if success else "fail"
@@ -47,6 +71,18 @@ def record_mongo_operation(operation, success):
     if not success:
         ERRORS.labels(error_type="mongo", city="unknown").inc()
 
+def record_raw_bytes(uncompressed, stored):
+    """Record raw payload size before and after compression"""
+    RAW_BYTES.labels(stage="uncompressed").inc(uncompressed)
+    RAW_BYTES.labels(stage="stored").inc(stored)
+
+def record_bulk_write(collection, duration, upserted, matched, modified, errors=0):
+    """Record latency and BulkWriteResult counts for one bulk write chunk"""
+    MONGO_BULK_LATENCY.labels(collection=collection).observe(duration)
+    for result, count in (("upserted", upserted), ("matched", matched), ("modified", modified), ("error", errors)):
+        if count:
+            MONGO_BULK_DOCS.labels(collection=collection, result=result).inc(count)
+
 def record_processing_time(city, stage, duration):
     """Record processing time for different stages"""
     PROCESSING_TIME.labels(city=city, stage=stage).observe(duration)
@@ -57,15 +93,13 @@ def record_records_processed(city, count, success=True):
     RECORDS_PROCESSED.labels(city=city, status=status).inc(count)
     INGESTION_RATE.labels(city=city).set(count)
 
+def record_curated_rows_skipped(city, count):
+    """Record curated rows dropped before upsert as unchanged"""
+    if count:
+        CURATED_ROWS_SKIPPED.labels(city=city).inc(count)
+
 def record_dead_letter_message(topic, reason):
     """Record message sent to dead letter topic"""
     DEAD_LETTER_MESSAGES.labels(topic=topic, reason=reason).inc()
     ERRORS.labels(error_type="dead_letter", city="unknown").inc()
 
-def update_kafka_lag(topic, partition, lag):
-    """Update Kafka consumer lag"""
-    KAFKA_LAG.labels(topic=topic, partition=partition).set(lag)
-
-def record_kafka_throughput(topic, count=1):
-    """Record Kafka message throughput"""
-    KAFKA_THROUGHPUT.labels(topic=topic).inc(count)
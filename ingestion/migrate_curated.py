@@ -0,0 +1,137 @@
+"""Migrate curated data from the long layout to the wide (city, hour) layout.
+
+With --rekey, instead gives curated documents written before _ids were
+deterministic their (city, timestamp[, pollutant]) key as _id, which the
+streaming service needs to resolve update events.
+
+Usage: python migrate_curated.py [--batch-size N] [--city NAME] [--drop-source] [--rekey] [--dry-run]
+"""
+import argparse
+import logging
+import sys
+import time
+
+from pymongo import DeleteOne, UpdateOne
+from common.curated_keys import document_id
+from logger import setup_logging
+from storage import client, curated_col, curated_wide_col
+from validator import POLLUTANTS
+
+logger = logging.getLogger(__name__)
+
+
+def migrate(batch_size=1000, city=None, drop_source=False, dry_run=False):
+    """Pivot long curated documents into wide ones; returns the number of hours written.
+
+    Live ingestion may write the wide collection while this runs, and its values are
+    newer than the ones read here, so an hour is inserted whole only if it does not
+    exist yet; otherwise only the fields it is missing are filled in.
+
+    With drop_source, a long-layout document is deleted only after its hour was written
+    to the wide collection, and only if its value is still the one that was migrated, so
+    documents ingestion upserts while the migration runs are kept for a second pass.
+    """
+    pipeline = []
+    if city:
+        pipeline.append({"$match": {"city": city}})
+    pipeline.append({
+        "$group": {
+            "_id": {"city": "$city", "timestamp": "$timestamp"},
+            "values": {"$push": {"k": "$pollutant", "v": "$value", "id": "$_id"}},
+            "source": {"$first": "$source"},
+        }
+    })
+
+    start_time = time.time()
+    written = 0
+    deleted = 0
+    operations = []
+    migrated = []  # DeleteOne per source document of the hours in `operations`
+
+    def flush():
+        nonlocal written, deleted
+        if operations and not dry_run:
+            curated_wide_col.bulk_write(operations, ordered=False)
+            if drop_source and migrated:
+                deleted += curated_col.bulk_write(migrated, ordered=False).deleted_count
+        written += len(operations) // 2
+        operations.clear()
+        migrated.clear()
+
+    for group in curated_col.aggregate(pipeline, allowDiskUse=True):
+        values = [item for item in group["values"] if item["k"] in POLLUTANTS]
+        fields = {item["k"]: item["v"] for item in values}
+        fields["source"] = group.get("source") or "open-meteo"
+        key = {"city": group["_id"]["city"], "timestamp": group["_id"]["timestamp"]}
+        operations.append(UpdateOne(key, {"$setOnInsert": {"_id": document_id(**key), **fields}}, upsert=True))
+        operations.append(UpdateOne(key, [{"$set": {f: {"$ifNull": [f"${f}", {"$literal": v}]} for f, v in fields.items()}}]))
+        if drop_source:
+            migrated.extend(DeleteOne({"_id": item["id"], "value": item["v"]}) for item in values)
+        if len(operations) >= 2 * batch_size:
+            flush()
+            logger.info(f"Migrated {written} hourly documents")
+    flush()
+
+    if drop_source and not dry_run:
+        remaining = curated_col.count_documents({"city": city} if city else {})
+        logger.info(f"Removed {deleted} long-layout documents"
+                    + (f"; {remaining} were not migrated (e.g. written or changed during the run), run it again to move them" if remaining else ""))
+
+    logger.info(f"Migration {'(dry run) ' if dry_run else ''}finished in {time.time() - start_time:.2f}s: {written} hourly documents")
+    return written
+
+
+def rekey(collection, batch_size=1000, city=None, dry_run=False):
+    """Move documents with an ObjectId _id to their key as _id; returns the number moved.
+
+    _id is immutable, so each batch is deleted and re-inserted in one transaction,
+    re-reading the documents inside it so concurrent ingestion writes are kept.
+    """
+    query = {"_id": {"$type": "objectId"}}
+    if city:
+        query["city"] = city
+    start_time = time.time()
+    moved = 0
+
+    def move(session, ids):
+        docs = list(collection.find({"_id": {"$in": ids}}, session=session))
+        if not docs:
+            return 0
+        collection.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}}, session=session)
+        collection.insert_many([{**doc, "_id": document_id(doc["city"], doc["timestamp"], doc.get("pollutant"))}
+                                for doc in docs], session=session)
+        return len(docs)
+
+    while True:
+        ids = [doc["_id"] for doc in collection.find(query, {"_id": 1}).limit(batch_size)]
+        if not ids:
+            break
+        if dry_run:
+            moved += collection.count_documents(query)
+            break
+        with client.start_session() as session:
+            moved += session.with_transaction(lambda s: move(s, ids))
+        logger.info(f"Re-keyed {moved} documents in {collection.name}")
+
+    logger.info(f"Re-key of {collection.name} {'(dry run) ' if dry_run else ''}finished in {time.time() - start_time:.2f}s: {moved} documents")
+    return moved
+
+
+if __name__ == "__main__":
+    setup_logging(log_file="")
+    parser = argparse.ArgumentParser(description="Migrate curated_air_quality to the wide (city, hour) layout")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--city", help="only migrate one city")
+    parser.add_argument("--drop-source", action="store_true", help="delete the long-layout documents that were migrated (changed or new ones are kept)")
+    parser.add_argument("--rekey", action="store_true", help="give documents of both layouts their key as _id instead of migrating")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    try:
+        if args.rekey:
+            for collection in (curated_col, curated_wide_col):
+                rekey(collection, args.batch_size, args.city, args.dry_run)
+        else:
+            migrate(args.batch_size, args.city, args.drop_source, args.dry_run)
+    except Exception as e:
+        logger.error(f"Migration failed: {e}")
+        sys.exit(1)
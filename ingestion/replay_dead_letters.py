@@ -0,0 +1,146 @@
+"""Reprocess messages from the dead-letter topic through process_city.
+
+Messages that carry the original API payload are validated and stored again
+without calling the API. Messages without one (API errors, payloads over the
+size cap) are skipped unless --refetch is given. A message that fails again
+is dead-lettered by process_city with retry_count + 1; once retry_count
+reaches DEAD_LETTER_MAX_RETRIES it is moved to the parked topic instead.
+Offsets are committed after each batch, so an interrupted replay resumes.
+Filtered replays use their own consumer group, so messages they skip stay
+pending for an unfiltered replay; `--reason api_error --refetch` later picks
+up the messages an unfiltered replay skipped.
+
+Usage: python replay_dead_letters.py [--reason PREFIX] [--city NAME] [--refetch]
+                                     [--concurrency N] [--rate N] [--max-messages N] [--dry-run]
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from confluent_kafka import Consumer, KafkaException
+
+from config import (
+    KAFKA_BOOTSTRAP_SERVERS, DEAD_LETTER_TOPIC, DEAD_LETTER_PARKED_TOPIC, DEAD_LETTER_MAX_RETRIES,
+    REPLAY_CONSUMER_GROUP, REPLAY_CONCURRENCY, REPLAY_RATE_PER_SECOND,
+)
+from http_client import RateLimiter
+from logger import setup_logging
+from metrics import DEAD_LETTER_REPLAYED
+from scheduler import process_city, dead_letter_handler
+from storage import flush_raw
+
+logger = logging.getLogger(__name__)
+
+
+def replay_one(message, limiter, refetch=False, dry_run=False):
+    """Replay one decoded dead-letter message; returns success/failed/parked/skipped"""
+    city = message.get("city")
+    retry_count = message.get("retry_count") or 0
+    payload = message.get("original_message")
+    has_payload = isinstance(payload, dict) and "hourly" in payload
+
+    if retry_count >= DEAD_LETTER_MAX_RETRIES:
+        if not dry_run:
+            dead_letter_handler.send_to_dead_letter(
+                payload, message.get("error_reason"), city=city, pollutant=message.get("pollutant"),
+                retry_count=retry_count, topic=DEAD_LETTER_PARKED_TOPIC,
+            )
+        return "parked"
+    if not city or (not has_payload and not refetch):
+        return "skipped"
+    if dry_run:
+        return "success"
+
+    limiter.acquire()
+    return "success" if process_city(city, payload if has_payload else None, retry_count + 1) else "failed"
+
+
+def consumer_group(reason=None, city=None):
+    """Replay consumer group; each filter combination tracks its own position"""
+    filters = [f"reason={reason}" if reason else None, f"city={city}" if city else None]
+    return ".".join([REPLAY_CONSUMER_GROUP] + [f for f in filters if f])
+
+
+def replay(reason=None, city=None, refetch=False, concurrency=REPLAY_CONCURRENCY, rate=REPLAY_RATE_PER_SECOND,
+           batch_size=500, max_messages=None, idle_timeout=10.0, dry_run=False):
+    """Drain the dead-letter topic; returns a {result: count} summary"""
+    consumer = Consumer({
+        "bootstrap.servers": KAFKA_BOOTSTRAP_SERVERS,
+        "group.id": consumer_group(reason, city),
+        "auto.offset.reset": "earliest",
+        "enable.auto.commit": False,
+    })
+    consumer.subscribe([DEAD_LETTER_TOPIC])
+    limiter = RateLimiter(rate)
+    summary = {"success": 0, "failed": 0, "parked": 0, "skipped": 0, "filtered": 0, "undecodable": 0}
+    start_time = time.time()
+    last_message = time.monotonic()
+    seen = 0
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="replay") as executor:
+            while max_messages is None or seen < max_messages:
+                limit = batch_size if max_messages is None else min(batch_size, max_messages - seen)
+                messages = [m for m in consumer.consume(num_messages=limit, timeout=1.0) if not m.error()]
+                if not messages:
+                    if time.monotonic() - last_message >= idle_timeout:
+                        break
+                    continue
+                last_message = time.monotonic()
+                seen += len(messages)
+
+                decoded = []
+                for msg in messages:
+                    try:
+                        decoded.append(json.loads(msg.value()))
+                    except (TypeError, ValueError):
+                        summary["undecodable"] += 1
+                selected = [
+                    m for m in decoded
+                    if (not reason or str(m.get("error_reason", "")).startswith(reason))
+                    and (not city or m.get("city") == city)
+                ]
+                summary["filtered"] += len(decoded) - len(selected)
+
+                for result in executor.map(lambda m: replay_one(m, limiter, refetch, dry_run), selected):
+                    summary[result] += 1
+                    DEAD_LETTER_REPLAYED.labels(result=result).inc()
+
+                # Raw payloads buffered by process_city and re-dead-lettered messages must be
+                # durable before the batch is committed
+                if not flush_raw():
+                    raise RuntimeError("raw archive flush failed; not committing this batch")
+                if dead_letter_handler.flush():
+                    raise RuntimeError("dead-letter producer did not drain; not committing this batch")
+                if not dry_run:
+                    consumer.commit(asynchronous=False)
+                logger.info(f"Replayed {seen} messages in {time.time() - start_time:.1f}s: {summary}")
+    finally:
+        consumer.close()
+
+    logger.info(f"Replay {'(dry run) ' if dry_run else ''}finished in {time.time() - start_time:.2f}s: {summary}")
+    return summary
+
+
+if __name__ == "__main__":
+    setup_logging(log_file="")
+    parser = argparse.ArgumentParser(description=f"Reprocess messages from {DEAD_LETTER_TOPIC}")
+    parser.add_argument("--reason", help="only replay error reasons starting with this, e.g. processing_error_upsert_curated")
+    parser.add_argument("--city", help="only replay one city")
+    parser.add_argument("--refetch", action="store_true", help="call the API for messages without a stored payload")
+    parser.add_argument("--concurrency", type=int, default=REPLAY_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=REPLAY_RATE_PER_SECOND, help="messages per second, 0 for no limit")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--max-messages", type=int)
+    parser.add_argument("--idle-timeout", type=float, default=10.0, help="stop after this many seconds without messages")
+    parser.add_argument("--dry-run", action="store_true", help="count what would be replayed without writing or committing")
+    args = parser.parse_args()
+    try:
+        replay(args.reason, args.city, args.refetch, args.concurrency, args.rate,
+               args.batch_size, args.max_messages, args.idle_timeout, args.dry_run)
+    except (KafkaException, RuntimeError) as e:
+        logger.error(f"Replay failed: {e}")
+        sys.exit(1)
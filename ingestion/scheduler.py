@@ -1,61 +1,63 @@
 from apscheduler.schedulers.blocking import BlockingScheduler
-from fetcher import fetch_city_air_quality
-from validator import validate_pollutant_value, validate_data_quality
-from storage import save_raw, upsert_curated
-from config import CITIES, BACKFILL_DAYS
+from fetcher import fetch_city_air_quality, fetch_cities_air_quality, chunked
+from validator import build_records, validate_payload
+from storage import save_raw, save_raw_many, flush_raw, upsert_curated, load_backfill_checkpoint, save_backfill_checkpoint
+from config import CITIES, BACKFILL_DAYS, BACKFILL_WINDOW_DAYS, BACKFILL_CONCURRENCY, FETCH_CONCURRENCY, JOB_TIMEOUT_SECONDS, BATCH_FETCH_SIZE, RAW_BATCH_INSERTS
 from datetime import datetime, timedelta
-from metrics import record_processing_time, record_records_processed, record_mongo_operation, ERRORS, BATCH_SIZE
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from metrics import record_processing_time, record_records_processed, record_mongo_operation, ERRORS, BATCH_SIZE, CITIES_IN_FLIGHT
 from dead_letter_handler import DeadLetterHandler
+from health import health
 import time
 import logging
 
 logger = logging.getLogger(__name__)
 dead_letter_handler = DeadLetterHandler()
 
-def process_city(city):
-    """Process air quality data for a single city with comprehensive error handling"""
+def process_city(city, data=None, retry_count=0, raw_failures=None):
+    """Process air quality data for a single city with comprehensive error handling.
+
+    `data` is a payload already fetched by a batched request (or replayed
+    from the dead-letter topic); when omitted the city is fetched on its own.
+    Failures are dead-lettered with `retry_count`.
+
+    With RAW_BATCH_INSERTS, True means the curated data is stored and the raw
+    payload is pending in the buffer: if flush_raw later fails to write it,
+    the city is added to the `raw_failures` set so the caller can count it
+    as failed.
+    """
     start_time = time.time()
-    logger.info(f"Starting processing for {city}")
+    logger.debug(f"Starting processing for {city}")
+    dead_lettered = False
     
     try:
         # Fetch data
-        data = fetch_city_air_quality(city)
+        if data is None:
+            data = fetch_city_air_quality(city)
         
         # Validate data quality
-        is_valid, quality_score = validate_data_quality(data, city)
+        # Validate data quality and build curated records in one columnar pass
+        is_valid, quality_score, records, error_counts = validate_payload(data, city)
         if not is_valid:
             logger.error(f"Data quality too low for {city}: {quality_score:.2%}")
-            dead_letter_handler.handle_processing_error(data, city, "low_data_quality")
+            dead_letter_handler.handle_processing_error(data, city, "low_data_quality", retry_count)
             return False
             
-        # Save raw data
+        # Save raw data; a buffered payload is only reported once flush_raw has written it
         try:
-            save_raw(city, data)
-            record_mongo_operation("save_raw", True)
-            logger.info(f"Saved raw data for {city}")
+            on_raw_saved = _raw_result_handler(retry_count, raw_failures)
+            if not save_raw(city, data, buffered=RAW_BATCH_INSERTS, on_result=on_raw_saved):
+                raise RuntimeError("raw archive write failed")
+            if not RAW_BATCH_INSERTS:
+                on_raw_saved(city, data, None)
         except Exception as e:
             logger.error(f"Failed to save raw data for {city}: {str(e)}")
             record_mongo_operation("save_raw", False)
-            dead_letter_handler.handle_processing_error(data, city, "save_raw_failure")
+            dead_letter_handler.handle_processing_error(data, city, "save_raw_failure", retry_count)
+            dead_lettered = True
             raise
 
-        # Process and validate records
-        hourly = data.get('hourly', {})
-        timestamps = hourly.get('time', [])
-        pollutants = ["pm2_5", "pm10", "ozone", "carbon_monoxide", "nitrogen_dioxide", "sulphur_dioxide", "uv_index"]
-        
-        records = []
-        validation_errors = 0
-        
-        for i, ts in enumerate(timestamps):
-            for p in pollutants:
-                values = hourly.get(p, [])
-                if i < len(values):
-                    value = values[i]
-                    if validate_pollutant_value(p, value, city):
-                        records.append({"timestamp": ts, "pollutant": p, "value": value})
-                    else:
-                        validation_errors += 1
+        validation_errors = sum(error_counts.values())
 
         # Record batch metrics
         BATCH_SIZE.labels(city=city).observe(len(records))
@@ -67,19 +69,22 @@ def process_city(city):
 
         # Save curated data
         try:
-            upsert_curated(city, records)
+            # upsert_curated logs and counts its own errors and reports them by returning False
+            if not upsert_curated(city, records):
+                raise RuntimeError("curated write failed")
             record_mongo_operation("upsert_curated", True)
             logger.info(f"Saved {len(records)} curated records for {city}")
         except Exception as e:
             logger.error(f"Failed to save curated data for {city}: {str(e)}")
             record_mongo_operation("upsert_curated", False)
-            dead_letter_handler.handle_processing_error(data, city, "upsert_curated_failure")
+            dead_letter_handler.handle_processing_error(data, city, "upsert_curated_failure", retry_count)
+            dead_lettered = True
             raise
 
         # Record processing time
         duration = time.time() - start_time
         record_processing_time(city, "full_processing", duration)
-        logger.info(f"Successfully processed {city} in {duration:.2f}s")
+        logger.info(f"Successfully processed {city} in {duration:.2f}s" + (", raw archive pending" if RAW_BATCH_INSERTS else ""))
         return True
         
     except Exception as e:
@@ -87,32 +92,110 @@ def process_city(city):
         logger.error(f"Failed to process {city} after {duration:.2f}s: {str(e)}")
         ERRORS.labels(error_type="processing_failure", city=city).inc()
         record_processing_time(city, "failed_processing", duration)
-        dead_letter_handler.handle_processing_error({"city": city, "error": str(e)}, city, "processing_failure")
+        if data is None:
+            # Nothing was fetched, so a replay has to go back to the API
+            dead_letter_handler.handle_api_error(city, str(e), retry_count)
+        elif not dead_lettered:
+            dead_letter_handler.handle_processing_error(data, city, "processing_failure", retry_count)
         return False
 
+def _raw_result_handler(retry_count, raw_failures=None):
+    """on_result callback for save_raw: records the outcome and dead-letters payloads that were not archived"""
+    def on_result(city, data, error):
+        if error is None:
+            record_mongo_operation("save_raw", True)
+            logger.debug(f"Saved raw data for {city}")
+            return
+        record_mongo_operation("save_raw", False)
+        ERRORS.labels(error_type="save_raw_failure", city=city).inc()
+        dead_letter_handler.handle_processing_error(data, city, "save_raw_failure", retry_count)
+        if raw_failures is not None:
+            raw_failures.add(city)
+    return on_result
+
+def _run_city(city, data=None, raw_failures=None):
+    """Run process_city for one city, isolating any exception it raises"""
+    CITIES_IN_FLIGHT.inc()
+    try:
+        return process_city(city, data, raw_failures=raw_failures)
+    except Exception as e:
+        logger.error(f"Exception processing {city}: {str(e)}")
+        ERRORS.labels(error_type="scheduled_job_error", city=city).inc()
+        return False
+    finally:
+        CITIES_IN_FLIGHT.dec()
+
+def _fetch_batched(cities):
+    """Fetch cities in BATCH_FETCH_SIZE chunks and return {city: payload}.
+
+    Cities from a chunk whose request failed are left out, so process_city
+    falls back to fetching them one by one.
+    """
+    payloads = {}
+    chunks = list(chunked(cities, BATCH_FETCH_SIZE))
+    with ThreadPoolExecutor(max_workers=max(1, min(FETCH_CONCURRENCY, len(chunks))), thread_name_prefix="batch") as executor:
+        futures = {executor.submit(fetch_cities_air_quality, chunk): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                payloads.update(future.result())
+            except Exception as e:
+                logger.warning(f"Batched fetch failed for {len(chunk)} cities, falling back to per-city fetches: {str(e)}")
+    return payloads
+
+def _run_cities_concurrently(cities, max_workers, payloads, raw_failures=None):
+    """Process cities on a bounded thread pool and return {city: success}"""
+    results = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="city")
+    futures = {executor.submit(_run_city, city, payloads.get(city), raw_failures): city for city in cities}
+    try:
+        for future in as_completed(futures, timeout=JOB_TIMEOUT_SECONDS):
+            results[futures[future]] = future.result()
+    except FuturesTimeoutError:
+        for future, city in futures.items():
+            if city not in results:
+                if not future.cancel() and RAW_BATCH_INSERTS:
+                    # A straggler buffers its raw payload after the job's flush; write it when it ends
+                    future.add_done_callback(lambda _: flush_raw())
+                results[city] = False
+                logger.error(f"Processing {city} did not finish within {JOB_TIMEOUT_SECONDS}s")
+                ERRORS.labels(error_type="city_timeout", city=city).inc()
+    finally:
+        # Do not block the job on stragglers; their threads finish in the background
+        executor.shutdown(wait=False)
+    return results
+
 def scheduled_job():
     """Scheduled job to process all cities"""
-    logger.info("Starting scheduled processing job")
+    logger.info(f"Starting scheduled processing job (concurrency={FETCH_CONCURRENCY})")
     start_time = time.time()
     
+    cities = list(CITIES.keys())
+    payloads = _fetch_batched(cities) if BATCH_FETCH_SIZE > 1 else {}
+    raw_failures = set()
+    if FETCH_CONCURRENCY > 1 and len(cities) > 1:
+        results = _run_cities_concurrently(cities, min(FETCH_CONCURRENCY, len(cities)), payloads, raw_failures)
+    else:
+        results = {city: _run_city(city, payloads.get(city), raw_failures) for city in cities}
+    # Payloads that still cannot be archived are dead-lettered by their save_raw callbacks;
+    # their cities only count as processed once the raw payload is written
+    flush_raw()
+    for city in raw_failures:
+        results[city] = False
+    
     success_count = 0
     failure_count = 0
     
-    for city in CITIES.keys():
-        try:
-            success = process_city(city)
-            if success:
-                success_count += 1
-                logger.info(f"Successfully processed {city}")
-            else:
-                failure_count += 1
-                logger.error(f"Failed to process {city}")
-        except Exception as e:
+    for city, success in results.items():
+        if success:
+            success_count += 1
+            logger.debug(f"Successfully processed {city}")
+        else:
             failure_count += 1
-            logger.error(f"Exception processing {city}: {str(e)}")
-            ERRORS.labels(error_type="scheduled_job_error", city=city).inc()
+            logger.error(f"Failed to process {city}")
     
     duration = time.time() - start_time
+    record_processing_time("all", "scheduled_job", duration)
     logger.info(f"Scheduled job completed in {duration:.2f}s: {success_count} success, {failure_count} failures")
     
     # Record job-level metrics
@@ -121,36 +204,104 @@ def scheduled_job():
 
 def start_scheduler():
     scheduler = BlockingScheduler()
-    scheduler.add_job(scheduled_job, 'interval', seconds=3600)  # hourly
+    scheduler.add_job(scheduled_job, 'interval', seconds=3600, max_instances=1, coalesce=True)  # hourly
+    # Liveness: proves the scheduler still dispatches jobs between the hourly runs
+    scheduler.add_job(health.heartbeat, 'interval', seconds=30, next_run_time=datetime.now())
+    health.add_check("scheduler", lambda: scheduler.running)
+    health.set_ready()
     scheduler.start()
 
+def _missing_windows(missing_days, window_days):
+    """Group sorted missing days into contiguous (start, end) windows of at most window_days"""
+    windows = []
+    for day in missing_days:
+        if windows:
+            start, end = windows[-1]
+            if day == end + timedelta(days=1) and (day - start).days < window_days:
+                windows[-1] = (start, day)
+                continue
+        windows.append((day, day))
+    return windows
+
+def _backfill_window(cities, start_day, end_day):
+    """Fetch, validate and store one date window for a group of cities.
+
+    Each city is checkpointed as soon as its window is stored; returns the
+    number of cities that completed.
+    """
+    start_time = time.time()
+    start_str, end_str = start_day.isoformat(), end_day.isoformat()
+    logger.info(f"Backfilling {len(cities)} cities for {start_str}..{end_str}")
+
+    if len(cities) > 1:
+        payloads = fetch_cities_air_quality(cities, start_date=start_str, end_date=end_str)
+    else:
+        payloads = {cities[0]: fetch_city_air_quality(cities[0], start_date=start_str, end_date=end_str)}
+
+    days = [(start_day + timedelta(days=i)).isoformat() for i in range((end_day - start_day).days + 1)]
+    if not save_raw_many(payloads.items()):
+        raise RuntimeError("raw archive write failed")
+    completed = 0
+    for city, data in payloads.items():
+        try:
+            records, validation_errors = build_records(data.get("hourly", {}), city)
+            if not upsert_curated(city, records):
+                raise RuntimeError("write failed")
+            save_backfill_checkpoint(city, days)
+            record_records_processed(city, len(records), True)
+            completed += 1
+        except Exception as ex:
+            logger.error(f"Backfill error for {city} on {start_str}..{end_str}: {ex}")
+            ERRORS.labels(error_type="backfill_failure", city=city).inc()
+
+    record_processing_time("all", "backfill_window", time.time() - start_time)
+    return completed
+
 def run_backfill():
+    """Backfill the last BACKFILL_DAYS days in multi-day windows on a worker pool.
+
+    Completed days are checkpointed per city, so a restarted backfill only
+    requests the days still missing.
+    """
+    start_time = time.time()
     try:
         today = datetime.utcnow().date()
-        for delta in range(BACKFILL_DAYS, 0, -1):
-            day = today - timedelta(days=delta)
-            day_str = day.isoformat()
-            for city in CITIES.keys():
+        all_days = [today - timedelta(days=delta) for delta in range(BACKFILL_DAYS, 0, -1)]
+
+        # Group cities that are missing the same windows so they can share a request
+        groups = {}
+        for city in CITIES.keys():
+            done = load_backfill_checkpoint(city)
+            missing = [day for day in all_days if day.isoformat() not in done]
+            for window in _missing_windows(missing, BACKFILL_WINDOW_DAYS):
+                groups.setdefault(window, []).append(city)
+
+        units = [
+            (chunk, start_day, end_day)
+            for (start_day, end_day), group in groups.items()
+            for chunk in chunked(group, max(1, BATCH_FETCH_SIZE))
+        ]
+        if not units:
+            logger.info("Backfill already complete, nothing to do")
+            return
+
+        logger.info(f"Backfilling {len(units)} windows with {BACKFILL_CONCURRENCY} workers")
+        completed = 0
+        failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, BACKFILL_CONCURRENCY), thread_name_prefix="backfill") as executor:
+            futures = {executor.submit(_backfill_window, *unit): unit for unit in units}
+            for future in as_completed(futures):
+                chunk, start_day, end_day = futures[future]
                 try:
-                    print(f"Backfilling {city} for {day_str}")
-                    data = fetch_city_air_quality(city, start_date=day_str, end_date=day_str)
-                    save_raw(city, data)
-
-                    # Process hourly data
-                    hourly = data.get("hourly", {})
-                    timestamps = hourly.get("time", [])
-                    pollutants = ["pm2_5", "pm10", "ozone", "carbon_monoxide", "nitrogen_dioxide", "sulphur_dioxide", "uv_index"]
-
-                    records = []
-                    for i, ts in enumerate(timestamps):
-                        for p in pollutants:
-                            values = hourly.get(p, [])
-                            if i < len(values):
-                                value = values[i]
-                                if validate_pollutant_value(p, value):
-                                    records.append({"timestamp": ts, "pollutant": p, "value": value})
-                    upsert_curated(city, records)
+                    done = future.result()
+                    completed += done
+                    failed += len(chunk) - done
                 except Exception as ex:
-                    print(f"Backfill error for {city} on {day_str}: {ex}")
+                    failed += len(chunk)
+                    logger.error(f"Backfill window {start_day}..{end_day} failed for {len(chunk)} cities: {ex}")
+                    ERRORS.labels(error_type="backfill_failure", city="batch").inc()
+
+        duration = time.time() - start_time
+        logger.info(f"Backfill finished in {duration:.2f}s: {completed} city-windows stored, {failed} failed")
     except Exception as ex:
-        print(f"Backfill setup failed: {ex}")
+        logger.error(f"Backfill setup failed: {ex}")
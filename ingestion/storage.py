@@ -1,48 +1,369 @@
-from pymongo import MongoClient, UpdateOne
-from config import MONGODB_URI, DB_NAME, RAW_CCOLLECTION, CURATED_COLLECTION
+from pymongo import MongoClient, UpdateOne, ASCENDING, DESCENDING
+from bson import Binary
+from pymongo.errors import BulkWriteError, OperationFailure
+from config import (
+    MONGODB_URI, DB_NAME, RAW_CCOLLECTION, CURATED_COLLECTION, CURATED_WIDE_COLLECTION, CURATED_LAYOUT,
+    BACKFILL_CHECKPOINT_COLLECTION, WATERMARK_COLLECTION, INCREMENTAL_UPSERTS, MONGO_BULK_CHUNK_SIZE, RAW_TTL_DAYS,
+    RAW_ARCHIVE_MODE, RAW_COMPRESSION, RAW_COMPRESSION_LEVEL, RAW_TIMESERIES, RAW_BATCH_SIZE,
+)
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import json
+import threading
+import time
+import zlib
 import logging
-from metrics import MONGO_OPS
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; zlib is always available
+    zstandard = None
+from common.curated_keys import document_id
+from metrics import MONGO_OPS, record_curated_rows_skipped, record_bulk_write, record_raw_bytes
+from validator import POLLUTANTS
 
 logger = logging.getLogger(__name__)
 
-client = MongoClient(MONGODB_URI)
+# connect=False defers connecting to the first operation, so importing this module never blocks
+client = MongoClient(MONGODB_URI, connect=False)
 db = client[DB_NAME]
 raw_col = db[RAW_CCOLLECTION]
 curated_col = db[CURATED_COLLECTION]
+curated_wide_col = db[CURATED_WIDE_COLLECTION]
+checkpoint_col = db[BACKFILL_CHECKPOINT_COLLECTION]
+watermark_col = db[WATERMARK_COLLECTION]
+
+_MISSING = object()
+
+RAW_SCHEMA_VERSION = 2
+RAW_CODEC = RAW_COMPRESSION if RAW_COMPRESSION != "zstd" or zstandard else "zlib"
+if RAW_CODEC != RAW_COMPRESSION:
+    logger.warning("zstandard is not installed; compressing raw payloads with zlib")
+
+# (document, city, payload, on_result) waiting for flush_raw
+_raw_buffer = []
+_raw_buffer_lock = threading.Lock()
+
+# An index with the same keys already exists with other options
+INDEX_OPTIONS_CONFLICT = 85
+
+def ensure_indexes():
+    """Create the indexes the upsert keys and retention rely on.
+
+    The unique compound indexes turn each upsert into an index lookup and
+    stop concurrent upserts from inserting duplicates. A changed TTL is
+    applied to the existing index with collMod. Failures (e.g. existing
+    duplicates) are logged and do not stop the service.
+    """
+    ensure_raw_collection()
+    specs = [
+        (curated_col, [("city", ASCENDING), ("timestamp", ASCENDING), ("pollutant", ASCENDING)], {"unique": True, "name": "curated_upsert_key"}),
+        (curated_wide_col, [("city", ASCENDING), ("timestamp", ASCENDING)], {"unique": True, "name": "curated_hourly_upsert_key"}),
+        (raw_col, [("city", ASCENDING), ("ingest_ts", DESCENDING)], {"name": "raw_city_ingest_ts"}),
+    ]
+    if RAW_TTL_DAYS > 0 and not RAW_TIMESERIES:
+        specs.append((raw_col, [("ingest_ts", ASCENDING)], {"name": "raw_ingest_ts_ttl", "expireAfterSeconds": RAW_TTL_DAYS * 86400}))
+
+    def create(collection, keys, options):
+        try:
+            try:
+                collection.create_index(keys, **options)
+            except OperationFailure as e:
+                if e.code != INDEX_OPTIONS_CONFLICT or "expireAfterSeconds" not in options:
+                    raise
+                # create_index cannot change a TTL; collMod can, in place
+                db.command("collMod", collection.name,
+                           index={"keyPattern": dict(keys), "expireAfterSeconds": options["expireAfterSeconds"]})
+                logger.info(f"Changed TTL of index {options['name']} on {collection.name} to {options['expireAfterSeconds']}s")
+            MONGO_OPS.labels(operation="create_index", status="success").inc()
+            logger.info(f"Ensured index {options['name']} on {collection.name}")
+        except Exception as e:
+            MONGO_OPS.labels(operation="create_index", status="fail").inc()
+            logger.error(f"Could not create index {options['name']} on {collection.name}: {e}")
+
+    # Each create_index is a round trip (a no-op if the index exists), so send them together
+    with ThreadPoolExecutor(max_workers=len(specs)) as executor:
+        list(executor.map(lambda spec: create(*spec), specs))
+
+def bulk_write_chunked(collection, operations, chunk_size=MONGO_BULK_CHUNK_SIZE):
+    """Run unordered bulk writes in chunks and record per-chunk latency and counts"""
+    for i in range(0, len(operations), max(1, chunk_size)):
+        chunk = operations[i:i + chunk_size]
+        start_time = time.time()
+        try:
+            result = collection.bulk_write(chunk, ordered=False)
+            record_bulk_write(collection.name, time.time() - start_time, result.upserted_count, result.matched_count, result.modified_count)
+        except BulkWriteError as e:
+            details = e.details
+            record_bulk_write(collection.name, time.time() - start_time, details.get("nUpserted", 0), details.get("nMatched", 0), details.get("nModified", 0), errors=len(details.get("writeErrors", [])))
+            raise
+
+def _compress(data):
+    """Compress bytes with the configured raw codec; returns (codec, blob)"""
+    if RAW_CODEC == "zstd":
+        return "zstd", zstandard.ZstdCompressor(level=RAW_COMPRESSION_LEVEL).compress(data)
+    if RAW_CODEC == "zlib":
+        return "zlib", zlib.compress(data, RAW_COMPRESSION_LEVEL)
+    return "none", data
+
+def build_raw_document(city, raw_data):
+    """Build a raw archive document with a real ingest timestamp.
 
-def save_raw(city, raw_data):
+    In compressed mode the payload is stored as a compact JSON blob under
+    `payload` with its codec and schema version; otherwise it is kept as a
+    nested document under `raw_payload` as before.
+    """
+    doc = {
+        "city": city,
+        "ingest_ts": datetime.now(timezone.utc),
+        "schema_version": RAW_SCHEMA_VERSION,
+    }
+    if RAW_ARCHIVE_MODE == "compressed":
+        encoded = json.dumps(raw_data, separators=(",", ":")).encode("utf-8")
+        codec, blob = _compress(encoded)
+        doc.update({"codec": codec, "payload": Binary(blob), "payload_size": len(encoded)})
+        record_raw_bytes(len(encoded), len(blob))
+    else:
+        doc["raw_payload"] = raw_data
+    return doc
+
+def load_raw_payload(doc):
+    """Return the original payload dict from a raw archive document"""
+    if "raw_payload" in doc:
+        return doc["raw_payload"]
+    blob = bytes(doc["payload"])
+    codec = doc.get("codec", "none")
+    if codec == "zstd":
+        blob = zstandard.ZstdDecompressor().decompress(blob)
+    elif codec == "zlib":
+        blob = zlib.decompress(blob)
+    return json.loads(blob)
+
+def ensure_raw_collection():
+    """Create raw_air_quality as a time-series collection when RAW_TIMESERIES is set"""
+    if not RAW_TIMESERIES:
+        return
     try:
-        doc = {
-            "city": city,
-            "raw_payload": raw_data,
-            "ingest_ts": raw_data.get("current_weather", {}).get("time"),
-        }
+        if RAW_CCOLLECTION in db.list_collection_names():
+            options = raw_col.options()
+            if "timeseries" not in options:
+                logger.warning(f"{RAW_CCOLLECTION} already exists as a regular collection; not converting to time-series")
+            elif RAW_TTL_DAYS > 0 and options.get("expireAfterSeconds") != RAW_TTL_DAYS * 86400:
+                db.command("collMod", RAW_CCOLLECTION, expireAfterSeconds=RAW_TTL_DAYS * 86400)
+                logger.info(f"Changed expiry of {RAW_CCOLLECTION} to {RAW_TTL_DAYS} days")
+            return
+        kwargs = {"timeseries": {"timeField": "ingest_ts", "metaField": "city", "granularity": "hours"}}
+        if RAW_TTL_DAYS > 0:
+            kwargs["expireAfterSeconds"] = RAW_TTL_DAYS * 86400
+        db.create_collection(RAW_CCOLLECTION, **kwargs)
+        MONGO_OPS.labels(operation="create_collection", status="success").inc()
+        logger.info(f"Created time-series collection {RAW_CCOLLECTION}")
+    except Exception as e:
+        MONGO_OPS.labels(operation="create_collection", status="fail").inc()
+        logger.error(f"Could not create time-series collection {RAW_CCOLLECTION}: {e}")
+
+def save_raw(city, raw_data, buffered=False, on_result=None):
+    """Archive a raw payload.
+
+    With buffered=True the document is queued and written together with
+    other cities' payloads by flush_raw (or once RAW_BATCH_SIZE is reached);
+    True then only means queued. The outcome is reported to
+    on_result(city, raw_data, error) when the document is written, with
+    error None on success.
+    """
+    try:
+        doc = build_raw_document(city, raw_data)
+        if buffered:
+            with _raw_buffer_lock:
+                _raw_buffer.append((doc, city, raw_data, on_result))
+                full = len(_raw_buffer) >= RAW_BATCH_SIZE
+            if full:
+                flush_raw()
+            return True
         raw_col.insert_one(doc)
         MONGO_OPS.labels(operation="insert_raw", status="success").inc()
+        return True
     except Exception as e:
         MONGO_OPS.labels(operation="insert_raw", status="fail").inc()
         logger.error(f"Error saving raw data for {city}: {e}")
+        return False
+
+def save_raw_many(items):
+    """Archive several (city, payload) pairs with one insert_many"""
+    try:
+        docs = [build_raw_document(city, raw_data) for city, raw_data in items]
+        if docs:
+            raw_col.insert_many(docs, ordered=False)
+        MONGO_OPS.labels(operation="insert_raw_many", status="success").inc()
+        return True
+    except Exception as e:
+        MONGO_OPS.labels(operation="insert_raw_many", status="fail").inc()
+        logger.error(f"Error saving raw data batch: {e}")
+        return False
+
+def flush_raw():
+    """Write any buffered raw documents with one insert_many.
+
+    Documents the batch insert did not write are retried one by one; each
+    entry's on_result callback gets the final outcome. Returns True when
+    every document was written.
+    """
+    with _raw_buffer_lock:
+        entries = list(_raw_buffer)
+        _raw_buffer.clear()
+    if not entries:
+        return True
+    errors = {}
+    try:
+        raw_col.insert_many([doc for doc, _, _, _ in entries], ordered=False)
+        MONGO_OPS.labels(operation="insert_raw_many", status="success").inc()
+    except BulkWriteError as e:
+        MONGO_OPS.labels(operation="insert_raw_many", status="fail").inc()
+        errors = {err["index"]: e for err in e.details.get("writeErrors", [])}
+    except Exception as e:
+        # Unknown how much of the batch landed; a retried document may be archived twice
+        MONGO_OPS.labels(operation="insert_raw_many", status="fail").inc()
+        errors = {i: e for i in range(len(entries))}
+
+    failed = 0
+    for i, (doc, city, raw_data, on_result) in enumerate(entries):
+        error = errors.get(i)
+        if error is not None:
+            try:
+                doc.pop("_id", None)
+                raw_col.insert_one(doc)
+                MONGO_OPS.labels(operation="insert_raw", status="success").inc()
+                error = None
+            except Exception as e:
+                MONGO_OPS.labels(operation="insert_raw", status="fail").inc()
+                logger.error(f"Error saving raw data for {city}: {e}")
+                error = e
+                failed += 1
+        if on_result is not None:
+            try:
+                on_result(city, raw_data, error)
+            except Exception as e:
+                logger.error(f"Raw archive callback failed for {city}: {e}")
+    if failed:
+        logger.error(f"Archived {len(entries) - failed} raw payloads, {failed} failed")
+    else:
+        logger.info(f"Archived {len(entries)} raw payloads")
+    return not failed
+
+def load_watermark(city):
+    """Return the latest curated timestamp written for a city, or None"""
+    doc = watermark_col.find_one({"_id": city}, {"last_timestamp": 1})
+    return doc.get("last_timestamp") if doc else None
+
+def save_watermark(city, timestamp):
+    """Advance a city's watermark; never moves it backwards"""
+    watermark_col.update_one({"_id": city}, {"$max": {"last_timestamp": timestamp}}, upsert=True)
+
+def _stored_values(city, first_ts, last_ts):
+    """Return {(timestamp, pollutant): value} stored for a city in a time range"""
+    query = {"city": city, "timestamp": {"$gte": first_ts, "$lte": last_ts}}
+    if CURATED_LAYOUT == "wide":
+        projection = {"_id": 0, "timestamp": 1, **{p: 1 for p in POLLUTANTS}}
+        return {
+            (doc["timestamp"], p): doc[p]
+            for doc in curated_wide_col.find(query, projection)
+            for p in POLLUTANTS if p in doc
+        }
+    return {
+        (doc["timestamp"], doc["pollutant"]): doc.get("value")
+        for doc in curated_col.find(query, {"_id": 0, "timestamp": 1, "pollutant": 1, "value": 1})
+    }
+
+def drop_unchanged_records(city, records):
+    """Drop records already stored with the same value.
+
+    Only timestamps at or below the city's watermark can already exist, so
+    those are compared against one range read of the stored values; newer
+    timestamps always pass through. The read stops at the batch's last
+    timestamp, since the watermark may lie days ahead in forecast hours.
+    """
+    if not records:
+        return records
+    watermark = load_watermark(city)
+    first_ts = min(rec["timestamp"] for rec in records)
+    if watermark is None or first_ts > watermark:
+        return records
 
-def upsert_curated(city, records):
+    stored = _stored_values(city, first_ts, min(watermark, max(rec["timestamp"] for rec in records)))
+    changed = [
+        rec for rec in records
+        if rec["timestamp"] > watermark or stored.get((rec["timestamp"], rec["pollutant"]), _MISSING) != rec["value"]
+    ]
+    record_curated_rows_skipped(city, len(records) - len(changed))
+    return changed
+
+def build_long_operations(city, records):
+    """One upsert per (city, timestamp, pollutant) document"""
+    operations = []
+    for rec in records:
+        key = {
+            "city": city,
+            "timestamp": rec["timestamp"],
+            "pollutant": rec["pollutant"],
+        }
+        doc = {
+            "$set": {
+                "value": rec["value"],
+                "source": "open-meteo",
+            },
+            # The key as _id lets the change stream resolve updates without reading the document
+            "$setOnInsert": {"_id": document_id(city, rec["timestamp"], rec["pollutant"])},
+        }
+        operations.append(UpdateOne(key, doc, upsert=True))
+    return operations
+
+def build_wide_operations(city, records, source="open-meteo"):
+    """One upsert per (city, timestamp) document holding every pollutant as a field"""
+    by_hour = {}
+    for rec in records:
+        by_hour.setdefault(rec["timestamp"], {})[rec["pollutant"]] = rec["value"]
+    return [
+        UpdateOne({"city": city, "timestamp": ts},
+                  {"$set": {**values, "source": source}, "$setOnInsert": {"_id": document_id(city, ts)}}, upsert=True)
+        for ts, values in by_hour.items()
+    ]
+
+def upsert_curated(city, records, skip_unchanged=INCREMENTAL_UPSERTS):
     # records is a list of dict with keys: timestamp, pollutant, value
     try:
-        operations = []
-        for rec in records:
-            key = {
-                "city": city,
-                "timestamp": rec["timestamp"],
-                "pollutant": rec["pollutant"],
-            }
-            doc = {
-                "$set": {
-                    "value": rec["value"],
-                    "source": "open-meteo",
-                }
-            }
-            operations.append(UpdateOne(key, doc, upsert=True))
+        if skip_unchanged:
+            try:
+                records = drop_unchanged_records(city, records)
+            except Exception as e:
+                logger.warning(f"Could not diff curated data for {city}, writing all records: {e}")
+        if CURATED_LAYOUT == "wide":
+            target, operations = curated_wide_col, build_wide_operations(city, records)
+        else:
+            target, operations = curated_col, build_long_operations(city, records)
         if operations:
-            curated_col.bulk_write(operations)
+            bulk_write_chunked(target, operations)
+            save_watermark(city, max(rec["timestamp"] for rec in records))
         MONGO_OPS.labels(operation="upsert_curated", status="success").inc()
+        return True
     except Exception as e:
         MONGO_OPS.labels(operation="upsert_curated", status="fail").inc()
-        logger.error(f"Error upserting curated data for {city}: {e}")
\ No newline at end of file
+        logger.error(f"Error upserting curated data for {city}: {e}")
+        return False
+
+def load_backfill_checkpoint(city):
+    """Return the set of ISO dates already backfilled for a city"""
+    doc = checkpoint_col.find_one({"_id": city}, {"completed_days": 1})
+    return set(doc.get("completed_days", [])) if doc else set()
+
+def save_backfill_checkpoint(city, days):
+    """Mark ISO dates as backfilled for a city"""
+    try:
+        checkpoint_col.update_one(
+            {"_id": city},
+            {"$addToSet": {"completed_days": {"$each": list(days)}}},
+            upsert=True,
+        )
+        MONGO_OPS.labels(operation="save_checkpoint", status="success").inc()
+    except Exception as e:
+        MONGO_OPS.labels(operation="save_checkpoint", status="fail").inc()
+        logger.error(f"Error saving backfill checkpoint for {city}: {e}")
@@ -0,0 +1,52 @@
+import mongomock
+import pytest
+
+import storage
+from storage import drop_unchanged_records, save_watermark
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    db = mongomock.MongoClient()["air_quality_test"]
+    for name in ("curated_col", "curated_wide_col", "watermark_col"):
+        monkeypatch.setattr(storage, name, db[name])
+    return db
+
+
+def record(hour, pollutant, value):
+    return {"timestamp": f"2024-01-01T{hour:02d}:00", "pollutant": pollutant, "value": value}
+
+
+def test_keeps_everything_without_a_watermark(mongo):
+    records = [record(0, "pm10", 1.0)]
+    assert drop_unchanged_records("Nairobi", records) == records
+
+
+def test_keeps_records_newer_than_the_watermark(mongo):
+    save_watermark("Nairobi", "2024-01-01T00:00")
+    records = [record(1, "pm10", 1.0), record(2, "pm10", 2.0)]
+    assert drop_unchanged_records("Nairobi", records) == records
+
+
+def test_drops_records_stored_with_the_same_value(mongo):
+    storage.curated_col.insert_many([
+        {"city": "Nairobi", "timestamp": "2024-01-01T00:00", "pollutant": "pm10", "value": 1.0},
+        {"city": "Nairobi", "timestamp": "2024-01-01T01:00", "pollutant": "pm10", "value": 2.0},
+        {"city": "Lagos", "timestamp": "2024-01-01T00:00", "pollutant": "ozone", "value": 3.0},
+    ])
+    save_watermark("Nairobi", "2024-01-01T01:00")
+    unchanged = record(0, "pm10", 1.0)
+    changed = record(1, "pm10", 2.5)
+    missing = record(0, "ozone", 3.0)
+    newer = record(2, "pm10", 1.0)
+
+    assert drop_unchanged_records("Nairobi", [unchanged, changed, missing, newer]) == [changed, missing, newer]
+
+
+def test_compares_pollutant_fields_in_the_wide_layout(mongo, monkeypatch):
+    monkeypatch.setattr(storage, "CURATED_LAYOUT", "wide")
+    storage.curated_wide_col.insert_one({"city": "Nairobi", "timestamp": "2024-01-01T00:00", "pm10": 1.0, "ozone": 2.0})
+    save_watermark("Nairobi", "2024-01-01T00:00")
+    records = [record(0, "pm10", 1.0), record(0, "ozone", 2.5), record(0, "uv_index", 1.0)]
+
+    assert drop_unchanged_records("Nairobi", records) == records[1:]
@@ -0,0 +1,38 @@
+from validator import POLLUTANTS, validate_hourly_columns
+
+TIMES = ["2024-01-01T00:00", "2024-01-01T01:00"]
+
+
+def hourly(**columns):
+    return {"time": TIMES, **{p: [1.0, 2.0] for p in POLLUTANTS}, **columns}
+
+
+def test_valid_payload_keeps_timestamp_then_pollutant_order():
+    records, valid, total, errors = validate_hourly_columns(hourly(pm2_5=[5, 6]))
+
+    assert (valid, total, errors) == (14, 14, {})
+    assert records[0] == {"timestamp": TIMES[0], "pollutant": "pm2_5", "value": 5.0}
+    assert [(r["timestamp"], r["pollutant"]) for r in records] == [(t, p) for t in TIMES for p in POLLUTANTS]
+
+
+def test_invalid_cells_are_counted_and_dropped():
+    records, valid, total, errors = validate_hourly_columns(
+        hourly(pm2_5=[None, 3.0], pm10=["high", 4.0], ozone=[-1.0, 1001.0], uv_index=[float("nan"), 2.0]))
+
+    assert errors == {"pm2_5": 1, "pm10": 1, "ozone": 2, "uv_index": 1}
+    assert (valid, total) == (9, 14)
+    assert {"timestamp": TIMES[1], "pollutant": "pm10", "value": 4.0} in records
+    assert not any(r["pollutant"] == "ozone" for r in records)
+
+
+def test_short_and_missing_columns_are_not_errors():
+    payload = hourly(pm2_5=[1.0])
+    del payload["uv_index"]
+    records, valid, total, errors = validate_hourly_columns(payload)
+
+    assert (valid, total, errors) == (11, 14, {})
+    assert not any(r["pollutant"] == "uv_index" for r in records)
+
+
+def test_empty_payload():
+    assert validate_hourly_columns({"time": []}) == ([], 0, 0, {})
@@ -1,7 +1,11 @@
 import logging
-from metrics import record_validation_error, ERRORS
+import numpy as np
+from logger import SampledLog
+from metrics import record_validation_error, record_validation_errors, ERRORS
 
 logger = logging.getLogger(__name__)
+# Per-cell and per-column warnings can fire for every record of a bad payload
+sampled = SampledLog(logger)
 
 # Define safe ranges for pollutants
 FIELD_RANGES = {
@@ -14,6 +18,8 @@ FIELD_RANGES = {
     "uv_index": (0, 20),
 }
 
+POLLUTANTS = list(FIELD_RANGES)
+
 def validate_pollutant_value(field, value, city="unknown"):
     """Validate pollutant value and record metrics for invalid values"""
     if value is None:
@@ -22,7 +28,7 @@ def validate_pollutant_value(field, value, city="unknown"):
         return False
         
     if not isinstance(value, (int, float)):
-        logger.warning(f"Invalid type for {field} in {city}: {type(value)}")
+        sampled.warning(("invalid_type", field), f"Invalid type for {field} in {city}: {type(value)}")
         record_validation_error(city, field)
         ERRORS.labels(error_type="validation_type", city=city).inc()
         return False
@@ -30,48 +36,136 @@ def validate_pollutant_value(field, value, city="unknown"):
     min_val, max_val = FIELD_RANGES.get(field, (None, None))
     if min_val is not None and max_val is not None:
         if value < min_val:
-            logger.warning(f"Value below minimum for {field} in {city}: {value} < {min_val}")
+            sampled.warning(("below_minimum", field), f"Value below minimum for {field} in {city}: {value} < {min_val}")
             record_validation_error(city, field)
             ERRORS.labels(error_type="validation_range", city=city).inc()
             return False
         elif value > max_val:
-            logger.warning(f"Value above maximum for {field} in {city}: {value} > {max_val}")
+            sampled.warning(("above_maximum", field), f"Value above maximum for {field} in {city}: {value} > {max_val}")
             record_validation_error(city, field)
             ERRORS.labels(error_type="validation_range", city=city).inc()
             return False
             
     return True
 
-def validate_data_quality(data, city):
-    """Validate overall data quality and return quality score"""
+def _column_masks(field, values, n):
+    """Vectorised null/type/range checks for one pollutant column.
+
+    Returns (values, valid, nulls, type_errors, range_errors) as arrays of
+    length n; cells missing from a short column are neither valid nor errors.
+    """
+    values = list(values[:n])
+    present = np.zeros(n, dtype=bool)
+    present[:len(values)] = True
+    column = np.full(n, np.nan)
+    nulls = np.zeros(n, dtype=bool)
+    type_errors = np.zeros(n, dtype=bool)
+
+    try:
+        arr = np.asarray(values)
+    except (ValueError, TypeError):
+        # Ragged nested lists/dicts; the per-cell checks below count them as type errors
+        arr = None
+    if arr is not None and arr.ndim == 1 and arr.dtype.kind in "biuf":
+        # Fast path: an all-numeric column converts without any per-cell checks
+        column[:len(values)] = arr
+    elif len(values):
+        nulls[:len(values)] = np.fromiter((v is None for v in values), dtype=bool, count=len(values))
+        numeric = np.fromiter((isinstance(v, (int, float)) for v in values), dtype=bool, count=len(values))
+        type_errors[:len(values)] = ~numeric & ~nulls[:len(values)]
+        column[:len(values)] = np.fromiter((float(v) if ok else np.nan for v, ok in zip(values, numeric)),
+                                           dtype=float, count=len(values))
+
+    min_val, max_val = FIELD_RANGES.get(field, (None, None))
+    checked = present & ~nulls & ~type_errors
+    range_errors = np.zeros(n, dtype=bool)
+    if min_val is not None and max_val is not None:
+        with np.errstate(invalid="ignore"):
+            range_errors = checked & ((column < min_val) | (column > max_val) | np.isnan(column))
+    valid = checked & ~range_errors
+    return column, valid, nulls, type_errors, range_errors
+
+def validate_hourly_columns(hourly, city="unknown"):
+    """Validate all pollutant columns of an hourly payload in one pass.
+
+    Returns (records, valid_count, total_expected, error_counts) where
+    records is a list of dicts with keys timestamp, pollutant, value and
+    error_counts maps each pollutant to its number of invalid cells.
+    Metrics are incremented once per pollutant rather than once per cell.
+    """
+    timestamps = hourly.get('time', [])
+    n = len(timestamps)
+    total_expected = n * len(POLLUTANTS)
+    if n == 0:
+        return [], 0, total_expected, {}
+
+    matrix = np.empty((n, len(POLLUTANTS)))
+    valid = np.zeros((n, len(POLLUTANTS)), dtype=bool)
+    error_counts = {}
+
+    for j, pollutant in enumerate(POLLUTANTS):
+        column, col_valid, nulls, type_errors, range_errors = _column_masks(pollutant, hourly.get(pollutant, []), n)
+        matrix[:, j] = column
+        valid[:, j] = col_valid
+
+        null_count = int(nulls.sum())
+        type_count = int(type_errors.sum())
+        range_count = int(range_errors.sum())
+        invalid = null_count + type_count + range_count
+        if invalid:
+            error_counts[pollutant] = invalid
+            record_validation_errors(city, pollutant, invalid)
+        if type_count:
+            sampled.warning(("invalid_type", pollutant), f"Invalid type for {pollutant} in {city}: {type_count} values")
+            ERRORS.labels(error_type="validation_type", city=city).inc(type_count)
+        if range_count:
+            sampled.warning(("out_of_range", pollutant), f"Out of range values for {pollutant} in {city}: {range_count} values outside {FIELD_RANGES.get(pollutant)}")
+            ERRORS.labels(error_type="validation_range", city=city).inc(range_count)
+        if null_count:
+            logger.debug(f"Null values for {pollutant} in {city}: {null_count}")
+
+    # Row-major nonzero keeps the original timestamp-then-pollutant ordering
+    rows, cols = np.nonzero(valid)
+    values = matrix[rows, cols].tolist()
+    records = [
+        {"timestamp": timestamps[i], "pollutant": POLLUTANTS[j], "value": v}
+        for i, j, v in zip(rows.tolist(), cols.tolist(), values)
+    ]
+    return records, len(records), total_expected, error_counts
+
+def build_records(hourly, city="unknown"):
+    """Turn an hourly payload into curated records.
+
+    Returns (records, validation_errors) where records is a list of dicts
+    with keys timestamp, pollutant, value.
+    """
+    records, _, _, error_counts = validate_hourly_columns(hourly, city)
+    return records, sum(error_counts.values())
+
+def validate_payload(data, city):
+    """Validate a payload once and return everything the pipeline needs.
+
+    Returns (is_valid, quality_score, records, error_counts).
+    """
     if not data:
         logger.error(f"Empty data received for {city}")
         ERRORS.labels(error_type="empty_data", city=city).inc()
-        return False, 0.0
+        return False, 0.0, [], {}
         
     hourly = data.get('hourly', {})
     if not hourly:
         logger.error(f"No hourly data for {city}")
         ERRORS.labels(error_type="missing_hourly", city=city).inc()
-        return False, 0.0
+        return False, 0.0, [], {}
         
     timestamps = hourly.get('time', [])
     if not timestamps:
         logger.error(f"No timestamps for {city}")
         ERRORS.labels(error_type="missing_timestamps", city=city).inc()
-        return False, 0.0
+        return False, 0.0, [], {}
         
     # Calculate data completeness
-    pollutants = ["pm2_5", "pm10", "ozone", "carbon_monoxide", "nitrogen_dioxide", "sulphur_dioxide", "uv_index"]
-    total_expected = len(timestamps) * len(pollutants)
-    valid_count = 0
-    
-    for pollutant in pollutants:
-        values = hourly.get(pollutant, [])
-        for i, value in enumerate(values):
-            if i < len(timestamps) and validate_pollutant_value(pollutant, value, city):
-                valid_count += 1
-                
+    records, valid_count, total_expected, error_counts = validate_hourly_columns(hourly, city)
     quality_score = valid_count / total_expected if total_expected > 0 else 0.0
     
     if quality_score < 0.5:
@@ -79,4 +173,9 @@ def validate_data_quality(data, city):
         ERRORS.labels(error_type="low_quality", city=city).inc()
         
     logger.info(f"Data quality for {city}: {quality_score:.2%} ({valid_count}/{total_expected})")
-    return quality_score > 0.5, quality_score
+    return quality_score > 0.5, quality_score, records, error_counts
+
+def validate_data_quality(data, city):
+    """Validate overall data quality and return quality score"""
+    is_valid, quality_score, _, _ = validate_payload(data, city)
+    return is_valid, quality_score
@@ -0,0 +1,92 @@
+"""Compare AvroDeserializer with AvroEventDecoder.
+
+Runs offline: payloads are produced by AvroSerializer against an in-memory
+registry. Reports records/sec for per-message AvroDeserializer calls and
+AvroEventDecoder.decode(), and checks the results match.
+
+Usage: python bench_avro.py [--records N]
+"""
+import argparse
+import json
+import random
+import time
+
+from confluent_kafka.schema_registry import Schema
+from confluent_kafka.schema_registry.avro import AvroDeserializer, AvroSerializer
+from confluent_kafka.serialization import SerializationContext, MessageField
+
+from common.avro_codec import AvroEventDecoder
+from rollups import POLLUTANTS
+
+SCHEMA = {
+    "namespace": "com.airquality",
+    "type": "record",
+    "name": "AirQualityEvent",
+    "fields": [
+        {"name": "city", "type": "string"},
+        {"name": "timestamp", "type": {"type": "long", "logicalType": "timestamp-millis"}},
+        *({"name": p, "type": ["null", "float"], "default": None} for p in POLLUTANTS),
+        {"name": "source", "type": "string"},
+        {"name": "ingest_time", "type": {"type": "long", "logicalType": "timestamp-millis"}},
+    ],
+}
+
+
+class InMemoryRegistry:
+    """The subset of SchemaRegistryClient the serializers call"""
+
+    def __init__(self):
+        self.schemas = {}
+
+    def register_schema(self, subject_name, schema, normalize_schemas=False):
+        # Like the registry, equivalent schemas share an ID regardless of formatting
+        canonical = json.dumps(json.loads(schema.schema_str), sort_keys=True)
+        return self.schemas.setdefault(canonical, len(self.schemas) + 1)
+
+    def get_schema(self, schema_id):
+        return next(Schema(s, "AVRO") for s, i in self.schemas.items() if i == schema_id)
+
+
+def sample_payloads(count, registry):
+    serializer = AvroSerializer(registry, json.dumps(SCHEMA))
+    ctx = SerializationContext("air_quality_events", MessageField.VALUE)
+    base = 1704067200000
+    return [
+        serializer({
+            "city": random.choice(["Nairobi", "Mombasa", "Kisumu", "Nakuru", "Eldoret"]),
+            "timestamp": base + i * 3600000,
+            **{p: (round(random.uniform(0, 100), 2) if random.random() > 0.1 else None) for p in POLLUTANTS},
+            "source": "open-meteo",
+            "ingest_time": base + i * 3600000 + 5000,
+        }, ctx)
+        for i in range(count)
+    ]
+
+
+def timed(label, count, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {count / elapsed:>12,.0f} records/s  ({elapsed * 1000:.0f} ms)")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Avro decoding of air quality events")
+    parser.add_argument("--records", type=int, default=200000)
+    args = parser.parse_args()
+
+    registry = InMemoryRegistry()
+    payloads = sample_payloads(args.records, registry)
+    deserializer = AvroDeserializer(registry)
+    decoder = AvroEventDecoder(registry)
+    ctx = SerializationContext("air_quality_events", MessageField.VALUE)
+
+    baseline = timed("AvroDeserializer", len(payloads), lambda: [deserializer(p, ctx) for p in payloads])
+    single = timed("AvroEventDecoder.decode", len(payloads), lambda: [decoder.decode(p) for p in payloads])
+    assert baseline == single, "decoders disagree"
+    print("Output identical across decoders")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,48 @@
 import time
-from cassandra.cluster import Cluster
+from cassandra import ConsistencyLevel
+from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+from cassandra.policies import DCAwareRoundRobinPolicy, TokenAwarePolicy
 from cassandra.query import SimpleStatement
-from config import CASSANDRA_HOSTS, CASSANDRA_KEYSPACE
+from config import (
+    CASSANDRA_HOSTS, CASSANDRA_KEYSPACE, CASSANDRA_LOCAL_DC, CASSANDRA_REQUEST_TIMEOUT_SECONDS, CASSANDRA_CONSISTENCY,
+    CASSANDRA_SCHEMA_PROFILE, CASSANDRA_REPLICATION, CASSANDRA_DEFAULT_TTL_SECONDS, CASSANDRA_COMPACTION_WINDOW_DAYS,
+    CASSANDRA_COMPRESSION, CASSANDRA_COMPRESSION_CHUNK_KB, CASSANDRA_ALTER_EXISTING,
+)
 from logger import get_logger
+from rollups import ROLLUP_TABLES, create_rollup_tables
 
 logger = get_logger()
 
 
+def replication_options():
+    """Keyspace replication map for the schema profile, as CQL"""
+    if CASSANDRA_SCHEMA_PROFILE != "timeseries":
+        return "{'class': 'SimpleStrategy', 'replication_factor': '1'}"
+    datacenters = [pair.split(":") for pair in CASSANDRA_REPLICATION.split(",") if pair.strip()]
+    dc_options = ", ".join(f"'{dc.strip()}': '{rf.strip()}'" for dc, rf in datacenters)
+    return f"{{'class': 'NetworkTopologyStrategy', {dc_options}}}"
+
+
+def timeseries_table_options():
+    """Table options for the hourly and rollup tables under the schema profile, as CQL (may be empty)"""
+    if CASSANDRA_SCHEMA_PROFILE != "timeseries":
+        return ""
+    # Rows arrive roughly in time order and expire together, so daily time
+    # windows let whole SSTables drop without compacting them again
+    return f"""
+        compaction = {{
+            'class': 'TimeWindowCompactionStrategy',
+            'compaction_window_unit': 'DAYS',
+            'compaction_window_size': '{CASSANDRA_COMPACTION_WINDOW_DAYS}'
+        }}
+        AND default_time_to_live = {CASSANDRA_DEFAULT_TTL_SECONDS}
+        AND compression = {{'class': '{CASSANDRA_COMPRESSION}', 'chunk_length_in_kb': '{CASSANDRA_COMPRESSION_CHUNK_KB}'}}
+    """
+
+
 def create_keyspace(session):
     query = f"""
-    CREATE KEYSPACE IF NOT EXISTS {CASSANDRA_KEYSPACE} WITH replication = {{
-        'class': 'SimpleStrategy',
-        'replication_factor': '1'
-    }};
+    CREATE KEYSPACE IF NOT EXISTS {CASSANDRA_KEYSPACE} WITH replication = {replication_options()};
     """
     session.execute(query)
     logger.info(f"Ensured keyspace {CASSANDRA_KEYSPACE} exists.")
@@ -33,19 +63,41 @@ def create_table(session):
         uv_index float,
         ingest_time timestamp,
         PRIMARY KEY ((city, date), hour)
-    ) WITH CLUSTERING ORDER BY (hour DESC);
+    ) WITH CLUSTERING ORDER BY (hour DESC){" AND " + timeseries_table_options() if timeseries_table_options() else ""};
     """
     session.execute(query)
     logger.info("Ensured table air_quality_by_city_date exists.")
 
 
+def schema_migration_statements():
+    """ALTER statements that bring an existing keyspace and table to the schema profile"""
+    statements = [f"ALTER KEYSPACE {CASSANDRA_KEYSPACE} WITH replication = {replication_options()}"]
+    if timeseries_table_options():
+        for table in ["air_quality_by_city_date", *ROLLUP_TABLES]:
+            statements.append(f"ALTER TABLE {CASSANDRA_KEYSPACE}.{table} WITH {timeseries_table_options()}")
+    return statements
+
+
+def alter_schema(session):
+    """Apply the schema profile to existing objects; CREATE ... IF NOT EXISTS never changes them"""
+    for statement in schema_migration_statements():
+        session.execute(statement)
+        logger.info(f"Applied: {' '.join(statement.split())}")
+
+
 def _connect_cluster():
     # CASSANDRA_HOSTS can be a comma-separated string or a list
     hosts = CASSANDRA_HOSTS
     if isinstance(hosts, str):
         # allow comma-separated host list in env/config
         hosts = [h.strip() for h in hosts.split(',') if h.strip()]
-    return Cluster(contact_points=hosts)
+    # Route each request to a replica of its partition, preferring the local datacenter
+    profile = ExecutionProfile(
+        load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy(local_dc=CASSANDRA_LOCAL_DC)),
+        request_timeout=CASSANDRA_REQUEST_TIMEOUT_SECONDS,
+        consistency_level=ConsistencyLevel.name_to_value[CASSANDRA_CONSISTENCY],
+    )
+    return Cluster(contact_points=hosts, execution_profiles={EXEC_PROFILE_DEFAULT: profile})
 
 
 def get_session(retries: int = 12, delay: int = 5):
@@ -68,6 +120,9 @@ def get_session(retries: int = 12, delay: int = 5):
             create_keyspace(session)
             session.set_keyspace(CASSANDRA_KEYSPACE)
             create_table(session)
+            create_rollup_tables(session, timeseries_table_options())
+            if CASSANDRA_ALTER_EXISTING:
+                alter_schema(session)
 
             logger.info("Cassandra session established.")
             return session
@@ -2,8 +2,76 @@ import os
 
 KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "kafka:9092")
 SCHEMA_REGISTRY_URL = os.getenv("SCHEMA_REGISTRY_URL", "http://schema-registry:8081")
+SCHEMA_CACHE_FILE = os.getenv("SCHEMA_CACHE_FILE", "/app/state/schema_cache.json")  # schema ID -> writer schema
+SCHEMA_LOOKUP_TIMEOUT_SECONDS = float(os.getenv("SCHEMA_LOOKUP_TIMEOUT_SECONDS", 30))  # registry retries for an unknown ID before dead-lettering
 KAFKA_TOPIC = os.getenv("KAFKA_TOPIC", "air_quality_events")
 KAFKA_CONSUMER_GROUP = os.getenv("KAFKA_CONSUMER_GROUP", "storage_service_group")
 
 CASSANDRA_HOSTS = os.getenv("CASSANDRA_HOSTS", "cassandra").split(",")
 CASSANDRA_KEYSPACE = os.getenv("CASSANDRA_KEYSPACE", "air_quality_keyspace")
+CASSANDRA_LOCAL_DC = os.getenv("CASSANDRA_LOCAL_DC")  # unset: the datacenter of the first contact point
+CASSANDRA_REQUEST_TIMEOUT_SECONDS = float(os.getenv("CASSANDRA_REQUEST_TIMEOUT_SECONDS", 10))
+CASSANDRA_CONSISTENCY = os.getenv("CASSANDRA_CONSISTENCY", "LOCAL_QUORUM")
+
+# Schema profile: "timeseries" (NetworkTopologyStrategy, daily TWCS, TTL, LZ4) or "default" (SimpleStrategy RF=1, table defaults)
+CASSANDRA_SCHEMA_PROFILE = os.getenv("CASSANDRA_SCHEMA_PROFILE", "timeseries")
+CASSANDRA_REPLICATION = os.getenv("CASSANDRA_REPLICATION", "datacenter1:1")  # comma-separated dc:rf pairs
+CASSANDRA_DEFAULT_TTL_SECONDS = int(os.getenv("CASSANDRA_DEFAULT_TTL_SECONDS", 63072000))  # 2 years; 0 disables
+CASSANDRA_COMPACTION_WINDOW_DAYS = int(os.getenv("CASSANDRA_COMPACTION_WINDOW_DAYS", 1))
+CASSANDRA_COMPRESSION = os.getenv("CASSANDRA_COMPRESSION", "LZ4Compressor")
+CASSANDRA_COMPRESSION_CHUNK_KB = int(os.getenv("CASSANDRA_COMPRESSION_CHUNK_KB", 16))
+# Apply the profile to an existing keyspace/tables at startup (python migrate_schema.py does it on demand)
+CASSANDRA_ALTER_EXISTING = os.getenv("CASSANDRA_ALTER_EXISTING", "false").lower() == "true"
+
+# Micro-batching: consume up to STORAGE_BATCH_SIZE messages (or wait STORAGE_BATCH_TIMEOUT_SECONDS) per write
+STORAGE_BATCH_SIZE = int(os.getenv("STORAGE_BATCH_SIZE", 500))
+STORAGE_BATCH_TIMEOUT_SECONDS = float(os.getenv("STORAGE_BATCH_TIMEOUT_SECONDS", 1.0))
+CASSANDRA_MAX_IN_FLIGHT = int(os.getenv("CASSANDRA_MAX_IN_FLIGHT", 64))  # concurrent write requests
+CASSANDRA_MAX_BATCH_ROWS = int(os.getenv("CASSANDRA_MAX_BATCH_ROWS", 50))  # rows per same-partition unlogged batch
+
+# At-least-once delivery: failed writes are retried with backoff, then dead-lettered
+STORAGE_MAX_RETRIES = int(os.getenv("STORAGE_MAX_RETRIES", 5))
+STORAGE_RETRY_BACKOFF_BASE_SECONDS = float(os.getenv("STORAGE_RETRY_BACKOFF_BASE_SECONDS", 0.5))
+STORAGE_RETRY_BACKOFF_MAX_SECONDS = float(os.getenv("STORAGE_RETRY_BACKOFF_MAX_SECONDS", 30))
+STORAGE_RETRY_QUEUE_MAX_ROWS = int(os.getenv("STORAGE_RETRY_QUEUE_MAX_ROWS", 10000))  # consumption pauses when full
+STORAGE_DLQ_TOPIC = os.getenv("STORAGE_DLQ_TOPIC", f"{KAFKA_TOPIC}_dlq")
+STORAGE_COMMIT_INTERVAL_SECONDS = float(os.getenv("STORAGE_COMMIT_INTERVAL_SECONDS", 5))  # 0 commits after every batch
+
+# Parallelism: STORAGE_WORKERS consumer processes join the same group (one per partition at most is useful)
+STORAGE_WORKERS = int(os.getenv("STORAGE_WORKERS", 1))
+STORAGE_WORKER_ID = os.getenv("STORAGE_WORKER_ID", "0")  # set by main.py for each worker process
+STORAGE_DRAIN_TIMEOUT_SECONDS = float(os.getenv("STORAGE_DRAIN_TIMEOUT_SECONDS", 10))  # retry budget for revoked partitions
+# A crashed worker is restarted after base * 2^(consecutive crashes), capped; a worker that ran for the cap resets it
+STORAGE_RESTART_BACKOFF_BASE_SECONDS = float(os.getenv("STORAGE_RESTART_BACKOFF_BASE_SECONDS", 1))
+STORAGE_RESTART_BACKOFF_MAX_SECONDS = float(os.getenv("STORAGE_RESTART_BACKOFF_MAX_SECONDS", 60))
+STARTUP_KAFKA_TIMEOUT_SECONDS = float(os.getenv("STARTUP_KAFKA_TIMEOUT_SECONDS", 10))  # broker metadata probe at startup
+LIVENESS_TIMEOUT_SECONDS = float(os.getenv("LIVENESS_TIMEOUT_SECONDS", 60))  # /health/live fails once the consume loop stalls this long
+STORAGE_METRICS_PORT = int(os.getenv("STORAGE_METRICS_PORT", 8002))  # worker N serves metrics on port + N
+# With STORAGE_WORKERS > 1 the supervisor serves its own metrics (worker restarts) on the port after the workers'
+STORAGE_SUPERVISOR_METRICS_PORT = int(os.getenv("STORAGE_SUPERVISOR_METRICS_PORT", STORAGE_METRICS_PORT + STORAGE_WORKERS))
+STORAGE_LAG_INTERVAL_SECONDS = float(os.getenv("STORAGE_LAG_INTERVAL_SECONDS", 15))
+
+# Daily/monthly rollups refreshed in the background for written days (python rollups.py rebuilds them)
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "true").lower() == "true"
+ROLLUP_DEBOUNCE_SECONDS = float(os.getenv("ROLLUP_DEBOUNCE_SECONDS", 5))  # days written within this window are refreshed once
+
+# Write notifications: partitions written per batch, used by the query API to invalidate its cache
+STORAGE_WRITES_TOPIC = os.getenv("STORAGE_WRITES_TOPIC", "air_quality_writes")  # empty disables
+
+# Query API
+QUERY_API_PORT = int(os.getenv("QUERY_API_PORT", 8010))
+QUERY_PAGE_SIZE = int(os.getenv("QUERY_PAGE_SIZE", 500))
+QUERY_MAX_CONCURRENCY = int(os.getenv("QUERY_MAX_CONCURRENCY", 32))  # partitions read in parallel per range query
+QUERY_MAX_RANGE_DAYS = int(os.getenv("QUERY_MAX_RANGE_DAYS", 366))
+QUERY_LATEST_LOOKBACK_DAYS = int(os.getenv("QUERY_LATEST_LOOKBACK_DAYS", 3))
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", 10000))
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", 60))  # current-day partitions
+QUERY_CACHE_PAST_TTL_SECONDS = float(os.getenv("QUERY_CACHE_PAST_TTL_SECONDS", 3600))  # earlier days change rarely
+
+# Logging: records are formatted and written by a background thread (see logger.py)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "json" for promtail/Loki
+LOG_FILE = os.getenv("LOG_FILE", "")  # stdout only unless set
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # records beyond this are dropped, not waited on
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", 5))  # per-record messages logged per key and interval
+LOG_SUMMARY_INTERVAL_SECONDS = float(os.getenv("LOG_SUMMARY_INTERVAL_SECONDS", 60))
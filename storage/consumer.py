@@ -1,43 +1,324 @@
-from confluent_kafka import DeserializingConsumer
+import time
+from datetime import datetime, timezone
+from confluent_kafka import Consumer, KafkaException, TopicPartition, TIMESTAMP_NOT_AVAILABLE
 from confluent_kafka.schema_registry import SchemaRegistryClient
-from confluent_kafka.schema_registry.avro import AvroDeserializer
-from repository import insert_air_quality_record
-from config import KAFKA_BOOTSTRAP_SERVERS, SCHEMA_REGISTRY_URL, KAFKA_TOPIC, KAFKA_CONSUMER_GROUP
-from logger import get_logger
+from common.avro_codec import AvroEventDecoder
+from dead_letter import DeadLetterProducer
+import repository
+from health import health, run_phases, startup_phase
+from repository import build_row, write_rows, is_retryable, refresh_rollups, stop_rollups
+from retry_queue import RetryQueue
+from write_notifications import WriteNotifier
+from config import (
+    KAFKA_BOOTSTRAP_SERVERS, SCHEMA_REGISTRY_URL, SCHEMA_CACHE_FILE, SCHEMA_LOOKUP_TIMEOUT_SECONDS,
+    KAFKA_TOPIC, KAFKA_CONSUMER_GROUP,
+    STORAGE_BATCH_SIZE, STORAGE_BATCH_TIMEOUT_SECONDS,
+    STORAGE_MAX_RETRIES, STORAGE_RETRY_BACKOFF_BASE_SECONDS, STORAGE_RETRY_BACKOFF_MAX_SECONDS,
+    STORAGE_RETRY_QUEUE_MAX_ROWS, STORAGE_DLQ_TOPIC, STORAGE_COMMIT_INTERVAL_SECONDS,
+    STORAGE_WORKER_ID, STORAGE_DRAIN_TIMEOUT_SECONDS, STORAGE_LAG_INTERVAL_SECONDS, STORAGE_WRITES_TOPIC,
+    STARTUP_KAFKA_TIMEOUT_SECONDS,
+)
+from logger import get_logger, SampledLog, PeriodicSummary
+from metrics import (
+    MESSAGES_CONSUMED, ROWS_WRITTEN, ROWS_DEAD_LETTERED, RETRY_QUEUE_ROWS, CONSUMER_LAG,
+    ASSIGNED_PARTITIONS, REBALANCES, BATCH_MESSAGES, WRITE_LATENCY, END_TO_END_LATENCY,
+)
 
 logger = get_logger()
+# Per-message failures are sampled and per-batch write lines rolled up into one line per interval
+sampled = SampledLog(logger)
+write_summary = PeriodicSummary(logger, "Wrote {rows} rows from {messages} messages ({batches} batches), {failed} failed")
 
-schema_registry_client = SchemaRegistryClient({"url": SCHEMA_REGISTRY_URL})
-avro_deserializer = AvroDeserializer(schema_registry_client)
-
+# Plain Consumer so messages can be fetched in batches with consume(); values are
+# decoded here a batch at a time instead of by DeserializingConsumer
 consumer_conf = {
     'bootstrap.servers': KAFKA_BOOTSTRAP_SERVERS,
     'group.id': KAFKA_CONSUMER_GROUP,
     'auto.offset.reset': 'earliest',
-    'key.deserializer': lambda k, ctx: k.decode('utf-8'),
-    'value.deserializer': avro_deserializer,
+    # Offsets are committed only up to messages stored in Cassandra or the dead-letter topic
+    'enable.auto.commit': False,
+    # Workers of the group only hand over the partitions that move during a rebalance
+    'partition.assignment.strategy': 'cooperative-sticky',
+    'client.id': f"storage-worker-{STORAGE_WORKER_ID}",
+    # Records committed offsets locally, so lag is computed without asking the group coordinator
+    'on_commit': lambda err, partitions: record_committed(partitions) if err is None else None,
 }
 
-consumer = DeserializingConsumer(consumer_conf)
-consumer.subscribe([KAFKA_TOPIC])
+retry_queue = RetryQueue(
+    STORAGE_RETRY_QUEUE_MAX_ROWS, STORAGE_MAX_RETRIES,
+    STORAGE_RETRY_BACKOFF_BASE_SECONDS, STORAGE_RETRY_BACKOFF_MAX_SECONDS,
+)
+
+# Kafka and registry clients, created by init()
+avro_decoder = None
+consumer = None
+dead_letter = None
+write_notifier = None
+
+# (topic, partition) -> next offset after the last consumed message
+_consumed = {}
+# (topic, partition) -> last offset this worker committed
+_committed = {}
+_last_commit = 0.0
+_last_lag_update = 0.0
+_paused = False
+
+def init_kafka():
+    """Create the Kafka clients and check that the brokers answer"""
+    global avro_decoder, consumer, dead_letter, write_notifier
+    # Writer schemas are cached on disk by ID, so known messages decode while the registry is down
+    schema_registry_client = SchemaRegistryClient({"url": SCHEMA_REGISTRY_URL})
+    avro_decoder = AvroEventDecoder(schema_registry_client, SCHEMA_CACHE_FILE, SCHEMA_LOOKUP_TIMEOUT_SECONDS)
+    consumer = Consumer(consumer_conf)
+    dead_letter = DeadLetterProducer(STORAGE_DLQ_TOPIC)
+    write_notifier = WriteNotifier(STORAGE_WRITES_TOPIC)
+    try:
+        consumer.list_topics(KAFKA_TOPIC, timeout=STARTUP_KAFKA_TIMEOUT_SECONDS)
+    except KafkaException as e:
+        # librdkafka keeps reconnecting in the background; consumption starts once it succeeds
+        logger.warning(f"Kafka metadata not available yet: {e}")
+
+def init():
+    """Connect to Cassandra and Kafka in parallel; returns once both are usable"""
+    with startup_phase("total"):
+        run_phases({"cassandra": repository.init, "kafka": init_kafka})
+    health.add_check("cassandra", repository.is_connected)
+
+def write_time_micros(msg):
+    """Cassandra write timestamp derived from the Kafka message timestamp"""
+    ts_type, ts = msg.timestamp()
+    if ts_type == TIMESTAMP_NOT_AVAILABLE or ts <= 0:
+        return None
+    return ts * 1000
+
+def decode_batch(messages):
+    """Deserialize a batch into (row, message) pairs; undecodable messages are dead-lettered"""
+    entries = []
+    valid = []
+    for msg in messages:
+        if msg.error():
+            sampled.error("consumer_error", f"Kafka consumer error: {msg.error()}")
+        else:
+            valid.append(msg)
+    for msg in valid:
+        try:
+            entries.append((build_row(avro_decoder.decode(msg.value()), write_time_micros(msg)), msg))
+        except Exception as e:
+            sampled.error("decode", f"Failed to decode message at {msg.topic()}[{msg.partition()}]@{msg.offset()}: {e}")
+            dead_letter.send(msg, e)
+            ROWS_DEAD_LETTERED.labels(worker=STORAGE_WORKER_ID, reason="decode").inc()
+    return entries
+
+def handle_failures(failures, attempts):
+    """Queue retryable failures for another attempt and dead-letter the rest"""
+    for entries, error in failures:
+        if is_retryable(error) and retry_queue.add(entries, attempts):
+            continue
+        logger.error(f"Dead-lettering {len(entries)} rows after {attempts} attempt(s): {error}")
+        for _, msg in entries:
+            dead_letter.send(msg, error, retry_count=attempts)
+        ROWS_DEAD_LETTERED.labels(worker=STORAGE_WORKER_ID, reason="write").inc(len(entries))
+
+def track_consumed(messages):
+    for msg in messages:
+        if msg.error():
+            continue
+        key = (msg.topic(), msg.partition())
+        _consumed[key] = max(_consumed.get(key, 0), msg.offset() + 1)
+
+def timed_write(entries):
+    """write_rows() plus write latency, row count and end-to-end latency of the rows that landed"""
+    start_time = time.time()
+    failures = write_rows(entries)
+    WRITE_LATENCY.labels(worker=STORAGE_WORKER_ID).observe(time.time() - start_time)
+
+    failed = {id(entry) for chunk, _ in failures for entry in chunk}
+    written = [entry[0] for entry in entries if id(entry) not in failed]
+    ROWS_WRITTEN.labels(worker=STORAGE_WORKER_ID).inc(len(written))
+    partitions = {(row[0], row[1]) for row in written}
+    refresh_rollups(partitions)
+    write_notifier.notify(partitions)
+    now = time.time()
+    for row in written:
+        # ingest_time is the last bound value before the write timestamp; the Avro
+        # decoder returns it timezone-aware, the millisecond fallback naive UTC
+        ingest_time = row[-2]
+        if isinstance(ingest_time, datetime):
+            if ingest_time.tzinfo is None:
+                ingest_time = ingest_time.replace(tzinfo=timezone.utc)
+            END_TO_END_LATENCY.labels(worker=STORAGE_WORKER_ID).observe(max(now - ingest_time.timestamp(), 0))
+    return failures
+
+def write_batch(messages):
+    """Write a batch; failed rows go to the retry queue or the dead-letter topic"""
+    track_consumed(messages)
+    MESSAGES_CONSUMED.labels(worker=STORAGE_WORKER_ID).inc(len(messages))
+    BATCH_MESSAGES.labels(worker=STORAGE_WORKER_ID).observe(len(messages))
+    entries = decode_batch(messages)
+    start_time = time.time()
+    failures = timed_write(entries)
+    handle_failures(failures, attempts=1)
+
+    failed_rows = sum(len(chunk) for chunk, _ in failures)
+    RETRY_QUEUE_ROWS.labels(worker=STORAGE_WORKER_ID).set(len(retry_queue))
+    duration = time.time() - start_time
+    logger.debug(
+        f"Wrote {len(entries) - failed_rows} rows from {len(messages)} messages in {duration * 1000:.0f}ms"
+        + (f", {failed_rows} failed ({failures[0][1]})" if failures else "")
+    )
+    write_summary.add(rows=len(entries) - failed_rows, messages=len(messages), batches=1, failed=failed_rows)
+
+def retry_due():
+    """Retry queued writes whose backoff has passed"""
+    for entry in retry_queue.pop_due():
+        handle_failures(timed_write(entry["items"]), entry["attempts"] + 1)
+    RETRY_QUEUE_ROWS.labels(worker=STORAGE_WORKER_ID).set(len(retry_queue))
+
+def apply_backpressure():
+    """Stop fetching while the retry queue is full, resume once it drains"""
+    global _paused
+    if retry_queue.full() and not _paused:
+        logger.warning(f"Retry queue holds {len(retry_queue)} rows; pausing consumption")
+        consumer.pause(consumer.assignment())
+        _paused = True
+    elif _paused and not retry_queue.full():
+        consumer.resume(consumer.assignment())
+        _paused = False
+
+def committable_offsets(pending, partitions=None):
+    """Offsets to commit: the consumed position, held back to the oldest row still pending"""
+    return [
+        TopicPartition(topic, partition, min(next_offset, pending.get((topic, partition), next_offset)))
+        for (topic, partition), next_offset in _consumed.items()
+        if partitions is None or (topic, partition) in partitions
+    ]
+
+def commit_offsets(force=False):
+    """Commit up to the first message that is not yet durable in Cassandra or the dead-letter topic"""
+    global _last_commit
+    now = time.monotonic()
+    if not _consumed or (not force and now - _last_commit < STORAGE_COMMIT_INTERVAL_SECONDS):
+        return
+    _last_commit = now
+    if not dead_letter.flush():
+        logger.error("Dead-letter topic has not acknowledged every message; postponing offset commit")
+        return
+    try:
+        committed = consumer.commit(offsets=committable_offsets(retry_queue.pending_offsets()), asynchronous=not force)
+        if committed:
+            record_committed(committed)
+    except KafkaException as e:
+        logger.error(f"Offset commit failed: {e}")
+
+def record_committed(partitions):
+    for tp in partitions:
+        if tp.error is None and tp.offset >= 0:
+            _committed[(tp.topic, tp.partition)] = tp.offset
+
+def record_lag(force=False):
+    """Publish per-partition lag: high watermark minus the committed offset.
+
+    Uses only local state (no broker round trip in the consume loop): the high
+    watermark cached from the last fetch and the offset this worker last
+    committed. Until a partition's first commit its consumed position stands
+    in, which under-reports lag by at most one commit interval.
+    """
+    global _last_lag_update
+    now = time.monotonic()
+    if not force and now - _last_lag_update < STORAGE_LAG_INTERVAL_SECONDS:
+        return
+    _last_lag_update = now
+    try:
+        assignment = consumer.assignment()
+        ASSIGNED_PARTITIONS.labels(worker=STORAGE_WORKER_ID).set(len(assignment))
+        if not assignment:
+            return
+        for tp in consumer.position(assignment):
+            _, high = consumer.get_watermark_offsets(tp, cached=True)
+            committed = _committed.get((tp.topic, tp.partition), tp.offset)
+            if high < 0 or committed < 0:
+                continue  # nothing fetched from this partition yet
+            CONSUMER_LAG.labels(worker=STORAGE_WORKER_ID, topic=tp.topic, partition=tp.partition).set(max(high - committed, 0))
+    except KafkaException as e:
+        logger.warning(f"Could not read consumer lag: {e}")
+
+def forget_partitions(partitions):
+    for topic, partition in partitions:
+        _consumed.pop((topic, partition), None)
+        _committed.pop((topic, partition), None)
+        try:
+            CONSUMER_LAG.remove(STORAGE_WORKER_ID, topic, partition)
+        except KeyError:
+            pass
+
+def on_assign(consumer, partitions):
+    REBALANCES.labels(worker=STORAGE_WORKER_ID, event="assign").inc()
+    logger.info(f"Assigned partitions {[tp.partition for tp in partitions]}")
+    if _paused:
+        consumer.pause(partitions)
+
+def on_revoke(consumer, partitions):
+    """Drain revoked partitions: retry their pending rows now and commit before another worker takes over"""
+    REBALANCES.labels(worker=STORAGE_WORKER_ID, event="revoke").inc()
+    revoked = {(tp.topic, tp.partition) for tp in partitions}
+    deadline = time.monotonic() + STORAGE_DRAIN_TIMEOUT_SECONDS
+    leftover = []
+    for entry in retry_queue.take_partitions(revoked):
+        if time.monotonic() >= deadline:
+            leftover.extend(entry["items"])
+            continue
+        for entries, error in timed_write(entry["items"]):
+            if is_retryable(error):
+                leftover.extend(entries)
+            else:
+                handle_failures([(entries, error)], entry["attempts"] + 1)
+
+    # Rows that still failed are left to the new owner, which replays from the committed offset
+    pending = {}
+    for _, msg in leftover:
+        key = (msg.topic(), msg.partition())
+        pending[key] = min(pending.get(key, msg.offset()), msg.offset())
+    if dead_letter.flush():
+        offsets = committable_offsets(pending, revoked)
+        if offsets:
+            try:
+                consumer.commit(offsets=offsets, asynchronous=False)
+            except KafkaException as e:
+                logger.error(f"Offset commit on revoke failed: {e}")
+    else:
+        logger.error("Dead-letter topic has not acknowledged every message; revoked partitions will be replayed")
+    forget_partitions(revoked)
+    RETRY_QUEUE_ROWS.labels(worker=STORAGE_WORKER_ID).set(len(retry_queue))
+    logger.info(f"Revoked partitions {sorted(p for _, p in revoked)} ({len(leftover)} rows left for replay)")
+
+def on_lost(consumer, partitions):
+    """Partitions already belong to another worker, so nothing is committed"""
+    REBALANCES.labels(worker=STORAGE_WORKER_ID, event="lost").inc()
+    lost = {(tp.topic, tp.partition) for tp in partitions}
+    retry_queue.take_partitions(lost)
+    forget_partitions(lost)
+    logger.warning(f"Lost partitions {sorted(p for _, p in lost)}")
 
 def consume_loop():
+    consumer.subscribe([KAFKA_TOPIC], on_assign=on_assign, on_revoke=on_revoke, on_lost=on_lost)
+    health.set_ready()
     try:
         while True:
-            msg = consumer.poll(1.0)
-            if msg is None:
-                continue
-            if msg.error():
-                logger.error(f"Kafka consumer error: {msg.error()}")
-                continue
-
-            record = msg.value()
-            try:
-                insert_air_quality_record(record)
-                logger.info(f"Inserted record for city {record['city']} at {record['timestamp']}")
-            except Exception as e:
-                logger.error(f"Failed to insert record: {e}")
+            health.heartbeat()
+            retry_due()
+            apply_backpressure()
+            messages = consumer.consume(num_messages=STORAGE_BATCH_SIZE, timeout=STORAGE_BATCH_TIMEOUT_SECONDS)
+            if messages:
+                write_batch(messages)
+            commit_offsets()
+            record_lag()
     except KeyboardInterrupt:
         logger.info("Shutdown requested, exiting...")
     finally:
+        health.set_ready(False)
+        # Rows still waiting for a retry are not committed and will be consumed again;
+        # close() leaves the group, which drains the remaining partitions through on_revoke
+        commit_offsets(force=True)
         consumer.close()
+        stop_rollups()
+        write_notifier.flush()
@@ -0,0 +1,66 @@
+from datetime import datetime
+from confluent_kafka import Producer, TIMESTAMP_NOT_AVAILABLE
+from config import KAFKA_BOOTSTRAP_SERVERS
+from logger import get_logger, SampledLog
+
+logger = get_logger()
+sampled = SampledLog(logger)
+
+
+class DeadLetterProducer:
+    """Publishes messages that could not be stored to a dead-letter topic.
+
+    The original key, Avro-encoded value and timestamp are forwarded
+    unchanged, so a dead-lettered message can be replayed onto the source
+    topic with its original event time; the failure is described in headers.
+    """
+
+    def __init__(self, topic):
+        self.topic = topic
+        self.producer = Producer({
+            'bootstrap.servers': KAFKA_BOOTSTRAP_SERVERS,
+            'enable.idempotence': True,
+            'acks': 'all',
+            'linger.ms': 50,
+            'compression.type': 'lz4',
+        })
+        # Messages the broker rejected; resent on the next flush
+        self.undelivered = []
+
+    def send(self, msg, error, retry_count=0):
+        """Queue one consumed message for the dead-letter topic"""
+        ts_type, timestamp = msg.timestamp()
+        if ts_type == TIMESTAMP_NOT_AVAILABLE or timestamp <= 0:
+            timestamp = 0  # let the producer stamp it
+        headers = [
+            ('error', str(error)[:1000].encode('utf-8')),
+            ('error_type', type(error).__name__.encode('utf-8')),
+            ('source_topic', msg.topic().encode('utf-8')),
+            ('source_partition', str(msg.partition()).encode('utf-8')),
+            ('source_offset', str(msg.offset()).encode('utf-8')),
+            ('source_timestamp', str(timestamp).encode('utf-8')),
+            ('retry_count', str(retry_count).encode('utf-8')),
+            ('failed_at', datetime.utcnow().isoformat().encode('utf-8')),
+        ]
+
+        def on_delivery(err, _):
+            if err is not None:
+                sampled.error("delivery", f"Failed to dead-letter message: {err}")
+                self.undelivered.append((msg, error, retry_count))
+
+        while True:
+            try:
+                self.producer.produce(self.topic, key=msg.key(), value=msg.value(), timestamp=timestamp,
+                                      headers=headers, on_delivery=on_delivery)
+                break
+            except BufferError:
+                self.producer.poll(0.1)
+        self.producer.poll(0)
+
+    def flush(self, timeout=30):
+        """Wait until every queued message is acknowledged; returns False if any is still undelivered"""
+        undelivered, self.undelivered = self.undelivered, []
+        for msg, error, retry_count in undelivered:
+            self.send(msg, error, retry_count)
+        remaining = self.producer.flush(timeout)
+        return remaining == 0 and not self.undelivered
@@ -0,0 +1,16 @@
+"""Health endpoints and startup phase timing of a storage worker; see common/health.py.
+
+/health/live fails once the consume loop has not beaten for LIVENESS_TIMEOUT_SECONDS.
+"""
+from common.health import HealthState
+from config import STORAGE_WORKER_ID, LIVENESS_TIMEOUT_SECONDS
+from logger import get_logger
+from metrics import STARTUP_PHASE_SECONDS, SERVICE_READY
+
+# Configures logging before the first startup phase logs
+get_logger()
+
+health = HealthState(LIVENESS_TIMEOUT_SECONDS, SERVICE_READY, STARTUP_PHASE_SECONDS, labels={"worker": STORAGE_WORKER_ID})
+startup_phase = health.startup_phase
+run_phases = health.run_phases
+start_health_server = health.start_server
@@ -1,12 +1,29 @@
+"""Logging for the storage service: common/logger.py configured from config.py.
+
+get_logger() sets this up on first use, so every worker process configures its own
+listener.
+"""
 import logging
-import sys
-
-def get_logger(name=__name__):
-    logger = logging.getLogger(name)
-    handler = logging.StreamHandler(sys.stdout)
-    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-    handler.setFormatter(formatter)
-    if not logger.hasHandlers():
-        logger.addHandler(handler)
-    logger.setLevel(logging.INFO)
-    return logger
\ No newline at end of file
+from common import logger as _shared
+from common.logger import JsonFormatter, SampledLog, PeriodicSummary, flush_summaries, shutdown_logging
+from config import (
+    LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_QUEUE_SIZE, LOG_SAMPLE_BURST, LOG_SUMMARY_INTERVAL_SECONDS, STORAGE_WORKER_ID,
+)
+
+SERVICE = "storage"
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, log_file=LOG_FILE):
+    """Route the root logger through a background queue listener; safe to call more than once"""
+    _shared.setup_logging(
+        SERVICE, level, fmt, log_file, fields={"worker": STORAGE_WORKER_ID}, queue_size=LOG_QUEUE_SIZE,
+        sample_burst=LOG_SAMPLE_BURST, summary_interval=LOG_SUMMARY_INTERVAL_SECONDS,
+        # The driver logs every connection and topology event at INFO
+        quiet_loggers={"cassandra": logging.WARNING},
+    )
+
+
+def get_logger(name=SERVICE):
+    """Service logger; configures logging on first use"""
+    setup_logging()
+    return logging.getLogger(name)
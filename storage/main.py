@@ -1,8 +1,101 @@
-from consumer import consume_loop
+import multiprocessing
+import os
+import signal
+import time
+from config import (
+    STORAGE_WORKERS, STORAGE_METRICS_PORT, STORAGE_SUPERVISOR_METRICS_PORT, STORAGE_DRAIN_TIMEOUT_SECONDS,
+    STORAGE_RESTART_BACKOFF_BASE_SECONDS, STORAGE_RESTART_BACKOFF_MAX_SECONDS,
+)
 from logger import get_logger
 
 logger = get_logger()
 
-if __name__ == "__main__":
-    logger.info("Starting storage service Kafka consumer...")
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_worker():
+    """Run one consumer; SIGTERM stops it through the same drain-and-commit path as Ctrl-C"""
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    worker_id = int(os.getenv("STORAGE_WORKER_ID", "0"))
+    # Imported here so the worker's config picks up its STORAGE_WORKER_ID
+    from consumer import init, consume_loop
+    from health import start_health_server
+
+    # Probes and metrics are served while Cassandra and Kafka are still connecting
+    start_health_server(STORAGE_METRICS_PORT + worker_id)
+    logger.info(f"Storage worker {worker_id} starting (pid {os.getpid()})")
+    init()
     consume_loop()
+
+
+def restart_delay(crashes, base=STORAGE_RESTART_BACKOFF_BASE_SECONDS, cap=STORAGE_RESTART_BACKOFF_MAX_SECONDS):
+    """Seconds to wait before restarting a worker after `crashes` consecutive quick exits"""
+    return min(base * 2 ** max(crashes - 1, 0), cap)
+
+
+def supervise(worker_count):
+    """Start worker processes in one consumer group and restart any that exit.
+
+    A worker that keeps exiting (e.g. Cassandra unreachable at startup) is
+    restarted with exponential backoff; the delay resets once a worker has run
+    for STORAGE_RESTART_BACKOFF_MAX_SECONDS.
+    """
+    from metrics import WORKER_RESTARTS, start_metrics_server
+    ctx = multiprocessing.get_context("spawn")
+    workers = {}
+    started_at = {}
+    crashes = {}
+    restart_at = {}  # worker_id -> monotonic time of the pending restart
+    stopping = False
+
+    def start(worker_id):
+        # Spawned processes inherit the environment at start time
+        os.environ["STORAGE_WORKER_ID"] = str(worker_id)
+        process = ctx.Process(target=run_worker, name=f"storage-worker-{worker_id}")
+        process.start()
+        workers[worker_id] = process
+        started_at[worker_id] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in workers.values():
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    start_metrics_server(STORAGE_SUPERVISOR_METRICS_PORT)
+    for worker_id in range(worker_count):
+        start(worker_id)
+
+    while not stopping:
+        now = time.monotonic()
+        for worker_id, process in list(workers.items()):
+            if stopping or process.is_alive() or worker_id in restart_at:
+                continue
+            ran = now - started_at[worker_id]
+            crashes[worker_id] = 1 if ran >= STORAGE_RESTART_BACKOFF_MAX_SECONDS else crashes.get(worker_id, 0) + 1
+            delay = restart_delay(crashes[worker_id])
+            restart_at[worker_id] = now + delay
+            WORKER_RESTARTS.labels(worker=str(worker_id)).inc()
+            logger.warning(f"Storage worker {worker_id} exited with code {process.exitcode} after {ran:.0f}s; "
+                           f"restarting in {delay:.0f}s")
+        for worker_id, due in list(restart_at.items()):
+            if now >= due and not stopping:
+                del restart_at[worker_id]
+                start(worker_id)
+        time.sleep(1)
+
+    for process in workers.values():
+        process.join(STORAGE_DRAIN_TIMEOUT_SECONDS + 30)
+    logger.info("All storage workers stopped")
+
+
+if __name__ == "__main__":
+    logger.info(f"Starting storage service Kafka consumer with {STORAGE_WORKERS} worker(s)...")
+    if STORAGE_WORKERS > 1:
+        supervise(STORAGE_WORKERS)
+    else:
+        run_worker()
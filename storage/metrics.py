@@ -0,0 +1,38 @@
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+MESSAGES_CONSUMED = Counter("storage_messages_consumed_total", "Kafka messages consumed", ["worker"])
+ROWS_WRITTEN = Counter("storage_rows_written_total", "Rows written to Cassandra", ["worker"])
+ROWS_DEAD_LETTERED = Counter("storage_rows_dead_lettered_total", "Messages sent to the dead-letter topic", ["worker", "reason"])
+RETRY_QUEUE_ROWS = Gauge("storage_retry_queue_rows", "Rows waiting for a write retry", ["worker"])
+CONSUMER_LAG = Gauge("kafka_consumer_lag", "Messages between the committed offset and the partition high watermark", ["worker", "topic", "partition"])
+ASSIGNED_PARTITIONS = Gauge("storage_assigned_partitions", "Partitions currently assigned to the worker", ["worker"])
+BATCH_MESSAGES = Histogram(
+    "storage_batch_messages", "Messages per consumed micro-batch", ["worker"],
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+WRITE_LATENCY = Histogram(
+    "storage_write_duration_seconds", "Time to write one micro-batch (or retry) to Cassandra", ["worker"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+END_TO_END_LATENCY = Histogram(
+    "storage_end_to_end_latency_seconds", "Time from the curated write in Mongo (event ingest_time) to the Cassandra write", ["worker"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900),
+)
+QUERY_CACHE_LOOKUPS = Counter("query_cache_lookups_total", "Query API partition cache lookups", ["result"])  # hit/miss
+QUERY_LATENCY = Histogram(
+    "query_duration_seconds", "Query API request duration", ["query"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+ROLLUP_PARTITIONS = Counter("rollup_statements_total", "Rollup reads and writes by table", ["table", "status"])
+ROLLUP_PENDING = Gauge("rollup_pending_partitions", "Written (city, date) partitions waiting for a rollup refresh")
+ROLLUP_LATENCY = Histogram(
+    "rollup_refresh_duration_seconds", "Time to refresh the rollups of one set of written partitions",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+STARTUP_PHASE_SECONDS = Gauge("service_startup_phase_seconds", "Duration of each startup phase of the last start", ["worker", "phase"])
+SERVICE_READY = Gauge("service_ready", "1 once startup finished and the service accepts work", ["worker"])
+REBALANCES = Counter("storage_rebalance_events_total", "Partition assignment changes", ["worker", "event"])  # assign/revoke/lost
+WORKER_RESTARTS = Counter("storage_worker_restarts_total", "Worker processes restarted by the supervisor after exiting", ["worker"])
+
+def start_metrics_server(port):
+    start_http_server(port)
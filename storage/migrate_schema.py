@@ -0,0 +1,44 @@
+"""Apply the configured Cassandra schema profile to an existing keyspace.
+
+CREATE ... IF NOT EXISTS never changes existing objects, so keyspaces created
+before the profile was introduced keep SimpleStrategy and default compaction
+until this runs. The new compaction strategy and TTL only affect newly
+written SSTables and rows.
+
+Usage: python migrate_schema.py [--dry-run]
+"""
+import argparse
+import sys
+from cassandra_session import _connect_cluster, schema_migration_statements
+from config import CASSANDRA_SCHEMA_PROFILE
+from logger import get_logger
+
+logger = get_logger()
+
+
+def migrate(dry_run=False):
+    statements = schema_migration_statements()
+    if dry_run:
+        for statement in statements:
+            print(" ".join(statement.split()) + ";")
+        return
+    cluster = _connect_cluster()
+    try:
+        session = cluster.connect()
+        for statement in statements:
+            session.execute(statement)
+            logger.info(f"Applied: {' '.join(statement.split())}")
+    finally:
+        cluster.shutdown()
+    logger.info(f"Schema profile '{CASSANDRA_SCHEMA_PROFILE}' applied. Run 'nodetool repair' if replication changed.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply the Cassandra schema profile to existing objects")
+    parser.add_argument("--dry-run", action="store_true", help="print the ALTER statements without running them")
+    args = parser.parse_args()
+    try:
+        migrate(args.dry_run)
+    except Exception as e:
+        logger.error(f"Schema migration failed: {e}")
+        sys.exit(1)
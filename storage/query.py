@@ -0,0 +1,175 @@
+import datetime
+import threading
+import time
+from collections import OrderedDict
+from config import (
+    QUERY_PAGE_SIZE, QUERY_MAX_CONCURRENCY, QUERY_MAX_RANGE_DAYS, QUERY_LATEST_LOOKBACK_DAYS,
+    QUERY_CACHE_MAX_ENTRIES, QUERY_CACHE_TTL_SECONDS, QUERY_CACHE_PAST_TTL_SECONDS,
+)
+from metrics import QUERY_CACHE_LOOKUPS, QUERY_LATENCY
+
+COLUMNS = ["city", "date", "hour", "pm2_5", "pm10", "ozone", "carbon_monoxide",
+           "nitrogen_dioxide", "sulphur_dioxide", "uv_index", "ingest_time"]
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a per-entry TTL.
+
+    Every invalidation takes the next generation number and records it for
+    its key. A reader takes generation() before it reads the source and
+    passes it to put(); a put for a key invalidated since then is dropped,
+    so a read that raced with a write never caches the old value.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # key -> generation of its last invalidation, bounded like the entries
+        self.invalidated = OrderedDict()
+        self.current = 0
+        # Highest generation dropped from `invalidated`; older puts of any key are refused
+        self.floor = 0
+        self.lock = threading.Lock()
+
+    def generation(self):
+        with self.lock:
+            return self.current
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, ttl, generation=None):
+        """Cache value unless key was invalidated after `generation`; returns whether it was stored"""
+        with self.lock:
+            if generation is not None and generation < max(self.invalidated.get(key, 0), self.floor):
+                return False
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return True
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.current += 1
+            self.invalidated[key] = self.current
+            self.invalidated.move_to_end(key)
+            while len(self.invalidated) > self.max_entries:
+                _, dropped = self.invalidated.popitem(last=False)
+                self.floor = max(self.floor, dropped)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class AirQualityQueries:
+    """Read path over air_quality_by_city_date with a per-partition cache.
+
+    Every query is answered from whole (city, date) partitions, so the
+    cache key is the partition and the storage consumer's write
+    notifications map directly onto cache invalidations.
+    """
+
+    def __init__(self, session, cache=None):
+        self.session = session
+        self.cache = cache or TTLCache(QUERY_CACHE_MAX_ENTRIES)
+        self.select_day = session.prepare(f"""
+            SELECT {", ".join(COLUMNS)} FROM air_quality_by_city_date WHERE city = ? AND date = ?
+        """)
+        self.select_daily = session.prepare("SELECT * FROM air_quality_daily_by_city WHERE city = ? AND year = ?")
+        self.select_monthly = session.prepare("SELECT * FROM air_quality_monthly_by_city WHERE city = ?")
+        for statement in (self.select_day, self.select_daily, self.select_monthly):
+            statement.fetch_size = QUERY_PAGE_SIZE
+
+    def invalidate(self, partitions):
+        """Drop cached (city, date) partitions after the consumer rewrote them"""
+        for city, date in partitions:
+            self.cache.invalidate((city, date))
+
+    def _ttl(self, date):
+        today = datetime.datetime.utcnow().strftime('%Y-%m-%d')
+        return QUERY_CACHE_TTL_SECONDS if date >= today else QUERY_CACHE_PAST_TTL_SECONDS
+
+    def _rows(self, result_set):
+        # Iterating the ResultSet fetches further pages as needed
+        return [
+            {k: v.isoformat() if isinstance(v, datetime.datetime) else v for k, v in row._asdict().items()}
+            for row in result_set
+        ]
+
+    def days(self, city, dates):
+        """Return {date: rows (hour descending)} for one city, reading uncached partitions concurrently"""
+        results = {}
+        misses = []
+        for date in dates:
+            rows = self.cache.get((city, date))
+            if rows is None:
+                misses.append(date)
+            else:
+                results[date] = rows
+        QUERY_CACHE_LOOKUPS.labels(result="hit").inc(len(dates) - len(misses))
+        QUERY_CACHE_LOOKUPS.labels(result="miss").inc(len(misses))
+
+        # Fan out with execute_async, at most QUERY_MAX_CONCURRENCY partitions in flight
+        for start in range(0, len(misses), QUERY_MAX_CONCURRENCY):
+            window = misses[start:start + QUERY_MAX_CONCURRENCY]
+            # Partitions rewritten while these reads run are not cached
+            generation = self.cache.generation()
+            futures = [(date, self.session.execute_async(self.select_day, (city, date))) for date in window]
+            for date, future in futures:
+                rows = self._rows(future.result())
+                self.cache.put((city, date), rows, self._ttl(date), generation)
+                results[date] = rows
+        return results
+
+    def day(self, city, date):
+        """All hourly rows of one (city, date) partition"""
+        with QUERY_LATENCY.labels(query="day").time():
+            return self.days(city, [date])[date]
+
+    def date_range(self, city, start_date, end_date):
+        """Hourly rows from start_date to end_date inclusive, oldest first"""
+        with QUERY_LATENCY.labels(query="range").time():
+            start = datetime.date.fromisoformat(start_date)
+            end = datetime.date.fromisoformat(end_date)
+            span = (end - start).days + 1
+            if span <= 0 or span > QUERY_MAX_RANGE_DAYS:
+                raise ValueError(f"Range must cover 1 to {QUERY_MAX_RANGE_DAYS} days")
+            dates = [(start + datetime.timedelta(days=i)).isoformat() for i in range(span)]
+            by_date = self.days(city, dates)
+            return [row for date in dates for row in reversed(by_date[date])]
+
+    def daily_rollups(self, city, year):
+        """Daily stats rows of one city and year, newest first (one partition)"""
+        with QUERY_LATENCY.labels(query="daily").time():
+            return self._rows(self.session.execute(self.select_daily, (city, int(year))))
+
+    def monthly_rollups(self, city):
+        """Monthly stats rows of one city, newest first (one partition)"""
+        with QUERY_LATENCY.labels(query="monthly").time():
+            return self._rows(self.session.execute(self.select_monthly, (city,)))
+
+    def latest(self, city):
+        """Most recent hourly row up to now for a city, looking back QUERY_LATEST_LOOKBACK_DAYS days"""
+        with QUERY_LATENCY.labels(query="latest").time():
+            now = datetime.datetime.utcnow()
+            for offset in range(QUERY_LATEST_LOOKBACK_DAYS):
+                date = (now.date() - datetime.timedelta(days=offset)).isoformat()
+                rows = self.days(city, [date])[date]
+                if offset == 0:
+                    # Today's partition also holds forecast hours
+                    rows = [row for row in rows if row["hour"] <= now.hour]
+                if rows:
+                    # Partitions are clustered by hour descending
+                    return rows[0]
+            return None
@@ -0,0 +1,111 @@
+"""HTTP query API over the Cassandra air quality tables.
+
+Endpoints (JSON):
+    GET /cities/<city>/latest
+    GET /cities/<city>/days/<YYYY-MM-DD>
+    GET /cities/<city>/range?start=<YYYY-MM-DD>&end=<YYYY-MM-DD>
+    GET /cities/<city>/daily?year=<YYYY>
+    GET /cities/<city>/monthly
+    GET /metrics
+    GET /health/live
+    GET /health/ready
+
+The server starts listening before Cassandra is reachable; queries answer
+503 until the session is up.
+
+Usage: python query_api.py
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from cassandra_session import get_session
+from config import QUERY_API_PORT, STORAGE_WRITES_TOPIC
+from health import health, startup_phase
+from logger import get_logger
+from query import AirQualityQueries
+from write_notifications import listen_for_writes
+
+logger = get_logger()
+
+queries = None
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+
+    def _send(self, status, body, content_type="application/json"):
+        payload = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [unquote(p) for p in url.path.strip("/").split("/")]
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        try:
+            if parts == ["metrics"]:
+                self._send(200, generate_latest(), CONTENT_TYPE_LATEST)
+            elif parts in (["health", "live"], ["health", "ready"]):
+                ok, detail = health.liveness() if parts[1] == "live" else health.readiness()
+                self._send(200 if ok else 503, {"status": "ok" if ok else "unavailable", **detail})
+            elif queries is None:
+                self._send(503, {"error": "starting up"})
+            elif len(parts) == 3 and parts[0] == "cities" and parts[2] == "latest":
+                row = queries.latest(parts[1])
+                self._send(200 if row else 404, row or {"error": "no recent readings"})
+            elif len(parts) == 4 and parts[0] == "cities" and parts[2] == "days":
+                self._send(200, queries.day(parts[1], parts[3]))
+            elif len(parts) == 3 and parts[0] == "cities" and parts[2] == "range":
+                self._send(200, queries.date_range(parts[1], params["start"], params["end"]))
+            elif len(parts) == 3 and parts[0] == "cities" and parts[2] == "daily":
+                self._send(200, queries.daily_rollups(parts[1], params["year"]))
+            elif len(parts) == 3 and parts[0] == "cities" and parts[2] == "monthly":
+                self._send(200, queries.monthly_rollups(parts[1]))
+            else:
+                self._send(404, {"error": "not found"})
+        except (KeyError, ValueError) as e:
+            self._send(400, {"error": f"bad request: {e}"})
+        except Exception as e:
+            logger.error(f"Query {self.path} failed: {e}")
+            self._send(500, {"error": "query failed"})
+
+    def log_message(self, format, *args):
+        # Dashboards poll every few seconds; keep request lines out of the service log
+        pass
+
+
+def connect(retry_delay=5):
+    """Open the Cassandra session in the background, then start serving queries"""
+    global queries
+    while queries is None:
+        try:
+            with startup_phase("cassandra"):
+                session = get_session()
+                queries = AirQualityQueries(session)
+        except Exception as e:
+            logger.error(f"Query API could not connect to Cassandra, retrying: {e}")
+            time.sleep(retry_delay)
+    health.add_check("cassandra", lambda: not session.is_shutdown and bool(session.get_pool_state()))
+    health.set_ready()
+    if STORAGE_WRITES_TOPIC:
+        threading.Thread(
+            target=listen_for_writes, args=(STORAGE_WRITES_TOPIC, queries.invalidate),
+            name="write-notifications", daemon=True,
+        ).start()
+
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer(("0.0.0.0", QUERY_API_PORT), QueryHandler)
+    threading.Thread(target=connect, name="cassandra-connect", daemon=True).start()
+    logger.info(f"Query API listening on port {QUERY_API_PORT}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutdown requested, exiting...")
+    finally:
+        server.server_close()
@@ -1,21 +1,66 @@
 from cassandra_session import get_session
+from cassandra import OperationTimedOut, WriteTimeout, WriteFailure, Unavailable
+from cassandra.cluster import NoHostAvailable
+from cassandra.concurrent import execute_concurrent
+from cassandra.protocol import OverloadedErrorMessage
+from cassandra.query import BatchStatement, BatchType, UNSET_VALUE
+from config import CASSANDRA_MAX_IN_FLIGHT, CASSANDRA_MAX_BATCH_ROWS, ROLLUPS_ENABLED, ROLLUP_DEBOUNCE_SECONDS
+from rollups import RollupRefresher, RollupWriter, POLLUTANTS
+from logger import get_logger
 import datetime
+import time
 
-session = get_session()
+logger = get_logger()
 
-insert_stmt = session.prepare("""
-    INSERT INTO air_quality_by_city_date (city, date, hour, pm2_5, pm10, ozone, carbon_monoxide,
-                                         nitrogen_dioxide, sulphur_dioxide, uv_index, ingest_time)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-""")
+# Set by init(), so importing this module never waits for Cassandra
+session = None
+insert_stmt = None
+rollup_refresher = None
 
-def insert_air_quality_record(record):
+RETRYABLE_ERRORS = (OperationTimedOut, WriteTimeout, WriteFailure, Unavailable, NoHostAvailable, OverloadedErrorMessage)
+
+def init():
+    """Connect to Cassandra and prepare the write statements; blocks until the cluster answers"""
+    global session, insert_stmt, rollup_refresher
+    new_session = get_session()
+    # The write timestamp is bound explicitly so a replayed or retried message writes
+    # identical cells and never overwrites a newer reading of the same hour
+    statement = new_session.prepare("""
+        INSERT INTO air_quality_by_city_date (city, date, hour, pm2_5, pm10, ozone, carbon_monoxide,
+                                             nitrogen_dioxide, sulphur_dioxide, uv_index, ingest_time)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        USING TIMESTAMP ?
+    """)
+    statement.is_idempotent = True
+    rollup_refresher = RollupRefresher(RollupWriter(new_session), ROLLUP_DEBOUNCE_SECONDS) if ROLLUPS_ENABLED else None
+    insert_stmt = statement
+    session = new_session
+    return session
+
+def is_connected():
+    """Whether init() finished and the driver still has a live connection"""
+    return session is not None and not session.is_shutdown and bool(session.get_pool_state())
+
+def is_retryable(error):
+    """Whether a failed write is worth retrying (timeouts, unavailable or overloaded nodes)"""
+    return isinstance(error, RETRYABLE_ERRORS)
+
+def unset_if_none(value):
+    return UNSET_VALUE if value is None else value
+
+def build_row(record, write_time=None):
+    """Convert a Kafka record into the bound values of insert_stmt.
+
+    `write_time` is the Cassandra write timestamp in microseconds; it
+    defaults to now. Missing pollutants are bound as UNSET_VALUE rather than
+    null, so they write no tombstone and leave any stored value in place.
+    """
     # Handle both datetime objects and millisecond timestamps
     if isinstance(record['timestamp'], datetime.datetime):
         ts = record['timestamp']
     else:
         ts = datetime.datetime.utcfromtimestamp(record['timestamp'] / 1000)
-    
+
     date_str = ts.strftime('%Y-%m-%d')
     hour = ts.hour
 
@@ -28,16 +73,68 @@ def insert_air_quality_record(record):
     else:
         ingest_time = None
 
-    session.execute(insert_stmt, (
+    return (
         record['city'],
         date_str,
         hour,
-        record.get('pm2_5'),
-        record.get('pm10'),
-        record.get('ozone'),
-        record.get('carbon_monoxide'),
-        record.get('nitrogen_dioxide'),
-        record.get('sulphur_dioxide'),
-        record.get('uv_index'),
-        ingest_time
-    ))
+        *(unset_if_none(record.get(p)) for p in POLLUTANTS),
+        unset_if_none(ingest_time),
+        write_time if write_time is not None else int(time.time() * 1_000_000)
+    )
+
+def insert_air_quality_record(record):
+    session.execute(insert_stmt, build_row(record))
+
+def build_statements(entries):
+    """Group (row, source) entries by partition (city, date) into unlogged batches.
+
+    Rows of one partition go to a single replica set, so an unlogged batch
+    costs one round trip without the batchlog. Partitions with a single row
+    are sent as plain bound statements. `source` is whatever the caller needs
+    back on failure. Returns (statement, params, entries) tuples.
+    """
+    partitions = {}
+    for entry in entries:
+        row = entry[0]
+        partitions.setdefault((row[0], row[1]), []).append(entry)
+
+    statements = []
+    for partition_entries in partitions.values():
+        for start in range(0, len(partition_entries), CASSANDRA_MAX_BATCH_ROWS):
+            chunk = partition_entries[start:start + CASSANDRA_MAX_BATCH_ROWS]
+            if len(chunk) == 1:
+                statements.append((insert_stmt, chunk[0][0], chunk))
+                continue
+            batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+            for row, _ in chunk:
+                batch.add(insert_stmt, row)
+            statements.append((batch, (), chunk))
+    return statements
+
+def write_rows(entries, max_in_flight=CASSANDRA_MAX_IN_FLIGHT):
+    """Write (row, source) entries concurrently with at most max_in_flight requests outstanding.
+
+    Returns a list of (entries, exception) for the statements that failed.
+    """
+    statements = build_statements(entries)
+    results = execute_concurrent(
+        session,
+        [(statement, params) for statement, params, _ in statements],
+        concurrency=max_in_flight,
+        raise_on_first_error=False,
+    )
+    return [
+        (chunk, result)
+        for (_, _, chunk), (success, result) in zip(statements, results)
+        if not success
+    ]
+
+def refresh_rollups(partitions):
+    """Queue written (city, date) partitions for a background rollup refresh"""
+    if rollup_refresher is not None:
+        rollup_refresher.submit(partitions)
+
+def stop_rollups():
+    """Refresh the rollups still pending and stop the background refresher"""
+    if rollup_refresher is not None:
+        rollup_refresher.stop()
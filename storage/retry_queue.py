@@ -0,0 +1,68 @@
+import random
+import time
+from collections import deque
+
+
+class RetryQueue:
+    """Bounded queue of failed writes waiting for a backoff retry.
+
+    Each entry is a list of (row, message) pairs plus the number of attempts
+    made so far. The queue holds at most `max_rows` rows; the consumer pauses
+    fetching while it is full.
+    """
+
+    def __init__(self, max_rows, max_retries, backoff_base, backoff_max):
+        self.max_rows = max_rows
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.entries = deque()
+        self.rows = 0
+
+    def __len__(self):
+        return self.rows
+
+    def full(self):
+        return self.rows >= self.max_rows
+
+    def add(self, items, attempts):
+        """Schedule items for another attempt; returns False once retries are exhausted"""
+        if attempts > self.max_retries:
+            return False
+        # Full-jitter exponential backoff
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempts)))
+        self.entries.append({"items": items, "attempts": attempts, "due": time.monotonic() + delay})
+        self.rows += len(items)
+        return True
+
+    def pop_due(self, now=None):
+        """Remove and return the entries whose backoff has passed"""
+        now = time.monotonic() if now is None else now
+        due = [entry for entry in self.entries if entry["due"] <= now]
+        if due:
+            self.entries = deque(entry for entry in self.entries if entry["due"] > now)
+            self.rows -= sum(len(entry["items"]) for entry in due)
+        return due
+
+    def pending_offsets(self):
+        """Return {(topic, partition): lowest offset still waiting for a retry}"""
+        offsets = {}
+        for entry in self.entries:
+            for _, msg in entry["items"]:
+                key = (msg.topic(), msg.partition())
+                offsets[key] = min(offsets.get(key, msg.offset()), msg.offset())
+        return offsets
+
+    def take_partitions(self, partitions):
+        """Remove and return the entries of the given (topic, partition) keys, e.g. on revoke"""
+        taken, kept = [], deque()
+        for entry in self.entries:
+            items = [(row, msg) for row, msg in entry["items"] if (msg.topic(), msg.partition()) in partitions]
+            rest = [(row, msg) for row, msg in entry["items"] if (msg.topic(), msg.partition()) not in partitions]
+            if items:
+                taken.append({**entry, "items": items})
+            if rest:
+                kept.append({**entry, "items": rest})
+        self.entries = kept
+        self.rows = sum(len(entry["items"]) for entry in kept)
+        return taken
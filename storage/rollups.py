@@ -0,0 +1,304 @@
+"""Daily and monthly rollups of air_quality_by_city_date.
+
+Rollups are recomputed from source rows for every (city, date) partition
+the consumer writes, rather than adjusted incrementally, so replayed or
+re-upserted hours never double count. The consumer hands written partitions
+to a RollupRefresher, which refreshes them on a background thread. The same
+code rebuilds them offline:
+
+Usage: python rollups.py [--city NAME] [--start YYYY-MM-DD] [--end YYYY-MM-DD]
+"""
+import argparse
+import datetime
+import sys
+import threading
+import time
+from cassandra.concurrent import execute_concurrent_with_args
+from cassandra.query import UNSET_VALUE
+from config import CASSANDRA_KEYSPACE, CASSANDRA_MAX_IN_FLIGHT
+from logger import get_logger
+from metrics import ROLLUP_PARTITIONS, ROLLUP_PENDING, ROLLUP_LATENCY
+
+logger = get_logger()
+
+ROLLUP_TABLES = ["air_quality_daily_by_city", "air_quality_monthly_by_city"]
+POLLUTANTS = ["pm2_5", "pm10", "ozone", "carbon_monoxide", "nitrogen_dioxide", "sulphur_dioxide", "uv_index"]
+STAT_COLUMNS = [f"{p}_{stat}" for p in POLLUTANTS for stat in ("min", "max", "avg", "count")]
+
+# US EPA PM2.5 (24-hour) breakpoints: (concentration low, high, index low, high)
+PM25_AQI_BREAKPOINTS = [
+    (0.0, 9.0, 0, 50),
+    (9.1, 35.4, 51, 100),
+    (35.5, 55.4, 101, 150),
+    (55.5, 125.4, 151, 200),
+    (125.5, 225.4, 201, 300),
+    (225.5, 325.4, 301, 500),
+]
+
+
+def _stat_columns_ddl():
+    return ",\n        ".join(
+        f"{p}_min float, {p}_max float, {p}_avg float, {p}_count int" for p in POLLUTANTS
+    )
+
+
+def create_rollup_tables(session, options=""):
+    """Create the rollup tables; `options` are extra CQL table options (see cassandra_session)"""
+    extra = f" AND {options}" if options else ""
+    session.execute(f"""
+    CREATE TABLE IF NOT EXISTS {CASSANDRA_KEYSPACE}.air_quality_daily_by_city (
+        city text,
+        year int,
+        date text,
+        hours int,
+        {_stat_columns_ddl()},
+        aqi int,
+        updated_at timestamp,
+        PRIMARY KEY ((city, year), date)
+    ) WITH CLUSTERING ORDER BY (date DESC){extra};
+    """)
+    session.execute(f"""
+    CREATE TABLE IF NOT EXISTS {CASSANDRA_KEYSPACE}.air_quality_monthly_by_city (
+        city text,
+        month text,
+        days int,
+        hours int,
+        {_stat_columns_ddl()},
+        aqi_avg float,
+        aqi_max int,
+        updated_at timestamp,
+        PRIMARY KEY ((city), month)
+    ) WITH CLUSTERING ORDER BY (month DESC){extra};
+    """)
+    logger.info("Ensured rollup tables air_quality_daily_by_city and air_quality_monthly_by_city exist.")
+
+
+def pm25_aqi(concentration):
+    """AQI for a 24-hour mean PM2.5 concentration (µg/m³), or None"""
+    if concentration is None:
+        return None
+    c = round(concentration, 1)
+    for c_low, c_high, i_low, i_high in PM25_AQI_BREAKPOINTS:
+        if c <= c_high:
+            return round((i_high - i_low) / (c_high - c_low) * (max(c, c_low) - c_low) + i_low)
+    return 500
+
+
+def _combine(stats, values):
+    """Fold per-pollutant (min, max, avg, count) tuples into stats"""
+    for p in POLLUTANTS:
+        low, high, avg, count = values[p]
+        if not count:
+            continue
+        s = stats.setdefault(p, [low, high, 0.0, 0])
+        s[0] = min(s[0], low)
+        s[1] = max(s[1], high)
+        s[2] += avg * count
+        s[3] += count
+
+
+def _stat_values(stats):
+    values = []
+    for p in POLLUTANTS:
+        s = stats.get(p)
+        values.extend([s[0], s[1], s[2] / s[3], s[3]] if s else [None, None, None, 0])
+    return values
+
+
+def daily_stats(rows):
+    """Per-pollutant stats of one day's hourly rows, in STAT_COLUMNS order"""
+    stats = {}
+    for row in rows:
+        _combine(stats, {p: (v, v, v, 1) if v is not None else (None, None, None, 0)
+                         for p, v in ((p, getattr(row, p)) for p in POLLUTANTS)})
+    return _stat_values(stats)
+
+
+def monthly_stats(daily_rows):
+    """Per-pollutant stats of a month from its daily rollups, weighting means by hour counts"""
+    stats = {}
+    for row in daily_rows:
+        _combine(stats, {p: (getattr(row, f"{p}_min"), getattr(row, f"{p}_max"),
+                             getattr(row, f"{p}_avg"), getattr(row, f"{p}_count") or 0) for p in POLLUTANTS})
+    return _stat_values(stats)
+
+
+def _unset_nulls(params):
+    # Unset rather than null columns, so no tombstones are written
+    return tuple(UNSET_VALUE if value is None else value for value in params)
+
+
+class RollupWriter:
+    """Recomputes daily and monthly rollups for the partitions a batch wrote"""
+
+    def __init__(self, session, max_in_flight=CASSANDRA_MAX_IN_FLIGHT):
+        self.session = session
+        self.max_in_flight = max_in_flight
+        self.select_hours = session.prepare(f"""
+            SELECT {", ".join(POLLUTANTS)} FROM air_quality_by_city_date WHERE city = ? AND date = ?
+        """)
+        self.insert_daily = session.prepare(f"""
+            INSERT INTO air_quality_daily_by_city (city, year, date, hours, {", ".join(STAT_COLUMNS)}, aqi, updated_at)
+            VALUES ({", ".join(["?"] * (len(STAT_COLUMNS) + 6))})
+        """)
+        self.select_month_days = session.prepare(f"""
+            SELECT {", ".join(STAT_COLUMNS)}, hours, aqi FROM air_quality_daily_by_city
+            WHERE city = ? AND year = ? AND date >= ? AND date <= ?
+        """)
+        self.insert_monthly = session.prepare(f"""
+            INSERT INTO air_quality_monthly_by_city (city, month, days, hours, {", ".join(STAT_COLUMNS)}, aqi_avg, aqi_max, updated_at)
+            VALUES ({", ".join(["?"] * (len(STAT_COLUMNS) + 7))})
+        """)
+        for statement in (self.insert_daily, self.insert_monthly):
+            statement.is_idempotent = True
+
+    def _run(self, statement, params, table):
+        """Execute statement for every params tuple concurrently; returns the successful results"""
+        results = execute_concurrent_with_args(
+            self.session, statement, params, concurrency=self.max_in_flight, raise_on_first_error=False,
+        )
+        succeeded = [result for success, result in results if success]
+        failed = len(params) - len(succeeded)
+        ROLLUP_PARTITIONS.labels(table=table, status="success").inc(len(succeeded))
+        if failed:
+            ROLLUP_PARTITIONS.labels(table=table, status="fail").inc(failed)
+            error = next(result for success, result in results if not success)
+            logger.warning(f"{failed}/{len(params)} {table} rollup statements failed: {error}")
+        return results
+
+    def refresh(self, partitions):
+        """Recompute rollups for a set of (city, date) partitions; returns False if any step failed"""
+        partitions = sorted(partitions)
+        if not partitions:
+            return True
+        start_time = time.time()
+        now = datetime.datetime.utcnow()
+
+        daily_params = []
+        for (city, date), (success, rows) in zip(partitions, self._run(self.select_hours, partitions, "hourly_read")):
+            if not success:
+                continue
+            rows = list(rows)
+            stats = daily_stats(rows)
+            aqi = pm25_aqi(stats[POLLUTANTS.index("pm2_5") * 4 + 2])
+            daily_params.append((city, int(date[:4]), date, len(rows), *stats, aqi, now))
+        daily_results = self._run(self.insert_daily, [_unset_nulls(p) for p in daily_params], "daily")
+
+        months = sorted({(params[0], params[2][:7]) for params, (success, _) in zip(daily_params, daily_results) if success})
+        month_reads = [(city, int(month[:4]), f"{month}-01", f"{month}-31") for city, month in months]
+        monthly_params = []
+        for (city, month), (success, rows) in zip(months, self._run(self.select_month_days, month_reads, "daily_read")):
+            if not success:
+                continue
+            rows = list(rows)
+            aqis = [row.aqi for row in rows if row.aqi is not None]
+            monthly_params.append((
+                city, month, len(rows), sum(row.hours or 0 for row in rows), *monthly_stats(rows),
+                sum(aqis) / len(aqis) if aqis else None, max(aqis) if aqis else None, now,
+            ))
+        monthly_results = self._run(self.insert_monthly, [_unset_nulls(p) for p in monthly_params], "monthly")
+
+        ROLLUP_LATENCY.observe(time.time() - start_time)
+        return (len(daily_params) == len(partitions) and len(monthly_params) == len(months)
+                and all(success for success, _ in daily_results)
+                and all(success for success, _ in monthly_results))
+
+
+class RollupRefresher:
+    """Refreshes rollups on a background thread, off the consumer's write path.
+
+    submit() only records the written (city, date) partitions. The thread
+    waits `debounce` seconds after the first one arrives, so a day written
+    by many batches in a row is refreshed once. stop() refreshes whatever
+    is still pending.
+    """
+
+    def __init__(self, writer, debounce):
+        self.writer = writer
+        self.debounce = debounce
+        self.pending = set()
+        self.stopping = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name="rollup-refresh", daemon=True)
+        self.thread.start()
+
+    def submit(self, partitions):
+        if not partitions:
+            return
+        with self.condition:
+            self.pending.update(partitions)
+            ROLLUP_PENDING.set(len(self.pending))
+            self.condition.notify()
+
+    def _take(self):
+        """Wait for partitions plus the debounce window; returns them, or None once stopped and drained"""
+        with self.condition:
+            while not self.pending and not self.stopping:
+                self.condition.wait()
+            deadline = time.monotonic() + self.debounce
+            while not self.stopping and time.monotonic() < deadline:
+                self.condition.wait(deadline - time.monotonic())
+            partitions, self.pending = self.pending, set()
+            ROLLUP_PENDING.set(0)
+        return partitions or None
+
+    def _run(self):
+        while True:
+            partitions = self._take()
+            if partitions is None:
+                return
+            try:
+                self.writer.refresh(partitions)
+            except Exception as e:
+                # Rollups are derived data; the next write to the day or a rebuild repairs them
+                logger.warning(f"Rollup refresh of {len(partitions)} days failed: {e}")
+
+    def stop(self, timeout=30):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.thread.join(timeout)
+
+
+def source_partitions(session, city=None, start=None, end=None):
+    """Enumerate (city, date) partitions of air_quality_by_city_date, optionally filtered"""
+    for row in session.execute("SELECT DISTINCT city, date FROM air_quality_by_city_date"):
+        if city and row.city != city:
+            continue
+        if (start and row.date < start) or (end and row.date > end):
+            continue
+        yield row.city, row.date
+
+
+def rebuild(session, city=None, start=None, end=None, batch_size=500):
+    """Recompute every rollup from the hourly table; returns the number of days refreshed"""
+    writer = RollupWriter(session)
+    start_time = time.time()
+    refreshed = 0
+    batch = []
+    for partition in source_partitions(session, city, start, end):
+        batch.append(partition)
+        if len(batch) >= batch_size:
+            writer.refresh(batch)
+            refreshed += len(batch)
+            batch = []
+            logger.info(f"Rebuilt rollups for {refreshed} days")
+    writer.refresh(batch)
+    refreshed += len(batch)
+    logger.info(f"Rollup rebuild finished in {time.time() - start_time:.2f}s: {refreshed} days")
+    return refreshed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild daily and monthly rollups from air_quality_by_city_date")
+    parser.add_argument("--city", help="only rebuild one city")
+    parser.add_argument("--start", help="first date (YYYY-MM-DD)")
+    parser.add_argument("--end", help="last date (YYYY-MM-DD)")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    from cassandra_session import get_session
+    try:
+        rebuild(get_session(), args.city, args.start, args.end, args.batch_size)
+    except Exception as e:
+        logger.error(f"Rollup rebuild failed: {e}")
+        sys.exit(1)
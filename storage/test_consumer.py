@@ -0,0 +1,35 @@
+import pytest
+
+import consumer
+from consumer import committable_offsets
+
+
+@pytest.fixture
+def consumed(monkeypatch):
+    positions = {("air_quality_events", 0): 100, ("air_quality_events", 1): 50}
+    monkeypatch.setattr(consumer, "_consumed", positions)
+    return positions
+
+
+def offsets(partitions):
+    return {(tp.topic, tp.partition): tp.offset for tp in partitions}
+
+
+def test_commits_the_consumed_position_when_nothing_is_pending(consumed):
+    assert offsets(committable_offsets({})) == consumed
+
+
+def test_holds_back_to_the_oldest_pending_row(consumed):
+    pending = {("air_quality_events", 0): 42}
+    assert offsets(committable_offsets(pending)) == {("air_quality_events", 0): 42, ("air_quality_events", 1): 50}
+
+
+def test_never_commits_past_the_consumed_position(consumed):
+    pending = {("air_quality_events", 1): 80}
+    assert offsets(committable_offsets(pending))[("air_quality_events", 1)] == 50
+
+
+def test_only_the_given_partitions(consumed):
+    pending = {("air_quality_events", 1): 10}
+    assert offsets(committable_offsets(pending, {("air_quality_events", 1)})) == {("air_quality_events", 1): 10}
+    assert committable_offsets({}, set()) == []
@@ -0,0 +1,62 @@
+import json
+import uuid
+from confluent_kafka import Consumer, Producer
+from config import KAFKA_BOOTSTRAP_SERVERS
+from logger import get_logger, SampledLog
+
+logger = get_logger()
+sampled = SampledLog(logger)
+
+
+class WriteNotifier:
+    """Publishes the (city, date) partitions of each written batch so readers can drop cached copies"""
+
+    def __init__(self, topic):
+        self.topic = topic
+        self.producer = Producer({
+            'bootstrap.servers': KAFKA_BOOTSTRAP_SERVERS,
+            'linger.ms': 10,
+        }) if topic else None
+
+    def notify(self, partitions):
+        if self.producer is None or not partitions:
+            return
+        try:
+            self.producer.produce(self.topic, value=json.dumps(sorted(partitions)).encode('utf-8'))
+            self.producer.poll(0)
+        except Exception as e:
+            # Readers fall back to their cache TTL, so a lost notification is not fatal
+            sampled.warning("publish", f"Could not publish write notification: {e}")
+
+    def flush(self, timeout=5):
+        if self.producer is not None:
+            self.producer.flush(timeout)
+
+
+def listen_for_writes(topic, on_partitions, poll_timeout=1.0):
+    """Call on_partitions([(city, date), ...]) for every write notification; blocks forever.
+
+    Each listener uses its own consumer group so every query API instance
+    sees every notification, starting from the latest one.
+    """
+    consumer = Consumer({
+        'bootstrap.servers': KAFKA_BOOTSTRAP_SERVERS,
+        'group.id': f"query-api-{uuid.uuid4()}",
+        'auto.offset.reset': 'latest',
+        'enable.auto.commit': False,
+    })
+    consumer.subscribe([topic])
+    try:
+        while True:
+            msg = consumer.poll(poll_timeout)
+            if msg is None:
+                continue
+            if msg.error():
+                sampled.warning("consumer_error", f"Write notification consumer error: {msg.error()}")
+                continue
+            try:
+                on_partitions([tuple(p) for p in json.loads(msg.value())])
+            except Exception as e:
+                sampled.error("bad_notification", f"Bad write notification: {e}")
+    finally:
+        consumer.close()
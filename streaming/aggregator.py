@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import AGGREGATED_EVENTS, AGGREGATOR_OPEN_HOURS
+
+POLLUTANTS = ["pm2_5", "pm10", "ozone", "carbon_monoxide", "nitrogen_dioxide", "sulphur_dioxide", "uv_index"]
+
+
+class HourAggregator:
+    """Buffers per-pollutant change events into one complete reading per (city, hour).
+
+    An hour is emitted as soon as every pollutant has arrived, when it has
+    been open for longer than `timeout` seconds, or when the window holds
+    more than `max_open` hours (oldest first). Emitted hours are returned
+    as (city, timestamp, values, source, ingest_time) tuples where missing
+    pollutants are None and ingest_time is the earliest one merged.
+
+    Each hour remembers the change-stream resume token from just before it
+    opened, so callers can checkpoint without skipping buffered events.
+    """
+
+    def __init__(self, timeout, max_open):
+        self.timeout = timeout
+        self.max_open = max_open
+        self.open_hours = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, city, timestamp, values, source, resume_token=None, ingest_time=None):
+        """Merge pollutant values for an hour; returns the hours ready to emit"""
+        ready = []
+        with self.lock:
+            key = (city, timestamp)
+            entry = self.open_hours.get(key)
+            if entry is None:
+                entry = {"values": {}, "source": source, "opened": time.monotonic(),
+                         "resume_token": resume_token, "ingest_time": ingest_time}
+                self.open_hours[key] = entry
+            elif ingest_time is not None:
+                entry["ingest_time"] = min(ingest_time, entry["ingest_time"] or ingest_time)
+            entry["values"].update({p: v for p, v in values.items() if v is not None})
+            entry["source"] = source or entry["source"]
+
+            if all(p in entry["values"] for p in POLLUTANTS):
+                ready.append(self._pop(key, "complete"))
+            while len(self.open_hours) > self.max_open:
+                ready.append(self._pop(next(iter(self.open_hours)), "evicted"))
+            AGGREGATOR_OPEN_HOURS.set(len(self.open_hours))
+        return ready
+
+    def expire(self, now=None):
+        """Return hours that have been open longer than the timeout"""
+        now = time.monotonic() if now is None else now
+        ready = []
+        with self.lock:
+            # Insertion order is opening order, so stop at the first hour still within the timeout
+            while self.open_hours:
+                key, entry = next(iter(self.open_hours.items()))
+                if now - entry["opened"] < self.timeout:
+                    break
+                ready.append(self._pop(key, "timeout"))
+            AGGREGATOR_OPEN_HOURS.set(len(self.open_hours))
+        return ready
+
+    def oldest_resume_token(self):
+        """Return (has_open_hours, resume token of the oldest open hour)"""
+        with self.lock:
+            if not self.open_hours:
+                return False, None
+            return True, next(iter(self.open_hours.values()))["resume_token"]
+
+    def drain(self):
+        """Return every open hour, e.g. on shutdown"""
+        with self.lock:
+            ready = [self._pop(key, "shutdown") for key in list(self.open_hours)]
+            AGGREGATOR_OPEN_HOURS.set(0)
+        return ready
+
+    def clear(self):
+        """Forget every open hour without emitting it, e.g. before the stream is replayed"""
+        with self.lock:
+            self.open_hours.clear()
+            AGGREGATOR_OPEN_HOURS.set(0)
+
+    def _pop(self, key, reason):
+        entry = self.open_hours.pop(key)
+        AGGREGATED_EVENTS.labels(reason=reason).inc()
+        values = {p: entry["values"].get(p) for p in POLLUTANTS}
+        return key[0], key[1], values, entry["source"], entry["ingest_time"]
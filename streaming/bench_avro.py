@@ -0,0 +1,81 @@
+"""Compare AvroSerializer with AvroEventEncoder.
+
+Runs offline: an in-memory registry stands in for Schema Registry. Reports
+records/sec for per-record AvroSerializer calls, per-record encode() and
+encode_batch(), and checks that all three produce identical bytes.
+
+Usage: python bench_avro.py [--records N] [--batch-size N]
+"""
+import argparse
+import json
+import random
+import time
+
+from confluent_kafka.schema_registry.avro import AvroSerializer
+from confluent_kafka.serialization import SerializationContext, MessageField
+
+from aggregator import POLLUTANTS
+from common.avro_codec import AvroEventEncoder
+
+
+class InMemoryRegistry:
+    """The subset of SchemaRegistryClient the serializers call"""
+
+    def __init__(self):
+        self.schemas = {}
+
+    def register_schema(self, subject_name, schema, normalize_schemas=False):
+        # Like the registry, equivalent schemas share an ID regardless of formatting
+        canonical = json.dumps(json.loads(schema.schema_str), sort_keys=True)
+        return self.schemas.setdefault(canonical, len(self.schemas) + 1)
+
+
+def sample_records(count):
+    base = 1704067200000
+    return [
+        {
+            "city": random.choice(["Nairobi", "Mombasa", "Kisumu", "Nakuru", "Eldoret"]),
+            "timestamp": base + i * 3600000,
+            **{p: (round(random.uniform(0, 100), 2) if random.random() > 0.1 else None) for p in POLLUTANTS},
+            "source": "open-meteo",
+            "ingest_time": base + i * 3600000 + 5000,
+        }
+        for i in range(count)
+    ]
+
+
+def timed(label, count, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {count / elapsed:>12,.0f} records/s  ({elapsed * 1000:.0f} ms)")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Avro encoding of air quality events")
+    parser.add_argument("--records", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    with open("air_quality_event.avsc", "r") as f:
+        schema_str = f.read()
+    registry = InMemoryRegistry()
+    serializer = AvroSerializer(registry, schema_str)
+    encoder = AvroEventEncoder(schema_str, registry, "air_quality_events-value")
+    ctx = SerializationContext("air_quality_events", MessageField.VALUE)
+    records = sample_records(args.records)
+
+    baseline = timed("AvroSerializer", len(records), lambda: [serializer(r, ctx) for r in records])
+    single = timed("AvroEventEncoder.encode", len(records), lambda: [encoder.encode(r) for r in records])
+    batched = timed("AvroEventEncoder.encode_batch", len(records), lambda: [
+        payload
+        for start in range(0, len(records), args.batch_size)
+        for payload in encoder.encode_batch(records[start:start + args.batch_size])
+    ])
+    assert baseline == single == batched, "encoders disagree"
+    print("Output identical across encoders")
+
+
+if __name__ == "__main__":
+    main()
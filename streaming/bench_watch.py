@@ -0,0 +1,111 @@
+"""Compare change-stream throughput with updateLookup vs the projected pipeline.
+
+For each curated layout (long and wide), fills a scratch collection before
+the change stream opens, then updates every document once while the stream
+is watched, and reports events/sec for each watch mode. The events are
+updates of documents the streaming process has never seen, as after a
+restart, so the projected mode has to resolve every one from the event
+alone. Needs a replica-set Mongo (change streams); Kafka is not involved.
+
+Usage: python bench_watch.py [--documents N] [--collection NAME] [--timeout SECONDS]
+"""
+import argparse
+import threading
+import time
+from datetime import datetime, timedelta
+
+from bson import BSON
+from pymongo import MongoClient, UpdateOne
+
+from aggregator import POLLUTANTS
+from common.curated_keys import document_id
+from config import MONGODB_URI, DB_NAME
+from projection import build_watch_pipeline, change_to_document
+
+LAYOUTS = {
+    "long": ["city", "timestamp", "pollutant"],
+    "wide": ["city", "timestamp"],
+}
+
+
+def document_keys(layout, documents):
+    """Keys of `documents` curated documents of one layout"""
+    start = datetime(2024, 1, 1)
+    if layout == "wide":
+        return [{"city": "Bench", "timestamp": (start + timedelta(hours=i)).strftime("%Y-%m-%dT%H:%M")}
+                for i in range(documents)]
+    return [{"city": "Bench", "timestamp": (start + timedelta(hours=i // len(POLLUTANTS))).strftime("%Y-%m-%dT%H:%M"),
+             "pollutant": POLLUTANTS[i % len(POLLUTANTS)]} for i in range(documents)]
+
+
+def fill(collection, layout, keys):
+    """Insert the documents the way ingestion does, before anything watches the collection"""
+    collection.drop()
+    collection.create_index([(field, 1) for field in LAYOUTS[layout]], unique=True)
+    values = {"value": 1.0} if layout == "long" else {p: 1.0 for p in POLLUTANTS}
+    for offset in range(0, len(keys), 1000):
+        batch = keys[offset:offset + 1000]
+        collection.bulk_write([UpdateOne(k, {"$set": {**values, "source": "bench"}, "$setOnInsert": {"_id": document_id(**k)}},
+                                         upsert=True) for k in batch], ordered=False)
+
+
+def write_load(collection, layout, keys, ready):
+    """Update every document once: the value in the long layout, two of the pollutants in the wide one"""
+    ready.wait()
+    for offset in range(0, len(keys), 1000):
+        batch = keys[offset:offset + 1000]
+        if layout == "long":
+            updates = [UpdateOne(k, {"$set": {"value": 2.0}}) for k in batch]
+        else:
+            updates = [UpdateOne(k, {"$set": {POLLUTANTS[i % len(POLLUTANTS)]: 2.0, POLLUTANTS[(i + 1) % len(POLLUTANTS)]: 2.0}})
+                       for i, k in enumerate(batch, offset)]
+        collection.bulk_write(updates, ordered=False)
+
+
+def run(collection, layout, mode, documents, timeout=120.0):
+    """Returns (events/sec, bytes/event, events received); stops at `timeout` if events go missing"""
+    keys = document_keys(layout, documents)
+    fill(collection, layout, keys)
+    if mode == "projected":
+        stream = collection.watch(build_watch_pipeline(), max_await_time_ms=500)
+    else:
+        stream = collection.watch(full_document="updateLookup", max_await_time_ms=500)
+
+    ready = threading.Event()
+    writer = threading.Thread(target=write_load, args=(collection, layout, keys, ready))
+    writer.start()
+    received = 0
+    event_bytes = 0
+    start_time = time.perf_counter()
+    deadline = start_time + timeout
+    with stream:
+        ready.set()
+        while received < documents and time.perf_counter() < deadline:
+            change = stream.try_next()
+            if change is None:
+                continue
+            doc = change_to_document(change) if mode == "projected" else change.get("fullDocument")
+            if doc is not None:
+                received += 1
+                event_bytes += len(BSON.encode(change))
+    elapsed = time.perf_counter() - start_time
+    writer.join()
+    return received / elapsed, event_bytes / max(received, 1), received
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark change-stream watch modes")
+    parser.add_argument("--documents", type=int, default=20000)
+    parser.add_argument("--collection", default="bench_watch")
+    parser.add_argument("--timeout", type=float, default=120.0, help="give up on a mode after this many seconds")
+    args = parser.parse_args()
+
+    collection = MongoClient(MONGODB_URI)[DB_NAME][args.collection]
+    try:
+        for layout in LAYOUTS:
+            for mode in ("lookup", "projected"):
+                rate, size, received = run(collection, layout, mode, args.documents, args.timeout)
+                partial = f" (timed out: {received} of {args.documents} events)" if received < args.documents else ""
+                print(f"{layout:>5} {mode:>10}: {rate:,.0f} events/s, {size:.0f} bytes/event{partial}")
+    finally:
+        collection.drop()
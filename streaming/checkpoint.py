@@ -0,0 +1,124 @@
+import heapq
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+from bson import json_util
+
+from metrics import CHECKPOINTS_SAVED
+
+
+class ResumeTokenStore:
+    """Persists the change-stream resume token in a Mongo collection or a local file"""
+
+    def __init__(self, backend, stream_name, collection=None, path=None):
+        self.backend = backend
+        self.stream_name = stream_name
+        self.collection = collection
+        self.path = path
+
+    def load(self):
+        """Return the last saved resume token, or None"""
+        try:
+            if self.backend == "file":
+                if not os.path.exists(self.path):
+                    return None
+                with open(self.path, "r") as f:
+                    return json_util.loads(f.read()).get("token")
+            doc = self.collection.find_one({"_id": self.stream_name})
+            return doc.get("token") if doc else None
+        except Exception as e:
+            logging.error(f"Could not load resume token for {self.stream_name}: {e}")
+            return None
+
+    def save(self, token):
+        """Persist a resume token; returns whether it was written"""
+        record = {"token": token, "updated_at": datetime.now(timezone.utc)}
+        try:
+            if self.backend == "file":
+                # Write then rename so a crash never leaves a truncated token file
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w") as f:
+                    f.write(json_util.dumps(record))
+                os.replace(tmp_path, self.path)
+            else:
+                self.collection.update_one({"_id": self.stream_name}, {"$set": record}, upsert=True)
+            CHECKPOINTS_SAVED.labels(status="success").inc()
+            return True
+        except Exception as e:
+            CHECKPOINTS_SAVED.labels(status="fail").inc()
+            logging.error(f"Could not save resume token for {self.stream_name}: {e}")
+            return False
+
+    def clear(self):
+        """Forget the saved token, e.g. after it fell off the oplog"""
+        try:
+            if self.backend == "file":
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+            else:
+                self.collection.delete_one({"_id": self.stream_name})
+        except Exception as e:
+            logging.error(f"Could not clear resume token for {self.stream_name}: {e}")
+
+
+class DeliveryWatermark:
+    """Tracks which produced messages Kafka has acknowledged, so checkpoints never run ahead of them.
+
+    Every produced message takes the next sequence number; the watermark is
+    the highest number up to which every message was delivered. Resume tokens
+    offered with offer() become committable once the watermark passes the
+    messages produced before them. A failed delivery stops the watermark
+    until reset().
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.produced = 0
+        self.reset()
+
+    def reset(self):
+        """Start over after a replay; reports for earlier messages are ignored"""
+        with self.lock:
+            self.base = self.produced
+            self.outstanding = []
+            self.acked = set()
+            self.failed = 0
+            self.offered = deque()
+
+    def next(self):
+        """Sequence number for a message about to be produced"""
+        with self.lock:
+            self.produced += 1
+            heapq.heappush(self.outstanding, self.produced)
+            return self.produced
+
+    def delivered(self, seq, ok):
+        """Record the delivery report of message `seq`"""
+        with self.lock:
+            if seq <= self.base:
+                return
+            if ok:
+                self.acked.add(seq)
+            else:
+                self.failed += 1
+
+    def offer(self, token):
+        """Remember a resume token that covers every message produced so far"""
+        with self.lock:
+            self.offered.append((self.produced, token))
+
+    def committable(self):
+        """Newest offered token whose messages have all been delivered, or None"""
+        with self.lock:
+            if self.failed:
+                return None
+            while self.outstanding and self.outstanding[0] in self.acked:
+                self.acked.discard(heapq.heappop(self.outstanding))
+            watermark = self.outstanding[0] - 1 if self.outstanding else self.produced
+            token = None
+            while self.offered and self.offered[0][0] <= watermark:
+                token = self.offered.popleft()[1]
+            return token
@@ -0,0 +1,55 @@
+import os
+
+MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://mongo:27017")
+DB_NAME = os.getenv("DB_NAME", "air_quality")
+CURATED_COLLECTION = os.getenv("CURATED_COLLECTION", "curated_air_quality")
+
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BROKER", "kafka:9092")
+SCHEMA_REGISTRY_URL = os.getenv("SCHEMA_REGISTRY_URL", "http://schema-registry:8081")
+KAFKA_TOPIC = os.getenv("KAFKA_TOPIC", "air_quality_events")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 8001))
+LIVENESS_TIMEOUT_SECONDS = float(os.getenv("LIVENESS_TIMEOUT_SECONDS", 60))  # /health/live fails once the stream loop stalls this long
+SCHEMA_CACHE_FILE = os.getenv("SCHEMA_CACHE_FILE", "/app/state/schema_ids.json")  # subject -> registry ID, used while the registry is down
+
+# Producer tuning: "default" keeps librdkafka defaults, "throughput" batches and compresses
+PRODUCER_PROFILE = os.getenv("PRODUCER_PROFILE", "throughput")
+KAFKA_LINGER_MS = os.getenv("KAFKA_LINGER_MS")
+KAFKA_BATCH_SIZE = os.getenv("KAFKA_BATCH_SIZE")
+KAFKA_COMPRESSION = os.getenv("KAFKA_COMPRESSION")  # lz4, zstd, snappy, gzip or none
+KAFKA_ACKS = os.getenv("KAFKA_ACKS")
+KAFKA_ENABLE_IDEMPOTENCE = os.getenv("KAFKA_ENABLE_IDEMPOTENCE")
+
+# Local queue backpressure: above the high watermark, wait (bounded) for deliveries
+PRODUCER_QUEUE_HIGH_WATERMARK = int(os.getenv("PRODUCER_QUEUE_HIGH_WATERMARK", 50000))
+PRODUCER_QUEUE_LOW_WATERMARK = int(os.getenv("PRODUCER_QUEUE_LOW_WATERMARK", 10000))
+PRODUCER_BACKPRESSURE_TIMEOUT_SECONDS = float(os.getenv("PRODUCER_BACKPRESSURE_TIMEOUT_SECONDS", 5))
+PRODUCER_POLL_EVERY = int(os.getenv("PRODUCER_POLL_EVERY", 500))  # serve delivery callbacks every N messages
+DELIVERY_LOG_INTERVAL_SECONDS = float(os.getenv("DELIVERY_LOG_INTERVAL_SECONDS", 30))
+
+# Hour aggregation: merge per-pollutant documents into one event per (city, hour)
+AGGREGATION_ENABLED = os.getenv("AGGREGATION_ENABLED", "true").lower() == "true"
+AGGREGATION_TIMEOUT_SECONDS = float(os.getenv("AGGREGATION_TIMEOUT_SECONDS", 30))
+AGGREGATION_MAX_OPEN_HOURS = int(os.getenv("AGGREGATION_MAX_OPEN_HOURS", 10000))
+AGGREGATION_POLL_MS = int(os.getenv("AGGREGATION_POLL_MS", 1000))
+
+# "lookup" asks Mongo for the full document on every update; "projected" streams only the changed fields
+WATCH_MODE = os.getenv("WATCH_MODE", "projected")
+
+# Change-stream resume tokens ("mongo" collection or local "file")
+RESUME_TOKEN_STORE = os.getenv("RESUME_TOKEN_STORE", "mongo")
+STREAM_CHECKPOINT_COLLECTION = os.getenv("STREAM_CHECKPOINT_COLLECTION", "stream_checkpoints")
+RESUME_TOKEN_FILE = os.getenv("RESUME_TOKEN_FILE", "/app/state/resume_token.json")
+STREAM_NAME = os.getenv("STREAM_NAME", f"{CURATED_COLLECTION}:{KAFKA_TOPIC}")
+CHECKPOINT_INTERVAL_SECONDS = float(os.getenv("CHECKPOINT_INTERVAL_SECONDS", 5))
+# "resume" from the saved token, "snapshot" to re-emit the collection first, or "now"
+STREAM_START_MODE = os.getenv("STREAM_START_MODE", "resume")
+CATCHUP_SNAPSHOT_DAYS = int(os.getenv("CATCHUP_SNAPSHOT_DAYS", 0))  # 0 scans the whole collection
+CATCHUP_BATCH_SIZE = int(os.getenv("CATCHUP_BATCH_SIZE", 1000))
+
+# Logging: records are formatted and written by a background thread (see logger.py)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "json" for promtail/Loki
+LOG_FILE = os.getenv("LOG_FILE", "")  # stdout only unless set
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # records beyond this are dropped, not waited on
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", 5))  # per-record messages logged per key and interval
+LOG_SUMMARY_INTERVAL_SECONDS = float(os.getenv("LOG_SUMMARY_INTERVAL_SECONDS", 60))
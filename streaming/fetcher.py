@@ -1,81 +1,430 @@
 import json
 import logging
-from confluent_kafka import SerializingProducer
+from confluent_kafka import Producer
 from confluent_kafka.schema_registry import SchemaRegistryClient
-from confluent_kafka.schema_registry.avro import AvroSerializer
 from pymongo import MongoClient
+from pymongo.errors import OperationFailure, PyMongoError
+import threading
 import time
+from datetime import datetime, timedelta, timezone
+from aggregator import HourAggregator, POLLUTANTS
+from common.avro_codec import AvroEventEncoder
+from health import health, run_phases, startup_phase
+from checkpoint import DeliveryWatermark, ResumeTokenStore
+from logger import SampledLog
+from projection import build_watch_pipeline, change_to_document
+from config import (
+    MONGODB_URI, DB_NAME, CURATED_COLLECTION, KAFKA_BOOTSTRAP_SERVERS, SCHEMA_REGISTRY_URL, KAFKA_TOPIC,
+    PRODUCER_PROFILE, KAFKA_LINGER_MS, KAFKA_BATCH_SIZE, KAFKA_COMPRESSION, KAFKA_ACKS, KAFKA_ENABLE_IDEMPOTENCE,
+    PRODUCER_QUEUE_HIGH_WATERMARK, PRODUCER_QUEUE_LOW_WATERMARK, PRODUCER_BACKPRESSURE_TIMEOUT_SECONDS,
+    PRODUCER_POLL_EVERY, DELIVERY_LOG_INTERVAL_SECONDS,
+    AGGREGATION_ENABLED, AGGREGATION_TIMEOUT_SECONDS, AGGREGATION_MAX_OPEN_HOURS, AGGREGATION_POLL_MS,
+    WATCH_MODE, SCHEMA_CACHE_FILE,
+    RESUME_TOKEN_STORE, STREAM_CHECKPOINT_COLLECTION, RESUME_TOKEN_FILE, STREAM_NAME, CHECKPOINT_INTERVAL_SECONDS,
+    STREAM_START_MODE, CATCHUP_SNAPSHOT_DAYS, CATCHUP_BATCH_SIZE,
+)
+from metrics import (
+    MESSAGES_DELIVERED, MESSAGES_FAILED, DELIVERY_LATENCY, BACKPRESSURE_WAITS, SNAPSHOT_DOCUMENTS,
+    PRODUCED_BYTES, QUEUE_DEPTH,
+)
 
-# Configurations
-mongodb_uri = "mongodb://mongo:27017"
-db_name = "air_quality"
-collection_name = "curated_air_quality"
-kafka_bootstrap_servers = "kafka:9092"
-schema_registry_url = "http://schema-registry:8081"
-kafka_topic = "air_quality_events"
+# Per-event failures are sampled so a bad batch cannot flood the log
+sampled = SampledLog(logging.getLogger(__name__))
 
 # Load Avro schema string
 with open("air_quality_event.avsc", "r") as f:
     avro_schema_str = f.read()
 
-# Set up Schema Registry client and Avro serializer
-schema_registry_client = SchemaRegistryClient({"url": schema_registry_url})
-avro_serializer = AvroSerializer(schema_registry_client, avro_schema_str)
+schema_registry_client = SchemaRegistryClient({"url": SCHEMA_REGISTRY_URL})
+# Created by init(); resolving the schema ID is a registry round trip
+avro_encoder = None
 
-# Key serializer for Kafka (simple string serializer here)
-def key_serializer(key, ctx):
-    return key.encode('utf-8')
-
-# Kafka producer setup with serializers
-producer_conf = {
-    "bootstrap.servers": kafka_bootstrap_servers,
-    "key.serializer": key_serializer,
-    "value.serializer": avro_serializer,
+# librdkafka settings per producer profile; explicit env settings override them
+PRODUCER_PROFILES = {
+    "default": {},
+    "throughput": {
+        "linger.ms": 20,
+        "batch.size": 262144,
+        "compression.type": "lz4",
+        "enable.idempotence": True,
+        "acks": "all",
+        "queue.buffering.max.messages": 200000,
+    },
 }
 
-producer = SerializingProducer(producer_conf)
+def build_producer_conf():
+    """Kafka producer config for the selected profile plus env overrides"""
+    conf = {
+        "bootstrap.servers": KAFKA_BOOTSTRAP_SERVERS,
+        **PRODUCER_PROFILES.get(PRODUCER_PROFILE, {}),
+    }
+    overrides = {
+        "linger.ms": int(KAFKA_LINGER_MS) if KAFKA_LINGER_MS else None,
+        "batch.size": int(KAFKA_BATCH_SIZE) if KAFKA_BATCH_SIZE else None,
+        "compression.type": KAFKA_COMPRESSION,
+        "acks": KAFKA_ACKS,
+        "enable.idempotence": KAFKA_ENABLE_IDEMPOTENCE.lower() == "true" if KAFKA_ENABLE_IDEMPOTENCE else None,
+    }
+    conf.update({k: v for k, v in overrides.items() if v is not None})
+    return conf
+
+# Keys and values are encoded before produce(), so a plain Producer is enough
+producer = Producer(build_producer_conf())
+
+# MongoDB and collection; connect=False defers connecting to the first operation
+client = MongoClient(MONGODB_URI, connect=False)
+collection = client[DB_NAME][CURATED_COLLECTION]
+
+# Per-(city, hour) window that merges pollutant documents into one event
+aggregator = HourAggregator(AGGREGATION_TIMEOUT_SECONDS, AGGREGATION_MAX_OPEN_HOURS) if AGGREGATION_ENABLED else None
+
+# Resume token persistence
+token_store = ResumeTokenStore(
+    RESUME_TOKEN_STORE, STREAM_NAME,
+    collection=client[DB_NAME][STREAM_CHECKPOINT_COLLECTION], path=RESUME_TOKEN_FILE,
+)
+# ChangeStreamHistoryLost, ChangeStreamFatalError, CappedPositionLost
+RESUME_TOKEN_LOST_CODES = {286, 280, 136}
+_last_token = None
+_last_checkpoint = 0.0
+# Where a replay restarts after failed deliveries: the last saved token, else where the stream started
+_replay_token = None
+
+class DeliveryFailed(Exception):
+    """Kafka rejected messages produced since the last checkpoint"""
+
+def init_encoder():
+    global avro_encoder
+    # Schema parsed once; its registry ID is cached on disk so a registry outage does not block startup
+    avro_encoder = AvroEventEncoder(avro_schema_str, schema_registry_client, f"{KAFKA_TOPIC}-value", SCHEMA_CACHE_FILE)
+
+def ping_mongo():
+    try:
+        client.admin.command("ping")
+    except PyMongoError as e:
+        # stream_mongo_changes() keeps retrying; readiness stays false until the stream opens
+        logging.warning(f"MongoDB not reachable yet: {e}")
+
+def init():
+    """Resolve the schema ID and reach Mongo in parallel, ahead of opening the change stream"""
+    with startup_phase("total"):
+        run_phases({"schema_registry": init_encoder, "mongo": ping_mongo})
+
+class DeliveryStats:
+    """Aggregates delivery reports and logs a periodic summary instead of one line per message"""
+
+    def __init__(self, interval=DELIVERY_LOG_INTERVAL_SECONDS):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.delivered = 0
+        self.failed = 0
+        self.last_log = time.monotonic()
+
+    def record(self, err, msg):
+        topic = msg.topic() if msg is not None else KAFKA_TOPIC
+        if err is not None:
+            MESSAGES_FAILED.labels(topic=topic, error=err.name() if hasattr(err, "name") else str(err)).inc()
+        else:
+            MESSAGES_DELIVERED.labels(topic=topic).inc()
+            PRODUCED_BYTES.labels(topic=topic).inc(len(msg.key() or b"") + len(msg.value() or b""))
+            latency = msg.latency()
+            if latency is not None:
+                DELIVERY_LATENCY.labels(topic=topic).observe(latency)
+        with self.lock:
+            if err is not None:
+                self.failed += 1
+                # Failures stay visible, but only the first of each interval is logged in full
+                if self.failed == 1:
+                    logging.error(f"Message delivery failed: {err}")
+            else:
+                self.delivered += 1
+        self.maybe_log()
+
+    def maybe_log(self, force=False):
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.last_log < self.interval:
+                return
+            delivered, failed = self.delivered, self.failed
+            self.delivered = self.failed = 0
+            elapsed = max(now - self.last_log, 1e-9)
+            self.last_log = now
+        if delivered or failed:
+            logging.info(f"Delivered {delivered} messages ({delivered / elapsed:.1f}/s), {failed} failed in the last {elapsed:.0f}s")
+
+delivery_stats = DeliveryStats()
+# Resume tokens are only checkpointed once every message produced before them is acknowledged
+delivery_watermark = DeliveryWatermark()
+
+def delivery_report(err, msg, seq=None):
+    delivery_stats.record(err, msg)
+    if seq is not None:
+        delivery_watermark.delivered(seq, err is None)
+
+_produced_since_poll = 0
+
+def wait_for_queue(low_watermark=PRODUCER_QUEUE_LOW_WATERMARK, timeout=PRODUCER_BACKPRESSURE_TIMEOUT_SECONDS):
+    """Serve delivery callbacks until the local queue drains below low_watermark or timeout passes"""
+    deadline = time.monotonic() + timeout
+    producer.poll(0.05)
+    while len(producer) > low_watermark and time.monotonic() < deadline:
+        producer.poll(0.05)
+    QUEUE_DEPTH.set(len(producer))
+
+def produce_event(key, value, topic=None):
+    """Produce one event, applying backpressure when the local queue fills up"""
+    global _produced_since_poll
+    topic = topic or KAFKA_TOPIC
+    seq = delivery_watermark.next()
+    on_delivery = lambda err, msg: delivery_report(err, msg, seq)
+    while True:
+        try:
+            producer.produce(topic=topic, key=key, value=value, on_delivery=on_delivery)
+            break
+        except BufferError:
+            BACKPRESSURE_WAITS.labels(reason="queue_full").inc()
+            wait_for_queue()
+        except Exception:
+            # Never queued, so no report will come; count it as a failed delivery
+            delivery_watermark.delivered(seq, False)
+            raise
+
+    _produced_since_poll += 1
+    if len(producer) >= PRODUCER_QUEUE_HIGH_WATERMARK:
+        BACKPRESSURE_WAITS.labels(reason="high_watermark").inc()
+        wait_for_queue()
+        _produced_since_poll = 0
+    elif _produced_since_poll >= PRODUCER_POLL_EVERY:
+        producer.poll(0)
+        QUEUE_DEPTH.set(len(producer))
+        _produced_since_poll = 0
+
+def pollutant_values(doc):
+    """Map a curated document to the Avro pollutant fields.
 
-# MongoDB and collection
-client = MongoClient(mongodb_uri)
-collection = client[db_name][collection_name]
+    Long-layout documents carry one `pollutant`/`value` pair; wide-layout
+    documents (one per city and hour) carry every pollutant as a field.
+    """
+    if "pollutant" in doc:
+        return {p: (doc.get("value") if doc["pollutant"] == p else None) for p in POLLUTANTS}
+    return {p: doc.get(p) for p in POLLUTANTS}
 
-def delivery_report(err, msg):
-    if err is not None:
-        logging.error(f"Message delivery failed: {err}")
+def change_time_ms(change):
+    """Milliseconds since epoch of the Mongo write behind a change event"""
+    if change.get("wallTime") is not None:
+        return int(change["wallTime"].replace(tzinfo=timezone.utc).timestamp() * 1000)
+    if change.get("clusterTime") is not None:
+        return change["clusterTime"].time * 1000
+    return None
+
+def build_event(city, timestamp_str, values, source, ingest_time=None):
+    """Avro record of one (city, hour) reading.
+
+    `ingest_time` (epoch ms) is when the reading reached Mongo; it defaults
+    to now and lets the storage service measure end-to-end latency.
+    """
+    # Parse timestamp string to datetime
+    timestamp_dt = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
+    return {
+        "city": city,
+        "timestamp": int(timestamp_dt.timestamp() * 1000),
+        **values,
+        "source": source or "open-meteo",
+        "ingest_time": ingest_time or int(time.time() * 1000),
+    }
+
+def emit_hour(city, timestamp_str, values, source, ingest_time=None):
+    """Serialize one (city, hour) reading and hand it to the producer"""
+    # Keyed by city so each city's hours stay ordered within one partition
+    value = avro_encoder.encode(build_event(city, timestamp_str, values, source, ingest_time))
+    produce_event(city.encode('utf-8'), value)
+
+def emit_hours(hours):
+    """Serialize a batch of (city, timestamp, values, source, ingest_time) hours in one pass"""
+    if not hours:
+        return
+    try:
+        values = avro_encoder.encode_batch([build_event(*hour) for hour in hours])
+    except Exception as e:
+        # Fall back to one at a time so a single bad hour does not drop the batch
+        logging.warning(f"Batch encode of {len(hours)} hours failed ({e}); emitting individually")
+        for hour in hours:
+            try:
+                emit_hour(*hour)
+            except Exception as e:
+                sampled.error("emit_hour", f"Error emitting hour {hour[0]} {hour[1]}: {e}")
+        return
+    for hour, value in zip(hours, values):
+        produce_event(hour[0].encode('utf-8'), value)
+
+def handle_document(full_doc, resume_token=None, ingest_time=None):
+    """Route a curated document through the hour aggregator (or straight out)"""
+    city = full_doc["city"]
+    timestamp_str = full_doc["timestamp"]
+    source = full_doc.get("source", "open-meteo")
+    values = pollutant_values(full_doc)
+    # Wide documents already hold the whole hour
+    if aggregator is None or "pollutant" not in full_doc:
+        emit_hour(city, timestamp_str, values, source, ingest_time)
+        return
+    emit_hours(list(aggregator.add(city, timestamp_str, values, source, resume_token, ingest_time)))
+
+def emit_expired():
+    """Emit aggregated hours whose timeout has passed"""
+    if aggregator is None:
+        return
+    try:
+        emit_hours(list(aggregator.expire()))
+    except Exception as e:
+        sampled.error("emit_expired", f"Error emitting aggregated hours: {e}")
+
+def checkpoint_token():
+    """Resume token that does not skip any event still buffered in the aggregator"""
+    if aggregator is not None:
+        has_open, token = aggregator.oldest_resume_token()
+        if has_open:
+            return token
+    return _last_token
+
+def maybe_checkpoint(force=False):
+    """Every CHECKPOINT_INTERVAL_SECONDS, persist the newest resume token Kafka has acknowledged everything before.
+
+    Never waits on the producer: the current token is offered to the delivery
+    watermark and saved on a later call once its messages are delivered.
+    Raises DeliveryFailed if a delivery failed since the last replay.
+    """
+    global _last_checkpoint, _replay_token
+    now = time.monotonic()
+    if not force and now - _last_checkpoint < CHECKPOINT_INTERVAL_SECONDS:
+        return
+    _last_checkpoint = now
+    if delivery_watermark.failed:
+        raise DeliveryFailed(f"{delivery_watermark.failed} messages failed delivery since the last checkpoint")
+    token = checkpoint_token()
+    if token is not None:
+        delivery_watermark.offer(token)
+    token = delivery_watermark.committable()
+    if token is not None and token_store.save(token):
+        _replay_token = token
+
+def replay_from_checkpoint():
+    """Drop buffered state so the stream can be reopened from the last saved token"""
+    if aggregator is not None:
+        aggregator.clear()
+    # Reports still in flight belong to the abandoned attempt and are ignored after the reset
+    delivery_watermark.reset()
+    return _replay_token
+
+def open_change_stream(resume_token=None):
+    # A bounded await lets the loop expire aggregated hours while the stream is idle
+    kwargs = {"max_await_time_ms": AGGREGATION_POLL_MS}
+    if WATCH_MODE == "projected":
+        kwargs["pipeline"] = build_watch_pipeline()
     else:
-        logging.info(f"Message delivered to {msg.topic()} [{msg.partition()}]")
+        kwargs["full_document"] = "updateLookup"
+    if resume_token is not None:
+        kwargs["resume_after"] = resume_token
+    return collection.watch(**kwargs)
+
+def handle_change(change, resume_token=None):
+    """Emit the curated document behind one change event"""
+    full_doc = change_to_document(change) if WATCH_MODE == "projected" else change.get("fullDocument")
+    if full_doc is None:
+        # Deleted before the lookup ran, or not a document we stream
+        return
+    handle_document(full_doc, resume_token, change_time_ms(change))
+
+def snapshot_catch_up():
+    """Re-emit curated documents from a collection scan.
+
+    Used when there is no usable resume token. The change stream is opened
+    before the scan, so writes made during the scan are replayed after it.
+    """
+    query = {}
+    if CATCHUP_SNAPSHOT_DAYS > 0:
+        since = (datetime.utcnow() - timedelta(days=CATCHUP_SNAPSHOT_DAYS)).strftime("%Y-%m-%dT%H:%M")
+        query = {"timestamp": {"$gte": since}}
+    logging.info(f"Starting snapshot catch-up of {CURATED_COLLECTION} {query or ''}")
+    start_time = time.time()
+    count = 0
+    for doc in collection.find(query, batch_size=CATCHUP_BATCH_SIZE):
+        try:
+            handle_document(doc, _last_token)
+        except Exception as e:
+            sampled.error("snapshot_document", f"Error re-emitting document {doc.get('_id')}: {e}")
+        count += 1
+        if count % CATCHUP_BATCH_SIZE == 0:
+            health.heartbeat()
+            SNAPSHOT_DOCUMENTS.inc(CATCHUP_BATCH_SIZE)
+            emit_expired()
+    SNAPSHOT_DOCUMENTS.inc(count % CATCHUP_BATCH_SIZE)
+    logging.info(f"Snapshot catch-up re-emitted {count} documents in {time.time() - start_time:.2f}s")
 
 def stream_mongo_changes():
-    with collection.watch(full_document="updateLookup") as stream:
-        for change in stream:
+    global _last_token, _replay_token
+    resume_token = token_store.load() if STREAM_START_MODE == "resume" else None
+    _replay_token = resume_token
+    needs_snapshot = STREAM_START_MODE == "snapshot"
+    if resume_token is not None:
+        logging.info(f"Resuming change stream {STREAM_NAME} from saved token")
+
+    while True:
+        try:
             try:
-                full_doc = change["fullDocument"]
-                # Parse timestamp string to datetime
-                from datetime import datetime
-                timestamp_str = full_doc["timestamp"]
-                timestamp_dt = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-                timestamp_ms = int(timestamp_dt.timestamp() * 1000)
-                
-                # Prepare Kafka message key and value
-                key = f"{full_doc['city']}_{timestamp_str}"
-                value = {
-                    "city": full_doc["city"],
-                    "timestamp": timestamp_ms,
-                    "pm2_5": full_doc.get("value") if full_doc.get("pollutant") == "pm2_5" else None,
-                    "pm10": full_doc.get("value") if full_doc.get("pollutant") == "pm10" else None,
-                    "ozone": full_doc.get("value") if full_doc.get("pollutant") == "ozone" else None,
-                    "carbon_monoxide": full_doc.get("value") if full_doc.get("pollutant") == "carbon_monoxide" else None,
-                    "nitrogen_dioxide": full_doc.get("value") if full_doc.get("pollutant") == "nitrogen_dioxide" else None,
-                    "sulphur_dioxide": full_doc.get("value") if full_doc.get("pollutant") == "sulphur_dioxide" else None,
-                    "uv_index": full_doc.get("value") if full_doc.get("pollutant") == "uv_index" else None,
-                    "source": full_doc.get("source", "open-meteo"),
-                    "ingest_time": timestamp_ms,
-                }
-                producer.produce(topic=kafka_topic, key=key, value=value, on_delivery=delivery_report)
-                producer.poll(0)
-            except Exception as e:
-                logging.error(f"Error processing change event: {e}")
-                time.sleep(1)
+                stream = open_change_stream(resume_token)
+            except OperationFailure as e:
+                if resume_token is None or e.code not in RESUME_TOKEN_LOST_CODES:
+                    raise
+                logging.warning(f"Resume token is no longer in the oplog ({e.code}); falling back to snapshot catch-up")
+                token_store.clear()
+                resume_token = None
+                needs_snapshot = True
+                stream = open_change_stream()
+
+            with stream:
+                _last_token = stream.resume_token
+                if _replay_token is None and not needs_snapshot:
+                    _replay_token = _last_token
+                if needs_snapshot:
+                    with startup_phase("snapshot_catch_up"):
+                        snapshot_catch_up()
+                    needs_snapshot = False
+                    maybe_checkpoint(force=True)
+                health.set_ready()
+                while stream.alive:
+                    health.heartbeat()
+                    change = stream.try_next()
+                    if change is not None:
+                        try:
+                            handle_change(change, _last_token)
+                        except Exception as e:
+                            sampled.error("change_event", f"Error processing change event: {e}")
+                    _last_token = stream.resume_token
+                    emit_expired()
+                    maybe_checkpoint()
+            health.set_ready(False)
+            logging.warning("Change stream closed (invalidated); stopping")
+            return
+        except DeliveryFailed as e:
+            health.set_ready(False)
+            resume_token = replay_from_checkpoint()
+            # Nothing saved since a snapshot means the snapshot itself has to be replayed
+            needs_snapshot = resume_token is None
+            logging.error(f"{e}; replaying the change stream from the last checkpoint")
+        except PyMongoError as e:
+            health.set_ready(False)
+            # Reopen from the last position that has nothing buffered behind it
+            resume_token = checkpoint_token()
+            logging.error(f"Change stream error, reopening: {e}")
+            time.sleep(1)
 
 def flush_and_close():
+    if aggregator is not None:
+        emit_hours(list(aggregator.drain()))
     producer.flush()
+    try:
+        maybe_checkpoint(force=True)
+    except DeliveryFailed as e:
+        # The next start resumes from the last saved token and produces them again
+        logging.error(f"{e}; keeping the previous resume token")
+    delivery_stats.maybe_log(force=True)
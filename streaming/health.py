@@ -0,0 +1,12 @@
+"""Health endpoints and startup phase timing of the streaming service; see common/health.py.
+
+/health/live fails once the change-stream loop has not beaten for LIVENESS_TIMEOUT_SECONDS.
+"""
+from common.health import HealthState
+from config import LIVENESS_TIMEOUT_SECONDS
+from metrics import STARTUP_PHASE_SECONDS, SERVICE_READY
+
+health = HealthState(LIVENESS_TIMEOUT_SECONDS, SERVICE_READY, STARTUP_PHASE_SECONDS)
+startup_phase = health.startup_phase
+run_phases = health.run_phases
+start_health_server = health.start_server
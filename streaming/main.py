@@ -1,20 +1,30 @@
 import signal
 import sys
 import logging
-from fetcher import stream_mongo_changes, flush_and_close
+from config import METRICS_PORT
+from fetcher import init, stream_mongo_changes, flush_and_close
+from health import start_health_server
+from logger import setup_logging
 
 def signal_handler(sig, frame):
+    # Only stops the stream loop; the finally block below flushes and checkpoints once
     logging.info("Shutdown signal received, cleaning up...")
-    flush_and_close()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
     sys.exit(0)
 
 if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO)
+    setup_logging()
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
+    # Probes and metrics are served while the registry and Mongo are still connecting
+    start_health_server(METRICS_PORT)
+    logging.info(f"Metrics and health endpoints started on port {METRICS_PORT}")
 
     try:
+        init()
         stream_mongo_changes()
     except Exception as e:
         logging.error(f"Fatal error in streaming: {e}")
+    finally:
         flush_and_close()
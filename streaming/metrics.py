@@ -0,0 +1,22 @@
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+MESSAGES_DELIVERED = Counter("producer_messages_delivered_total", "Messages acknowledged by Kafka", ["topic"])
+MESSAGES_FAILED = Counter("producer_messages_failed_total", "Messages that failed delivery", ["topic", "error"])
+DELIVERY_LATENCY = Histogram(
+    "producer_delivery_latency_seconds", "Time from produce() to broker acknowledgement", ["topic"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+PRODUCED_BYTES = Counter("producer_bytes_delivered_total", "Serialized key and value bytes acknowledged by Kafka", ["topic"])
+QUEUE_DEPTH = Gauge("producer_queue_depth", "Messages waiting in the local producer queue")
+BACKPRESSURE_WAITS = Counter("producer_backpressure_waits_total", "Times produce waited on a full local queue", ["reason"])
+
+AGGREGATED_EVENTS = Counter("aggregated_hours_emitted_total", "Hour events emitted by the aggregator", ["reason"])  # complete/timeout/evicted/shutdown
+AGGREGATOR_OPEN_HOURS = Gauge("aggregator_open_hours", "Hours buffered in the aggregation window")
+CHECKPOINTS_SAVED = Counter("stream_checkpoints_saved_total", "Resume token checkpoints", ["status"])
+SNAPSHOT_DOCUMENTS = Counter("stream_snapshot_documents_total", "Documents re-emitted by snapshot catch-up")
+UNKEYED_UPDATES = Counter("stream_unkeyed_updates_total", "Projected update events skipped because their _id does not carry the document key")
+STARTUP_PHASE_SECONDS = Gauge("service_startup_phase_seconds", "Duration of each startup phase of the last start", ["phase"])
+SERVICE_READY = Gauge("service_ready", "1 while the change stream is open and events are flowing")
+
+def start_metrics_server(port):
+    start_http_server(port)
@@ -0,0 +1,47 @@
+import logging
+
+from aggregator import POLLUTANTS
+from common.curated_keys import key_from_id
+from logger import SampledLog
+from metrics import UNKEYED_UPDATES
+
+KEY_FIELDS = ["city", "timestamp", "pollutant"]
+STREAMED_FIELDS = KEY_FIELDS + ["value", "source"] + POLLUTANTS
+
+sampled = SampledLog(logging.getLogger(__name__))
+
+
+def build_watch_pipeline():
+    """Change-stream pipeline that keeps only the fields streaming needs.
+
+    Inserts and replaces carry a projected fullDocument; updates carry only
+    their changed fields plus the document key, whose _id holds the city,
+    hour and pollutant, so Mongo never has to look a document up.
+    """
+    projection = {"operationType": 1, "documentKey": 1, "wallTime": 1, "clusterTime": 1,
+                  "updateDescription.updatedFields": 1}
+    projection.update({f"fullDocument.{field}": 1 for field in STREAMED_FIELDS})
+    return [
+        {"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}},
+        {"$project": projection},
+    ]
+
+
+def change_to_document(change):
+    """Turn a projected change event into a curated document, or None to skip it.
+
+    Updates of wide documents only carry the pollutants that changed; the
+    others are left out and stay unset downstream.
+    """
+    if change["operationType"] in ("insert", "replace"):
+        return change.get("fullDocument")
+
+    doc_id = change.get("documentKey", {}).get("_id")
+    key = key_from_id(doc_id)
+    if key is None:
+        # Written before curated _ids carried the key; migrate_curated.py --rekey fixes them
+        UNKEYED_UPDATES.inc()
+        sampled.warning("unkeyed_update", f"Skipping update of {doc_id}: its _id does not carry the document key")
+        return None
+    updated = change.get("updateDescription", {}).get("updatedFields", {})
+    return {**key, **{field: value for field, value in updated.items() if field in STREAMED_FIELDS}}
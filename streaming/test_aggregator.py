@@ -0,0 +1,59 @@
+import time
+
+from aggregator import POLLUTANTS, HourAggregator
+
+
+def all_values(value=1.0):
+    return {p: value for p in POLLUTANTS}
+
+
+def test_hour_is_emitted_once_every_pollutant_arrived():
+    aggregator = HourAggregator(timeout=60, max_open=10)
+    assert aggregator.add("Nairobi", 1000, {"pm2_5": 5.0, "pm10": None}, "open-meteo", ingest_time=20) == []
+
+    ready = aggregator.add("Nairobi", 1000, {p: 2.0 for p in POLLUTANTS if p != "pm2_5"}, "open-meteo", ingest_time=10)
+    assert ready == [("Nairobi", 1000, {**all_values(2.0), "pm2_5": 5.0}, "open-meteo", 10)]
+    assert aggregator.oldest_resume_token() == (False, None)
+
+
+def test_oldest_hour_is_evicted_past_max_open():
+    aggregator = HourAggregator(timeout=60, max_open=2)
+    aggregator.add("Nairobi", 1000, {"pm2_5": 1.0}, "open-meteo")
+    aggregator.add("Nairobi", 2000, {"pm2_5": 2.0}, "open-meteo")
+
+    ready = aggregator.add("Nairobi", 3000, {"pm2_5": 3.0}, "open-meteo")
+    assert [(city, ts) for city, ts, *_ in ready] == [("Nairobi", 1000)]
+    assert ready[0][2] == {**{p: None for p in POLLUTANTS}, "pm2_5": 1.0}
+
+
+def test_expire_returns_only_hours_past_the_timeout():
+    aggregator = HourAggregator(timeout=60, max_open=10)
+    aggregator.add("Nairobi", 1000, {"pm2_5": 1.0}, "open-meteo")
+    opened = time.monotonic()
+    aggregator.open_hours[("Nairobi", 1000)]["opened"] = opened - 120
+    aggregator.add("Lagos", 1000, {"pm2_5": 1.0}, "open-meteo")
+
+    assert [(city, ts) for city, ts, *_ in aggregator.expire(now=opened)] == [("Nairobi", 1000)]
+    assert aggregator.expire(now=opened) == []
+
+
+def test_oldest_resume_token_is_the_token_before_the_oldest_open_hour():
+    aggregator = HourAggregator(timeout=60, max_open=10)
+    aggregator.add("Nairobi", 1000, {"pm2_5": 1.0}, "open-meteo", resume_token="a")
+    aggregator.add("Nairobi", 1000, {"pm10": 1.0}, "open-meteo", resume_token="b")
+    aggregator.add("Lagos", 1000, {"pm2_5": 1.0}, "open-meteo", resume_token="c")
+
+    assert aggregator.oldest_resume_token() == (True, "a")
+    aggregator.add("Nairobi", 1000, all_values(), "open-meteo")
+    assert aggregator.oldest_resume_token() == (True, "c")
+
+
+def test_drain_emits_and_clear_drops_open_hours():
+    aggregator = HourAggregator(timeout=60, max_open=10)
+    aggregator.add("Nairobi", 1000, {"pm2_5": 1.0}, "open-meteo")
+    aggregator.add("Lagos", 1000, {"pm2_5": 1.0}, "open-meteo")
+    assert [city for city, *_ in aggregator.drain()] == ["Nairobi", "Lagos"]
+
+    aggregator.add("Nairobi", 2000, {"pm2_5": 1.0}, "open-meteo")
+    aggregator.clear()
+    assert aggregator.drain() == []
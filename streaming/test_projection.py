@@ -0,0 +1,50 @@
+from bson import ObjectId
+from prometheus_client import REGISTRY
+
+from common.curated_keys import document_id
+from projection import build_watch_pipeline, change_to_document
+
+
+def unkeyed_updates():
+    return REGISTRY.get_sample_value("stream_unkeyed_updates_total") or 0
+
+
+def test_insert_returns_the_full_document():
+    doc = {"city": "Nairobi", "timestamp": "2024-01-01T00:00", "pollutant": "pm10", "value": 3.0, "source": "open-meteo"}
+    assert change_to_document({"operationType": "insert", "fullDocument": doc}) == doc
+
+
+def test_long_update_is_resolved_from_the_document_key():
+    change = {
+        "operationType": "update",
+        "documentKey": {"_id": document_id("Nairobi", "2024-01-01T00:00", "pm10")},
+        "updateDescription": {"updatedFields": {"value": 4.0, "fetched_at": "ignored"}},
+    }
+    assert change_to_document(change) == {"city": "Nairobi", "timestamp": "2024-01-01T00:00", "pollutant": "pm10", "value": 4.0}
+
+
+def test_wide_update_carries_only_the_changed_pollutants():
+    change = {
+        "operationType": "update",
+        "documentKey": {"_id": document_id("Nairobi", "2024-01-01T00:00")},
+        "updateDescription": {"updatedFields": {"ozone": 12.0, "uv_index": 2.0}},
+    }
+    assert change_to_document(change) == {"city": "Nairobi", "timestamp": "2024-01-01T00:00", "ozone": 12.0, "uv_index": 2.0}
+
+
+def test_update_of_unkeyed_document_is_skipped():
+    before = unkeyed_updates()
+    change = {
+        "operationType": "update",
+        "documentKey": {"_id": ObjectId()},
+        "updateDescription": {"updatedFields": {"value": 4.0}},
+    }
+    assert change_to_document(change) is None
+    assert unkeyed_updates() == before + 1
+
+
+def test_pipeline_keeps_the_document_key_without_a_lookup():
+    match, project = build_watch_pipeline()
+    assert match["$match"]["operationType"]["$in"] == ["insert", "update", "replace"]
+    assert project["$project"]["documentKey"] == 1
+    assert project["$project"]["updateDescription.updatedFields"] == 1
@@ -1,35 +1,70 @@
 #!/usr/bin/env python3
 
-import json
-import time
+import os
 from confluent_kafka import Producer
-from datetime import datetime
+from confluent_kafka.schema_registry import SchemaRegistryClient
+from datetime import datetime, timezone
+
+from common.avro_codec import AvroEventDecoder, AvroEventEncoder
 
 # Kafka configuration
 kafka_config = {
     'bootstrap.servers': 'localhost:9092'
 }
 
-# Create producer
-producer = Producer(kafka_config)
-
-# Create a test message
-test_message = {
-    "city": "TestCity",
-    "timestamp": int(datetime.now().timestamp() * 1000),  # Current time in milliseconds
-    "pm2_5": 25.5,
-    "pm10": 30.2,
-    "ozone": 0.05,
-    "carbon_monoxide": 1.2,
-    "nitrogen_dioxide": 15.8,
-    "sulphur_dioxide": 3.1,
-    "uv_index": 6.5,
-    "source": "test",
-    "ingest_time": int(datetime.now().timestamp() * 1000)
-}
+# The storage consumer only reads Confluent-framed Avro, so encode with the streaming service's schema
+schema_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'streaming', 'air_quality_event.avsc')
+with open(schema_path, 'r') as f:
+    schema_str = f.read()
+
+
+def build_test_message():
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    return {
+        "city": "TestCity",
+        "timestamp": now,
+        "pm2_5": 25.5,
+        "pm10": 30.25,
+        "ozone": 0.5,
+        "carbon_monoxide": 1.25,
+        "nitrogen_dioxide": 15.75,
+        "sulphur_dioxide": 3.0,
+        "uv_index": 6.5,
+        "source": "test",
+        "ingest_time": now,
+    }
+
+
+class _OfflineRegistry:
+    def register_schema(self, subject, schema):
+        return 1
+
+    def get_schema(self, schema_id):
+        return type("RegisteredSchema", (), {"schema_str": schema_str})()
+
+
+def test_message_matches_consumer_schema():
+    """The smoke-test message decodes in the storage consumer exactly as it was sent"""
+    registry = _OfflineRegistry()
+    encoder = AvroEventEncoder(schema_str, registry, 'air_quality_events-value')
+    message = build_test_message()
+    assert AvroEventDecoder(registry).decode(encoder.encode(message)) == message
+
+
+def main():
+    schema_registry_client = SchemaRegistryClient({'url': 'http://localhost:8081'})
+    encoder = AvroEventEncoder(schema_str, schema_registry_client, 'air_quality_events-value')
+
+    # Create producer
+    producer = Producer(kafka_config)
+
+    # Send a test message
+    test_message = build_test_message()
+    producer.produce('air_quality_events', key='test_key', value=encoder.encode(test_message))
+    producer.flush()
+
+    print(f"Sent test message: {test_message}")
 
-# Send the message
-producer.produce('air_quality_events', key='test_key', value=json.dumps(test_message))
-producer.flush()
 
-print(f"Sent test message: {test_message}")
+if __name__ == "__main__":
+    main()